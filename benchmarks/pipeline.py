@@ -0,0 +1,201 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+from time import perf_counter
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import commands  # noqa: E402
+import db  # noqa: E402
+from models import PointsType  # noqa: E402
+from services.donation_alerts import DonationAlerts  # noqa: E402
+from services.factorio import FactorioBot  # noqa: E402
+from services.factorio.scheduler import EffectScheduler  # noqa: E402
+from services.trovo import TrovoChat  # noqa: E402
+from services.twitch import TwitchBot  # noqa: E402
+
+# Replays chat traffic through the real handlers: TrovoChat._process_message, TwitchBot._on_message
+# and DonationAlerts._on_donation, then commands.trigger_commands and db.add_points.
+# Platform clients and rcon are local fakes, nothing leaves the process.
+# Run: python benchmarks/pipeline.py [--messages 5000] [--trovo-frames recorded.jsonl]
+
+viewers = 300
+texts = ['hello', 'gg', '!points', '!p', '!biters', '!hotpotato', '!help', 'lol what', '!очки', '!queue']
+
+
+class FakeRcon:
+    def __init__(self):
+        self.executed = 0
+
+    async def execute(self, cmd: str) -> str:
+        self.executed += 1
+        return ''
+
+
+class FakeBatcher:
+    def __init__(self):
+        self.calls = 0
+
+    async def call(self, name: str, *args):
+        self.calls += 1
+
+
+class Pipeline:
+    def __init__(self):
+        self.trovo = TrovoChat('client', 'secret', 'http://localhost')
+        self.trovo.message_queue.maxsize = sys.maxsize  # nothing drains it here
+        self.twitch = TwitchBot('client', 'secret', 'http://localhost:8000', 'channel')
+        self.twitch.message_queue.maxsize = sys.maxsize
+        self.alerts = DonationAlerts('token', announce_bot=self.trovo)
+
+        self.factorio = FactorioBot('127.0.0.1', 0, '', 'streamer')
+        self.factorio.client = FakeRcon()
+        self.factorio.batcher = FakeBatcher()
+        # effects are not rate limited in the replay, only the dispatch cost is measured
+        self.factorio.scheduler = EffectScheduler({}, rate=1e9, burst=10 ** 9, default_limit=(1e9, 10 ** 9))
+        commands.enable_module('factorio')
+
+        for i in range(viewers):
+            for name, kwargs in ((f'trovo{i}', {'trovo_id': 1000 + i}), (f'twitch{i}', {'twitch_id': 5000 + i})):
+                db.add_points(db.find_user(name, **kwargs), 10 ** 9, PointsType.Mana, source='replay')
+
+    async def handle(self, event: tuple):
+        kind, payload = event
+        match kind:
+            case 'trovo':
+                self.trovo._process_message(payload)
+            case 'twitch':
+                await self.twitch._on_message(payload)
+            case 'donation':
+                await self.alerts._on_donation(payload)
+
+    def messages(self, event: tuple) -> int:
+        kind, payload = event
+        return len(payload.data.get('chats', ())) if kind == 'trovo' else 1
+
+
+def synthetic_events(count: int, seed: int = 1) -> list[tuple]:
+    from services.trovo._frames import decode_frame
+
+    rnd = random.Random(seed)
+    events = []
+    for i in range(count):
+        roll = rnd.random()
+        if roll < 0.6:
+            chats = [{
+                'type': 0,
+                'content': rnd.choice(texts),
+                'nick_name': f'trovo{(viewer := rnd.randrange(viewers))}',
+                'sender_id': 1000 + viewer,
+                'send_time': 1,
+                'roles': ['follower'],
+                'medals': []
+            } for _ in range(rnd.randint(1, 3))]
+            events.append(('trovo', decode_frame(json.dumps({'type': 'CHAT', 'data': {'chats': chats}}))))
+        elif roll < 0.95:
+            viewer = rnd.randrange(viewers)
+            events.append(('twitch', SimpleNamespace(
+                text=rnd.choice(texts),
+                user=SimpleNamespace(name=f'twitch{viewer}', id=str(5000 + viewer), badges={'subscriber': '1'})
+            )))
+        else:
+            events.append(('donation', json.dumps({
+                'id': i,
+                'alert_type': '1',
+                'additional_data': '{}',
+                'username': f'trovo{rnd.randrange(viewers)}',
+                'amount': '100',
+                'amount_main': 100,
+                'date_created': '2024-01-01 12:00:00',
+                '_is_test_alert': False
+            })))
+    return events
+
+
+def recorded_events(path: str) -> list[tuple]:
+    # one raw Trovo websocket frame per line, e.g. cut from a services.trovo.frames debug log
+    from services.trovo._frames import decode_frame
+
+    with open(path, encoding='utf-8') as f:
+        return [('trovo', decode_frame(line)) for line in f if line.strip()]
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def replay(events: list[tuple]) -> dict:
+    pipeline = Pipeline()
+    messages = sum(pipeline.messages(event) for event in events)
+
+    # one event at a time, until its commands are done
+    latencies = []
+    for event in events:
+        start = perf_counter()
+        await pipeline.handle(event)
+        await commands.wait_commands()
+        latencies.append(perf_counter() - start)
+
+    # everything at once, as a burst after a raid would arrive
+    start = perf_counter()
+    for event in events:
+        await pipeline.handle(event)
+    await commands.wait_commands()
+    burst = perf_counter() - start
+
+    tracemalloc.start()
+    for event in events:
+        await pipeline.handle(event)
+    await commands.wait_commands()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'events': len(events),
+        'messages': messages,
+        'sequential_per_sec': messages / sum(latencies),
+        'burst_per_sec': messages / burst,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'alloc_peak_kib': peak / 1024,
+        'alloc_retained_kib': current / 1024,
+        'rcon_calls': pipeline.factorio.batcher.calls + pipeline.factorio.client.executed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=5000, help='synthetic events to replay')
+    parser.add_argument('--trovo-frames', help='file with recorded Trovo frames, one per line')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    events = recorded_events(args.trovo_frames) if args.trovo_frames else synthetic_events(args.messages)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        db.init(interval=60)
+        try:
+            result = asyncio.run(replay(events))
+        finally:
+            db.close()
+            commands.disable_module('factorio')
+
+    print(f'{result["messages"]} messages in {result["events"]} events, {result["rcon_calls"]} rcon calls')
+    print(f'sequential: {result["sequential_per_sec"]:,.0f} msg/s, '
+          f'p50 {result["p50_ms"]:.3f} ms, p99 {result["p99_ms"]:.3f} ms')
+    print(f'burst:      {result["burst_per_sec"]:,.0f} msg/s')
+    print(f'allocations: peak {result["alloc_peak_kib"]:,.0f} KiB, retained {result["alloc_retained_kib"]:,.0f} KiB')
+
+
+if __name__ == '__main__':
+    main()
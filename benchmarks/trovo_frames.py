@@ -0,0 +1,89 @@
+import json
+import logging
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.trovo._chat_message import TrovoChatMessage  # noqa: E402
+from services.trovo._chat_socket_message import TrovoChatSocketMessage  # noqa: E402
+from services.trovo._frames import decode_frame, new_chats, orjson  # noqa: E402
+
+# Decoding of Trovo CHAT frames: the path before the change against decode_frame + new_chats.
+# Run: python benchmarks/trovo_frames.py
+
+_log = logging.getLogger('benchmark')
+start_time = 1_700_000_000
+
+
+def chat_entry(i: int, send_time: int) -> dict:
+    return {
+        'type': random.choice([0, 0, 0, 5, 5004]),
+        'content': f'message number {i} !points',
+        'nick_name': f'viewer{i % 500}',
+        'avatar': f'https://headicon.trovo.live/user/{i % 500}.png',
+        'sub_tier': '1',
+        'medals': ['sub_tier1', 'ace'],
+        'roles': ['follower', 'subscriber'],
+        'message_id': f'{i:032x}',
+        'sender_id': 100000 + i % 500,
+        'send_time': send_time,
+        'uid': 100000 + i % 500,
+        'user_name': f'viewer{i % 500}',
+        'content_data': {'normal_emote_enabled': True}
+    }
+
+
+def recorded_frames() -> list[str]:
+    # one history frame after connect, then live frames with a few messages each
+    frames = [json.dumps({'type': 'CHAT', 'channel_info': {'channel_id': '42'}, 'data': {
+        'eid': '0', 'chats': [chat_entry(i, start_time - 600 + i) for i in range(50)]
+    }})]
+    for i in range(500):
+        chats = [chat_entry(i * 3 + j, start_time + i) for j in range(random.randint(1, 3))]
+        frames.append(json.dumps({'type': 'CHAT', 'data': {'eid': str(i), 'chats': chats}}))
+    return frames
+
+
+def old_path(frames: list[str]) -> int:
+    count = 0
+    for data in frames:
+        _log.debug(f'Response: {data}')
+        obj = json.loads(data)
+        raw_msg = TrovoChatSocketMessage(str(obj.get('type')), str(obj.get('nonce', '')),
+                                         str(obj.get('error', None)), dict(obj.get('data', {})))
+        for raw_chat_msg in raw_msg.data.get('chats', []):
+            msg = TrovoChatMessage.from_dict(raw_chat_msg)
+            msg.medals, msg.roles = list(msg.medals), list(msg.roles)  # copies from_dict used to make
+            if msg.send_time >= start_time:
+                count += 1
+            else:
+                _log.debug(f'Old message "{msg.content}" ignored')
+    return count
+
+
+def new_path(frames: list[str]) -> int:
+    count = 0
+    for data in frames:
+        _log.debug('Response: %s', data)
+        chats, _ = new_chats(decode_frame(data), start_time)
+        count += len(chats)
+    return count
+
+
+def main():
+    random.seed(1)
+    logging.basicConfig(level=logging.INFO)
+    frames = recorded_frames()
+    assert old_path(frames) == new_path(frames)
+
+    print(f'{len(frames)} frames, orjson: {"yes" if orjson else "no"}')
+    for name, path in (('old', old_path), ('new', new_path)):
+        best = min(timeit.repeat(lambda: path(frames), number=20, repeat=5)) / 20
+        print(f'{name}: {best * 1000:.2f} ms per pass, {len(frames) / best:,.0f} frames/s')
+
+
+if __name__ == '__main__':
+    main()
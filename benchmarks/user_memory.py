@@ -0,0 +1,48 @@
+import gc
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models import UserData  # noqa: E402
+
+# Memory held by 100k users: the slotted UserData against the plain dataclass it replaced.
+# Run: python benchmarks/user_memory.py
+
+count = 100_000
+
+
+@dataclass
+class PlainUserData:
+    name: str
+    mana: int
+    elixir: int
+    trovo_id: int
+    twitch_id: int
+
+
+def measure(cls) -> int:
+    # names are created up front, they take the same space with either class
+    names = [f'viewer{i}' for i in range(count)]
+    gc.collect()
+    tracemalloc.start()
+    users = [cls(names[i], i % 1000, i % 300, 100000 + i, -1) for i in range(count)]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del users
+    return size
+
+
+def main():
+    plain = measure(PlainUserData)
+    slotted = measure(UserData)
+    print(f'{count:,} users')
+    print(f'plain dataclass: {plain / 2 ** 20:.1f} MiB, {plain / count:.0f} bytes per user')
+    print(f'slotted:         {slotted / 2 ** 20:.1f} MiB, {slotted / count:.0f} bytes per user')
+    print(f'saved:           {(plain - slotted) / 2 ** 20:.1f} MiB ({1 - slotted / plain:.0%})')
+
+
+if __name__ == '__main__':
+    main()
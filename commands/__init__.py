@@ -1,13 +1,16 @@
 from .commands import (
     command,
     command_prefix,
+    bind,
     enable_module,
     disable_module,
     trigger_commands,
+    wait_commands,
     help_command,
     commands,
     active_modules
 )
 from .points import add_ep_command, add_mp_command, points_command
+from .link import link_command, merge_command
 from .timer import timer_command
 from .beep import beep_command
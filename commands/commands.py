@@ -1,7 +1,12 @@
+import asyncio
+import contextlib
 import logging
 import traceback
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
 import db
+import metrics
 from models import ChatMessage, ChatBot, PointsType
 
 _log = logging.getLogger(__name__)
@@ -10,22 +15,57 @@ command_prefix = '!'
 commands = []
 active_modules = ['base']
 
+# sync handlers run here, so blocking rcon or http calls don't stall the chat loops
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='command')
+_running: set[asyncio.Task] = set()
+_loop: asyncio.AbstractEventLoop or None = None  # commands of every platform run here, see bind()
+
+# '!name' and '!alias' -> commands, only for active modules.
+# Tuples are replaced, not mutated, so a command may toggle modules while being dispatched.
+_dispatch_table: dict[str, tuple] = {}
+
 
 def enable_module(name: str):
+    if name in active_modules:
+        return
     active_modules.append(name)
+    for cmd in commands:
+        if cmd.module == name:
+            _add_to_dispatch_table(cmd)
 
 
 def disable_module(name: str):
     if name in active_modules:
         active_modules.remove(name)
+        for cmd in commands:
+            if cmd.module == name:
+                _remove_from_dispatch_table(cmd)
+
+
+def _add_to_dispatch_table(cmd):
+    for key in cmd.keys:
+        _dispatch_table[key] = (*_dispatch_table.get(key, ()), cmd)
+
+
+def _remove_from_dispatch_table(cmd):
+    for key in cmd.keys:
+        handlers = tuple(handler for handler in _dispatch_table.get(key, ()) if handler is not cmd)
+        if handlers:
+            _dispatch_table[key] = handlers
+        else:
+            _dispatch_table.pop(key, None)
 
 
 def command(name: str, *, aliases=None, owner_only=False, roles_required=None,
-            elixir: int = 0, mana: int = 0, module: str = 'base'):
+            elixir: int = 0, mana: int = 0, module: str = 'base',
+            timeout: float or None = 30, concurrency: int = 0):
     if aliases is None:
         aliases = []
 
     def decorator(func):
+        is_async = asyncio.iscoroutinefunction(func)
+        limiter = asyncio.Semaphore(concurrency) if concurrency > 0 else contextlib.nullcontext()
+
         def can_execute(msg: ChatMessage) -> bool:
             if module not in active_modules:
                 return False
@@ -41,41 +81,68 @@ def command(name: str, *, aliases=None, owner_only=False, roles_required=None,
 
             return True
 
-        def wrapper(msg: ChatMessage, bot: ChatBot):
+        async def wrapper(msg: ChatMessage, bot: ChatBot):
             user = msg.sender
             username = user.name
 
-            def has_pay() -> bool:
-                if user.mana >= mana >= 0 or user.elixir >= elixir >= 0:
-                    return True
+            def charge() -> tuple[int, PointsType] or None:
+                if mana > 0 and db.spend(user, mana, PointsType.Mana, source=f'command:{name}'):
+                    return mana, PointsType.Mana
+                elif elixir > 0 and db.spend(user, elixir, PointsType.Elixir, source=f'command:{name}'):
+                    return elixir, PointsType.Elixir
+                return None
 
+            def refuse_payment():
                 if mana > 0 and elixir > 0:
                     bot.send_message(f"@{username} не хватает ({elixir} ep или {mana} mp)")
                 elif elixir > 0:
                     bot.send_message(f"@{username} не хватает ({elixir} ep)")
                 elif mana > 0:
                     bot.send_message(f"@{username} не хватает ({mana} mp)")
-
                 _log.debug(f'Can\'t pay for trigger command "{name}": {msg.text} by {username}')
-                return False
 
-            prefix = msg.text.split(maxsplit=1)[0].lower()
-            if any([cmd for cmd in [*aliases, name] if prefix == command_prefix + cmd]):
-                if can_execute(msg) and has_pay():
-                    _log.debug(f'Trigger command "{name}": {msg.text} by {username}')
-                    try:
-                        func(msg, bot)
-
-                        if user.mana >= mana > 0:
-                            db.add_points(user, -mana, PointsType.Mana)
-                        elif user.elixir >= elixir > 0:
-                            db.add_points(user, -elixir, PointsType.Elixir)
-
-                    except Exception as e:
-                        _log.error(f'Error during execute {name} by {username}: {e}')
-                        _log.debug(traceback.format_exc())
+            if not can_execute(msg):
+                _log.debug(f'Reject command "{name}": {msg.text} by {username} (no privileges)')
+                metrics.inc('commands_total', command=name, result='rejected')
+                return
+
+            # pay before awaiting, so parallel commands of one user can't spend the same points twice.
+            # the balance is checked by the charge itself, it may change up to the last moment
+            payment = charge()
+            if not payment and (mana > 0 or elixir > 0):
+                refuse_payment()
+                metrics.inc('commands_total', command=name, result='rejected')
+                return
+            _log.debug(f'Trigger command "{name}": {msg.text} by {username}')
+            start = perf_counter()
+            try:
+                async with limiter:
+                    if is_async:
+                        await asyncio.wait_for(func(msg, bot), timeout)
+                    else:
+                        loop = asyncio.get_running_loop()
+                        await asyncio.wait_for(loop.run_in_executor(_executor, func, msg, bot), timeout)
+                metrics.inc('commands_total', command=name, result='ok')
+
+            except Exception as e:
+                metrics.inc('commands_total', command=name,
+                            result='timeout' if isinstance(e, asyncio.TimeoutError) else 'error')
+                if isinstance(e, asyncio.TimeoutError) and not is_async:
+                    # the handler keeps running in its thread and may still apply the effect, no refund
+                    _log.error(f'Timeout during execute {name} by {username}, the handler is still running')
+                    return
+                if isinstance(e, asyncio.TimeoutError):
+                    _log.error(f'Timeout during execute {name} by {username}')
                 else:
-                    _log.debug(f'Reject command "{name}": {msg.text} by {username} (no privileges)')
+                    _log.error(f'Error during execute {name} by {username}: {e}')
+                    _log.debug(traceback.format_exc())
+
+                if payment:
+                    amount, points_type = payment
+                    db.add_points(user, amount, points_type, source=f'command:{name}:refund')
+                    bot.send_message(f'@{username} {command_prefix}{name} не сработала, очки возвращены')
+            finally:
+                metrics.observe('command_seconds', perf_counter() - start, command=name)
 
         if not hasattr(wrapper, 'registered') or wrapper.registered is False:
             wrapper.registered = True
@@ -83,7 +150,10 @@ def command(name: str, *, aliases=None, owner_only=False, roles_required=None,
             wrapper.help_text = command_prefix + name
             wrapper.name = name
             wrapper.module = module
+            wrapper.keys = list(dict.fromkeys((command_prefix + cmd).lower() for cmd in [name, *aliases]))
             commands.append(wrapper)
+            if module in active_modules:
+                _add_to_dispatch_table(wrapper)
         return wrapper
 
     return decorator
@@ -130,10 +200,47 @@ def disable_module_command(msg: ChatMessage, bot: ChatBot):
     bot.send_message(f'Module {module} off')
 
 
+def bind():
+    # twitchAPI delivers messages on its own loop in another thread, their commands are handed
+    # over to this one, so rcon, the scheduler and the batcher only ever see one loop
+    global _loop
+    _loop = asyncio.get_running_loop()
+
+
 def trigger_commands(msg: ChatMessage, bot: ChatBot):
-    for cmd in commands:
-        try:
-            cmd(msg, bot)
-        except Exception as e:
-            _log.warning(f'Trigger command {cmd.name} by {msg.sender.name} is failed: {e}')
-            _log.debug(traceback.format_exc())
+    if not msg.text.startswith(command_prefix):
+        return
+
+    prefix = msg.text.split(maxsplit=1)[0].lower()
+    for cmd in _dispatch_table.get(prefix, ()):
+        if _loop and not _loop.is_closed() and _current_loop() is not _loop:
+            _loop.call_soon_threadsafe(_start_command, cmd, msg, bot)
+        else:
+            _start_command(cmd, msg, bot)
+
+
+def _current_loop() -> asyncio.AbstractEventLoop or None:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _start_command(cmd, msg: ChatMessage, bot: ChatBot):
+    task = asyncio.get_running_loop().create_task(cmd(msg, bot), name=f'command:{cmd.name}')
+    _running.add(task)
+    task.add_done_callback(_on_command_done)
+
+
+def _on_command_done(task: asyncio.Task):
+    _running.discard(task)
+    if not task.cancelled() and task.exception():
+        e = task.exception()
+        _log.warning(f'Trigger {task.get_name()} is failed: {e}')
+        _log.debug(''.join(traceback.format_exception(e)))
+
+
+async def wait_commands():
+    loop = asyncio.get_running_loop()
+    while tasks := [task for task in _running if task.get_loop() is loop]:
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,64 @@
+import logging
+from time import monotonic
+
+import db
+from commands import command
+from models import ChatMessage, ChatBot, UserData
+
+_log = logging.getLogger(__name__)
+
+link_timeout = 300  # seconds the other platform has to answer a !link
+# (nick, nick on the other platform) -> a !link waiting for the other side
+_pending: dict[tuple[str, str], tuple[UserData, ChatBot, float]] = {}
+
+
+# A viewer links its Twitch and Trovo accounts by naming each other from both sides:
+# !link trovo_nick on Twitch, then !link twitch_nick on Trovo. Nobody can claim an account it can't chat from.
+@command('link', aliases=['связать'])
+async def link_command(msg: ChatMessage, bot: ChatBot):
+    args = msg.text.split()
+    if len(args) < 2:
+        return
+
+    name, other = msg.sender.name, args[1].removeprefix('@')
+    now = monotonic()
+    for key in [key for key, (_, _, at) in _pending.items() if now - at > link_timeout]:
+        del _pending[key]
+
+    request = _pending.get((other.casefold(), name.casefold()))
+    if not request or request[1] is bot:
+        _pending[(name.casefold(), other.casefold())] = (msg.sender, bot, now)
+        bot.send_message(f'@{name} now send !link {name} from {other} on the other platform')
+        return
+
+    del _pending[(other.casefold(), name.casefold())]
+    target, target_bot, _ = request
+    try:
+        db.merge(msg.sender, target)
+    except ValueError as e:
+        bot.send_message(f'@{name} can\'t link: {e}')
+        return
+    _log.info(f'Linked {name} and {target.name}')
+    bot.send_message(f'@{name} linked with {target.name}: {target.mana} mp, {target.elixir} ep')
+
+
+# !merge from to, e.g. a donation nick into the viewer, later donations under it go there too
+@command('merge', owner_only=True)
+async def merge_command(msg: ChatMessage, bot: ChatBot):
+    args = msg.text.split()
+    if len(args) < 3:
+        return
+
+    source_name, target_name = args[1].removeprefix('@'), args[2].removeprefix('@')
+    source = db.get_user(source_name, **await bot.user_ids(source_name))
+    target = db.get_user(target_name, **await bot.user_ids(target_name))
+    if not source or not target:
+        bot.send_message(f'Unknown user {target_name if source else source_name}')
+        return
+
+    try:
+        db.merge(source, target)
+    except ValueError as e:
+        bot.send_message(f'Can\'t merge: {e}')
+        return
+    bot.send_message(f'{source.name} merged into {target.name}: {target.mana} mp, {target.elixir} ep')
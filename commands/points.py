@@ -4,25 +4,27 @@ from models import PointsType, ChatBot, ChatMessage
 
 
 @command('addmp', owner_only=True)
-def add_mp_command(msg: ChatMessage, bot: ChatBot):
+async def add_mp_command(msg: ChatMessage, bot: ChatBot):
     args = msg.text.split()
     if len(args) > 2:
-        user = db.find_user(args[1].removeprefix('@'))
+        username = args[1].removeprefix('@')
+        user = db.find_user(username, **await bot.user_ids(username))
         quantity = int(args[2])
-        db.add_points(user, quantity, PointsType.Mana, bot=bot)
+        db.add_points(user, quantity, PointsType.Mana, bot=bot, source=f'addmp:{msg.sender.name}')
 
 
 @command('addep', owner_only=True)
-def add_ep_command(msg: ChatMessage, bot: ChatBot):
+async def add_ep_command(msg: ChatMessage, bot: ChatBot):
     args = msg.text.split()
     if len(args) > 2:
-        user = db.find_user(args[1].removeprefix('@'))
+        username = args[1].removeprefix('@')
+        user = db.find_user(username, **await bot.user_ids(username))
         quantity = int(args[2])
-        db.add_points(user, quantity, PointsType.Elixir, bot=bot)
+        db.add_points(user, quantity, PointsType.Elixir, bot=bot, source=f'addep:{msg.sender.name}')
 
 
 @command('points', aliases=['p', 'очки'])
-def points_command(msg: ChatMessage, bot: ChatBot):
+async def points_command(msg: ChatMessage, bot: ChatBot):
     username = None
 
     if msg.roles.__contains__('streamer'):
@@ -32,7 +34,7 @@ def points_command(msg: ChatMessage, bot: ChatBot):
             username = username.removeprefix('@')
 
     if username:
-        user = db.find_user(username)
+        user = db.find_user(username, **await bot.user_ids(username))
     else:
         user = msg.sender
 
@@ -1,50 +1,171 @@
+import asyncio
 import logging
-import time
-from threading import Thread, Timer
+import os
+import re
+from time import monotonic
 
 import db
 from commands import command
 from models import ChatMessage, ChatBot
+from services import events
 
 _log = logging.getLogger(__name__)
 
+default_timer = 'timer'
+_name_pattern = re.compile(r'[a-z0-9_-]{1,32}')
+_file_pattern = re.compile(r'timer(_[a-z0-9_-]{1,32})?\.txt')
+
 
 class Countdown:
-    target_time = 0
-    thread: Thread = None
+    hold = 5  # seconds 00:00 stays on screen before the timer is cleared
+
+    def __init__(self, name: str):
+        self.name = name
+        self.filename = 'timer.txt' if name == default_timer else f'timer_{name}.txt'
+        self.text = ''
+        self.target_time = 0.0
+        self._task: asyncio.Task or None = None
+        self._subscribers: dict[asyncio.Queue, asyncio.AbstractEventLoop] = {}  # queue -> the loop it belongs to
 
     def start(self, seconds: float):
-        self.target_time = time.time() + seconds
+        self.target_time = monotonic() + seconds
+        if self._task:
+            self._task.cancel()
+        self._task = asyncio.create_task(self._run(), name=f'timer:{self.name}')
+
+    def stop(self):
+        self.target_time = monotonic() - self.hold
+        if self._task:
+            self._task.cancel()
+        self._task = asyncio.create_task(self._show(''))
 
-        if not self.thread:
-            self.thread = Thread(target=self._loop)
-            self.thread.start()
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=1)
+        queue.put_nowait(self.text)
+        self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
 
-    def _loop(self):
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.pop(queue, None)
+
+    async def _run(self):
         while True:
-            seconds = self.target_time - time.time()
-            if seconds < -5:
-                return
+            remaining = self.target_time - monotonic()
+            if remaining < -self.hold:
+                break
+
+            m, s = divmod(int(remaining), 60) if remaining > 0 else (0, 0)
+            await self._show(f'{m:02d}:{s:02d}')
+            # sleep until the shown second changes instead of polling
+            await asyncio.sleep(remaining % 1 + 0.001 if remaining > 0 else remaining + self.hold + 0.001)
 
-            if seconds > 0:
-                m, s = divmod(int(seconds), 60)
+        await self._show('')
+
+    async def _show(self, text: str):
+        if text == self.text:
+            return
+        self.text = text
+        await asyncio.to_thread(db.save, self.filename, text)
+        events.publish('timer', name=self.name, text=text)
+        loop = asyncio.get_running_loop()
+        for queue, queue_loop in list(self._subscribers.items()):
+            # asyncio queues are not thread-safe, each is filled on its own loop
+            if queue_loop is loop:
+                self._offer(queue, text)
             else:
-                m, s = 0, 0
+                queue_loop.call_soon_threadsafe(self._offer, queue, text)
+
+    @staticmethod
+    def _offer(queue: asyncio.Queue, text: str):
+        # overlays only need the latest value, a slow one skips the stale text
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(text)
+
+
+_timers: dict[str, Countdown] = {}
+
 
-            db.save('timer.txt', '{:02d}:{:02d}'.format(m, s))
-            time.sleep(0.5)
+def get_timer(name: str = default_timer) -> Countdown:
+    if name not in _timers:
+        _timers[name] = Countdown(name)
+    return _timers[name]
 
 
-_timer = Countdown()
-db.save('timer.txt', '')
+def clear_files():
+    # at startup, OBS would show the last countdown of the previous run until a timer ticks
+    filenames = {get_timer().filename}
+    if os.path.isdir('data'):
+        filenames.update(filename for filename in os.listdir('data') if _file_pattern.fullmatch(filename))
+    for filename in sorted(filenames):
+        db.save(filename, '')
 
 
+# !timer 300, !timer break 600, !timer break 0 to stop
 @command('timer', owner_only=True)
-def timer_command(msg: ChatMessage, bot: ChatBot):
+async def timer_command(msg: ChatMessage, bot: ChatBot):
     args = msg.text.split()
     if len(args) < 2:
         return
 
-    seconds = float(args[1])
-    _timer.start(seconds)
-    _log.debug(f'Run countdown timer on {seconds} sec')
+    name, value = (default_timer, args[1]) if len(args) == 2 else (args[1].lower(), args[2])
+    if not _name_pattern.fullmatch(name):
+        bot.send_message(f'Bad timer name {name}')
+        return
+
+    seconds = float(value)
+    if seconds > 0:
+        get_timer(name).start(seconds)
+        _log.debug(f'Run countdown timer {name} on {seconds} sec')
+    else:
+        get_timer(name).stop()
+        _log.debug(f'Stop countdown timer {name}')
+
+
+_overlay_page = '''<!DOCTYPE html>
+<html><head><meta charset="utf-8"><style>
+body {{ margin: 0; background: transparent; color: white; font: bold 64px sans-serif; text-shadow: 0 0 6px black; }}
+</style></head><body><div id="timer"></div><script>
+new EventSource('/timers/{name}').onmessage = e => document.getElementById('timer').textContent = e.data;
+</script></body></html>
+'''
+
+
+# OBS browser source: http://127.0.0.1:<port>/timers/<name>/overlay, or any SSE client on /timers/<name>
+async def serve_overlay(host: str = '127.0.0.1', port: int = 8765):
+    from aiohttp import web
+
+    def timer_name(request) -> str:
+        name = request.match_info['name']
+        if not _name_pattern.fullmatch(name):
+            raise web.HTTPNotFound()
+        return name
+
+    async def overlay(request):
+        return web.Response(text=_overlay_page.format(name=timer_name(request)), content_type='text/html')
+
+    async def stream(request):
+        timer = get_timer(timer_name(request))
+        response = web.StreamResponse(headers={'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache'})
+        await response.prepare(request)
+        queue = timer.subscribe()
+        try:
+            while True:
+                await response.write(f'data: {await queue.get()}\n\n'.encode())
+        except ConnectionError:
+            pass
+        finally:
+            timer.unsubscribe(queue)
+        return response
+
+    app = web.Application()
+    app.router.add_get('/timers/{name}', stream)
+    app.router.add_get('/timers/{name}/overlay', overlay)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _log.info(f'Timer overlay on http://{host}:{port}/timers/{default_timer}/overlay')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
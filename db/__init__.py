@@ -0,0 +1,405 @@
+import asyncio
+import logging
+import os
+import threading
+import traceback
+from functools import partial
+
+import metrics
+from models import PointsType, UserData, ChatBot
+from . import backups
+from .files import save, load
+from .json_storage import JsonStorage
+from .sqlite_storage import SqliteStorage
+
+_log = logging.getLogger(__name__)
+
+users_filename = 'users.json'
+ledger_dir = 'data/ledger'
+sqlite_path = 'data/users.sqlite3'
+aliases_filename = 'aliases.json'
+users: list[UserData] = []
+
+# a user is identified by its (platform, platform id) accounts, the name index is for lookups
+# without an id (donations, streamer commands) and keeps the first user seen with a nick
+_users_by_account: dict[tuple[str, int], UserData] = {}
+_users_by_name: dict[str, UserData] = {}
+_aliases: dict[str, str] = {}  # merged away nick -> ledger key of the user it was merged into
+_merged: dict[int, tuple[UserData, UserData]] = {}  # id of a merged user -> (it, where it went)
+_aliases_changed = False
+
+flush_interval = 5.0
+flush_threshold = 50
+
+_lock = threading.RLock()
+_write_lock = threading.Lock()
+_dirty_count = 0
+_dirty: dict[int, UserData] = {}
+_flush_event = threading.Event()
+_stop_event = threading.Event()
+_flusher: threading.Thread or None = None
+_storage: JsonStorage or SqliteStorage or None = None
+_ready = threading.Event()
+_ready.set()  # cleared only while init_in_background is loading users
+
+
+def init(*, engine: str = 'json', interval: float = None, threshold: int = None):
+    global users, flush_interval, flush_threshold, _flusher, _storage, _dirty_count
+    if interval is not None:
+        flush_interval = interval
+    if threshold is not None:
+        flush_threshold = threshold
+
+    if _storage:
+        _storage.close()
+
+    match engine:
+        case 'json':
+            _storage = JsonStorage(users_filename, ledger_dir)
+        case 'sqlite':
+            _storage = SqliteStorage(sqlite_path, import_from=JsonStorage(users_filename, ledger_dir))
+        case _:
+            raise ValueError(f'Unknown db engine {engine}')
+
+    users = _storage.open()
+
+    _users_by_account.clear()
+    _users_by_name.clear()
+    _merged.clear()
+    for user in users:
+        _index_user(user)
+    _aliases.clear()
+    if os.path.exists(f'data/{aliases_filename}'):
+        _aliases.update(load(aliases_filename))
+    _aliases.update(_storage.aliases)
+
+    _dirty.clear()
+    _dirty_count = _storage.replayed
+    if _storage.replayed:
+        _dirty.update((id(usr), usr) for usr in users)
+
+    if not _flusher:
+        _stop_event.clear()
+        _flusher = threading.Thread(target=_flush_loop, name='db-flusher', daemon=True)
+        _flusher.start()
+
+
+def init_in_background(**kwargs) -> asyncio.Future:
+    # services connect meanwhile, find_user waits until the users are loaded
+    _ready.clear()
+    return asyncio.get_running_loop().run_in_executor(None, partial(_init_and_set_ready, **kwargs))
+
+
+async def wait_ready():
+    # for the receive loops, find_user itself would block the loop while users load
+    if not _ready.is_set():
+        await asyncio.get_running_loop().run_in_executor(None, _ready.wait)
+
+
+def _init_and_set_ready(**kwargs):
+    try:
+        init(**kwargs)
+    finally:
+        _ready.set()
+
+
+def close():
+    global _flusher, _storage
+    if _flusher:
+        _stop_event.set()
+        _flush_event.set()
+        _flusher.join()
+        _flusher = None
+    flush()
+    if _storage:
+        _storage.close()
+        _storage = None
+
+
+def flush():
+    global _dirty_count, _aliases_changed
+    with _write_lock:
+        with _lock:
+            aliases = dict(_aliases) if _aliases_changed else None
+            _aliases_changed = False
+        if aliases is not None:
+            save(aliases_filename, aliases)
+
+        with _lock:
+            if _dirty_count == 0 or not _storage:
+                return
+            count = _dirty_count
+            data = _storage.snapshot(users, list(_dirty.values()))
+            _dirty_count = 0
+            _dirty.clear()
+
+        with metrics.timer('db_flush_seconds'):
+            _storage.write(data)
+        _log.debug(f'Flushed {count} changes')
+
+        with _lock:
+            _storage.compact()
+
+
+def _flush_loop():
+    while not _stop_event.is_set():
+        _flush_event.wait(flush_interval)
+        _flush_event.clear()
+        flush()
+
+
+def _mark_dirty(user: UserData):
+    global _dirty_count
+    with _lock:
+        _dirty[id(user)] = user
+        _dirty_count += 1
+        if _dirty_count >= flush_threshold:
+            _flush_event.set()
+
+
+def _index_user(user: UserData):
+    # setdefault keeps the first match, same as the old linear scan did
+    _users_by_name.setdefault(user.name.casefold(), user)
+    for account in user.accounts():
+        _users_by_account.setdefault(account, user)
+
+
+def _attach_ids(user: UserData, trovo_id: int, twitch_id: int) -> bool:
+    # only a user without any account yet, e.g. one made by a donation, takes the ids of its nick
+    if user.accounts():
+        return False
+
+    old_key = user.keys()[0]
+    attached = False
+    for account in _accounts(trovo_id, twitch_id):
+        # the sqlite engine has users on disk that aren't loaded yet
+        if account not in _users_by_account and not (_storage and _storage.has_account(*account)):
+            platform, platform_id = account
+            setattr(user, f'{platform}_id', platform_id)
+            _users_by_account[account] = user
+            attached = True
+    if attached and _storage:
+        # later records are keyed by the account, the snapshot still has the nick
+        _storage.record_identity(old_key, user)
+    return attached
+
+
+def _accounts(trovo_id: int, twitch_id: int) -> list[tuple[str, int]]:
+    return UserData('', 0, 0, trovo_id, twitch_id).accounts()
+
+
+def _is_renamed(user: UserData, username: str, trovo_id: int, twitch_id: int) -> bool:
+    if user.name.casefold() == username.casefold():
+        return False
+    # a user known on both platforms may have two different nicks, keep the first one
+    if trovo_id != -1 and user.trovo_id == trovo_id:
+        return user.twitch_id == -1
+    if twitch_id != -1 and user.twitch_id == twitch_id:
+        return user.trovo_id == -1
+    return False
+
+
+def _rename(user: UserData, username: str):
+    _log.info(f'User {user.name} renamed to {username}')
+    if _users_by_name.get(user.name.casefold()) is user:
+        del _users_by_name[user.name.casefold()]
+    old_key = user.keys()[0]
+    user.name = username
+    _users_by_name[username.casefold()] = user
+    if _storage:
+        _storage.record_identity(old_key, user)
+
+
+def backup():
+    try:
+        # live database files are copied by the storage itself, a plain copy may be torn
+        files = _storage.files if _storage else []
+        backups.create('data', skip=set(files), storage=_storage)
+    except Exception as e:
+        _log.error(f'Backup failed: {e}')
+        _log.debug(traceback.format_exc())
+
+
+def add_points(user: UserData, quantity: int, points_type: PointsType, *, bot: ChatBot = None,
+               source: str = ''):
+    with _lock:
+        user = _current(user)
+        if _storage:
+            _storage.record(user, quantity, points_type, source)
+
+        match points_type:
+            case points_type.Mana:
+                user.mana = user.mana + quantity
+                _log.info(f'Added {quantity} mana points to {user.name}. Total: {user.mana}')
+                if bot:
+                    bot.send_message(f'Add {quantity} mp to {user.name}')
+
+            case points_type.Elixir:
+                user.elixir = user.elixir + quantity
+                _log.info(f'Added {quantity} elixir points to {user.name}. Total: {user.elixir}')
+                if bot:
+                    bot.send_message(f'Add {quantity} ep to {user.name}')
+
+    _mark_dirty(user)
+
+
+def spend(user: UserData, quantity: int, points_type: PointsType, *, source: str = '') -> bool:
+    # check and take in one step, donations and commands from other threads can't get in between
+    with _lock:
+        user = _current(user)
+        balance = user.mana if points_type == PointsType.Mana else user.elixir
+        if balance < quantity:
+            return False
+        add_points(user, -quantity, points_type, source=source)
+        return True
+
+
+def find_user(username: str, *, trovo_id: int = -1, twitch_id: int = -1) -> UserData:
+    if not _ready.is_set():
+        _ready.wait()  # only a caller that skipped wait_ready gets here
+    with _lock:
+        return _find_user(username, trovo_id, twitch_id)
+
+
+def get_user(username: str, *, trovo_id: int = -1, twitch_id: int = -1) -> UserData or None:
+    # same lookup as find_user, but an unknown user is not created
+    if not _ready.is_set():
+        _ready.wait()
+    with _lock:
+        return _find_user(username, trovo_id, twitch_id, create=False)
+
+
+def merge(source: UserData, target: UserData):
+    # moves the balance and platform accounts of source to target, source is gone afterwards
+    global _aliases_changed
+    with _lock:
+        source, target = _current(source), _current(target)
+        source_keys = source.keys()
+        target_key = target.keys()[0]
+        if source is target:
+            raise ValueError(f'{source.name} is already {target.name}')
+        for platform, platform_id in source.accounts():
+            if getattr(target, f'{platform}_id') not in (-1, platform_id):
+                raise ValueError(f'{target.name} already has another {platform} account')
+
+        # through the ledger, so a replay after a crash gives the same totals
+        for points_type, quantity in ((PointsType.Mana, source.mana), (PointsType.Elixir, source.elixir)):
+            if quantity:
+                if _storage:
+                    _storage.record(source, -quantity, points_type, f'merge:{target.keys()[0]}')
+                    _storage.record(target, quantity, points_type, f'merge:{source_keys[0]}')
+        target.mana += source.mana
+        target.elixir += source.elixir
+        source.mana = source.elixir = 0
+
+        for account in source.accounts():
+            platform, platform_id = account
+            setattr(target, f'{platform}_id', platform_id)
+            _users_by_account[account] = target
+        source.trovo_id = source.twitch_id = -1
+
+        # by identity, == would match any user with the same fields
+        users[:] = [user for user in users if user is not source]
+        if _users_by_name.get(source.name.casefold()) is source:
+            del _users_by_name[source.name.casefold()]
+        _dirty.pop(id(source), None)
+        _merged[id(source)] = (source, target)
+        if _storage:
+            _storage.forget(source)
+
+        # donations under the old nick go to the merged user from now on
+        aliases = {name: target.keys()[0] for name, key in _aliases.items() if key in source_keys}
+        if source.name.casefold() != target.name.casefold():
+            aliases[source.name.casefold()] = target.keys()[0]
+        _aliases.update(aliases)
+        _aliases_changed = True  # written by the flusher, not under the lock
+        if _storage:
+            # the source first, its accounts are the target's from here on
+            _storage.record_merge(source_keys[0], target, aliases)
+            _storage.record_identity(target_key, target)
+
+        _log.info(f'User {source.name} merged into {target.name}')
+        _mark_dirty(target)
+        _flush_event.set()
+
+
+def _current(user: UserData) -> UserData:
+    # a message in flight may still hold a user that was merged meanwhile
+    while id(user) in _merged:
+        user = _merged[id(user)][1]
+    return user
+
+
+def _find_user(username: str, trovo_id: int, twitch_id: int, create: bool = True) -> UserData or None:
+    accounts = _accounts(trovo_id, twitch_id)
+    user = None
+    for account in accounts:
+        user = user or _users_by_account.get(account)
+
+    if not user and accounts and _storage:
+        # an account on disk beats a nick in memory, with the sqlite engine users load lazily
+        user = _storage.lookup(username, trovo_id, twitch_id, by_name=False)
+        if user:
+            users.append(user)
+            _index_user(user)
+
+    if not user and not accounts:
+        user = _find_by_alias(username)
+
+    if not user:
+        # a nick alone only matches a user that isn't tied to a platform account yet,
+        # the same nick on twitch and trovo can be two different people
+        user = _users_by_name.get(username.casefold())
+        if user and accounts and user.accounts():
+            user = None
+
+    if not user and _storage:
+        user = _storage.lookup(username, trovo_id, twitch_id)
+        if user:
+            users.append(user)
+            _index_user(user)
+
+    if not user and not create:
+        return None
+
+    if user:
+        changed = _attach_ids(user, trovo_id, twitch_id)
+        if _is_renamed(user, username, trovo_id, twitch_id):
+            _rename(user, username)
+            changed = True
+        if changed:
+            _mark_dirty(user)
+    else:
+        user = UserData(
+            name=username,
+            mana=0,
+            elixir=0,
+            trovo_id=trovo_id,
+            twitch_id=twitch_id
+        )
+        users.append(user)
+        _index_user(user)
+        _mark_dirty(user)
+
+    return user
+
+
+def _find_by_alias(username: str) -> UserData or None:
+    key = _aliases.get(username.casefold())
+    if not key:
+        return None
+
+    platform, _, platform_id = key.partition(':')
+    if platform_id.isdigit():
+        ids = {'trovo_id': -1, 'twitch_id': -1, f'{platform}_id': int(platform_id)}
+        user = _users_by_account.get((platform, int(platform_id)))
+    else:
+        ids = {'trovo_id': -1, 'twitch_id': -1}
+        user = _users_by_name.get(key.casefold())
+
+    if not user and _storage:
+        user = _storage.lookup(key, **ids)
+        if user:
+            users.append(user)
+            _index_user(user)
+    return user
@@ -0,0 +1,128 @@
+import json
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta
+from time import perf_counter
+
+import metrics
+
+_log = logging.getLogger(__name__)
+
+backups_dir = 'backups'
+keep_last = 5
+keep_daily = 7
+keep_weekly = 4
+
+_prefix = 'backup_'
+_time_format = '%Y-%m-%d-%H-%M-%S'
+_manifest = 'manifest.json'
+
+
+# Every backup is a full directory tree, but files unchanged since the previous backup
+# (same size and mtime) are hard links to it, so only changed files take space and time.
+def create(source: str, *, skip: set[str] = None, storage=None) -> str:
+    start = perf_counter()
+    os.makedirs(backups_dir, exist_ok=True)
+    name = _prefix + datetime.now().strftime(_time_format)
+    target = os.path.join(backups_dir, name)
+    previous = _latest()
+    previous_manifest = _load_manifest(previous) if previous else {}
+    skip = {os.path.normpath(path) for path in skip or []}
+
+    manifest = {}
+    copied = linked = 0
+    for root, dirs, files in os.walk(source):
+        for file in files:
+            filepath = os.path.join(root, file)
+            if os.path.normpath(filepath) in skip or file.endswith('.tmp'):
+                continue
+
+            relpath = os.path.relpath(filepath, source)
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                continue  # removed while walking
+            signature = [stat.st_size, stat.st_mtime_ns]
+            dest = os.path.join(target, relpath)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+            if previous_manifest.get(relpath) == signature and _link(os.path.join(previous, relpath), dest):
+                linked += 1
+            else:
+                shutil.copy2(filepath, dest)
+                copied += 1
+            manifest[relpath] = signature
+
+    os.makedirs(target, exist_ok=True)
+    if storage:
+        storage.backup(target)
+
+    with open(os.path.join(target, _manifest), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+    removed = prune()
+    elapsed = perf_counter() - start
+    metrics.observe('backup_seconds', elapsed)
+    _log.info(f'Backup {target} created in {elapsed:.3f}s '
+              f'(copied {copied}, linked {linked}, pruned {len(removed)})')
+    return target
+
+
+def prune(now: datetime = None) -> list[str]:
+    now = now or datetime.now()
+    backups = _list()
+    keep = set(name for name, _ in backups[-keep_last:])
+
+    days = {}
+    weeks = {}
+    for name, created in backups:  # oldest first, so the newest one of a day or week wins
+        if now - created < timedelta(days=keep_daily):
+            days[created.date()] = name
+        if now - created < timedelta(weeks=keep_weekly):
+            weeks[created.isocalendar()[:2]] = name
+    keep.update(days.values())
+    keep.update(weeks.values())
+
+    removed = []
+    for name, _ in backups:
+        if name not in keep:
+            shutil.rmtree(os.path.join(backups_dir, name), ignore_errors=True)
+            removed.append(name)
+    return removed
+
+
+def _list() -> list[tuple[str, datetime]]:
+    backups = []
+    if not os.path.isdir(backups_dir):
+        return backups
+
+    for name in os.listdir(backups_dir):
+        if not name.startswith(_prefix) or not os.path.isdir(os.path.join(backups_dir, name)):
+            continue  # old zip backups are left alone
+        try:
+            backups.append((name, datetime.strptime(name.removeprefix(_prefix), _time_format)))
+        except ValueError:
+            continue
+    return sorted(backups, key=lambda item: item[1])
+
+
+def _latest() -> str or None:
+    backups = _list()
+    return os.path.join(backups_dir, backups[-1][0]) if backups else None
+
+
+def _load_manifest(path: str) -> dict:
+    try:
+        with open(os.path.join(path, _manifest), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}  # unfinished backup, copy everything
+
+
+def _link(src: str, dest: str) -> bool:
+    try:
+        os.link(src, dest)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,52 @@
+import json
+import logging
+import os
+import tempfile
+import traceback
+from json import JSONDecodeError
+
+_log = logging.getLogger(__name__)
+
+
+def save(filename: str, data: dict or list or str):
+    try:
+        filepath = f'data/{filename}'
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        if isinstance(data, str):
+            text = data
+        else:
+            text = json.dumps(data, default=dict, indent=True)
+
+        # write to a temp file and swap it in, so readers never see a truncated file
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(filepath), suffix='.tmp',
+                                        dir=os.path.dirname(filepath))
+        try:
+            with open(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, filepath)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    except Exception as e:
+        _log.critical(f'Can\'t save: {e}')
+        _log.debug(traceback.format_exc())
+
+
+def load(filename: str) -> dict or list:
+    try:
+        filepath = f'data/{filename}'
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'r', encoding='utf-8') as f:
+            return json.loads(f.read())
+    except FileNotFoundError as e:
+        _log.warning(f'File not found {e.filename}')
+    except JSONDecodeError as e:
+        _log.critical(f'Can\'t load (decode): {e}')
+        _log.debug(traceback.format_exc())
+    except Exception as e:
+        _log.critical(f'Can\'t load: {e}')
+        _log.debug(traceback.format_exc())
+    return {}
@@ -0,0 +1,130 @@
+import json
+import logging
+
+from models import PointsType, UserData
+from .files import load, save
+from .ledger import Ledger, LedgerRecord
+
+_log = logging.getLogger(__name__)
+
+
+# All users live in one json snapshot, changes between snapshots are kept in the ledger
+class JsonStorage:
+    def __init__(self, filename: str, ledger_dir: str):
+        self.filename = filename
+        self.ledger = Ledger(ledger_dir)
+        self.replayed = 0
+        self.aliases: dict[str, str] = {}  # aliases made by merges after the snapshot
+
+    @property
+    def files(self) -> list[str]:
+        return []
+
+    def open(self) -> list[UserData]:
+        snapshot = load(self.filename)
+        if isinstance(snapshot, list):  # snapshot written before the ledger existed
+            snapshot = {'ledger_seq': 0, 'users': snapshot}
+        users = [UserData.from_dict(usr) for usr in snapshot.get('users', [])]
+
+        by_key = {}
+        for user in users:
+            for key in _record_keys(user):
+                by_key.setdefault(key.casefold(), user)
+
+        self.aliases = {}
+        records = self.ledger.open(int(snapshot.get('ledger_seq', 0)))
+        for record in records:
+            user = by_key.get(record.key.casefold())
+            if record.points_type is None:
+                self._apply_identity(record, user, users, by_key)
+                continue
+            if not user:
+                user = self._new_user(record.key)
+                by_key[record.key.casefold()] = user
+                users.append(user)
+
+            match record.points_type:
+                case PointsType.Mana:
+                    user.mana += record.delta
+                case PointsType.Elixir:
+                    user.elixir += record.delta
+
+        self.replayed = len(records)
+        if records:
+            _log.info(f'Replayed {len(records)} ledger records')
+        return users
+
+    def lookup(self, name: str, trovo_id: int, twitch_id: int, *, by_name: bool = True) -> UserData or None:
+        return None  # everything is loaded by open()
+
+    def has_account(self, platform: str, platform_id: int) -> bool:
+        return False  # every account is in the db index already
+
+    def record(self, user: UserData, quantity: int, points_type: PointsType, source: str):
+        self.ledger.append(user.keys()[0], quantity, points_type, source)
+
+    def record_identity(self, old_key: str, user: UserData):
+        self.ledger.append_identity(old_key, {'name': user.name, 'trovo_id': user.trovo_id,
+                                              'twitch_id': user.twitch_id})
+
+    def record_merge(self, source_key: str, target: UserData, aliases: dict[str, str]):
+        self.ledger.append_identity(source_key, {'merged_into': target.keys()[0], 'aliases': aliases})
+
+    def forget(self, user: UserData):
+        pass  # the next snapshot is written without it
+
+    def snapshot(self, users: list[UserData], dirty: list[UserData]) -> dict:
+        return {
+            'ledger_seq': self.ledger.seq,
+            'users': [usr.to_dict() for usr in users]
+        }
+
+    def write(self, data: dict):
+        save(self.filename, data)
+
+    def compact(self):
+        self.ledger.compact()
+
+    def backup(self, directory: str):
+        pass  # plain files, db.backup copies them
+
+    def close(self):
+        self.ledger.close()
+
+    def _apply_identity(self, record: LedgerRecord, user: UserData or None, users: list[UserData], by_key: dict):
+        change = json.loads(record.source)
+        if user:
+            for key in _record_keys(user):
+                if by_key.get(key.casefold()) is user:
+                    del by_key[key.casefold()]
+
+        if 'merged_into' in change:
+            # its balance already moved to the target by points records
+            if user:
+                users[:] = [usr for usr in users if usr is not user]
+            self.aliases.update(change['aliases'])
+            return
+
+        if not user:
+            user = self._new_user(record.key)  # made after the snapshot, without points yet
+            users.append(user)
+        user.name = change['name']
+        user.trovo_id = change['trovo_id']
+        user.twitch_id = change['twitch_id']
+        for key in _record_keys(user):
+            by_key[key.casefold()] = user
+
+    @staticmethod
+    def _new_user(key: str) -> UserData:
+        # a user made after the snapshot, its nick comes back with its next message
+        user = UserData(name=key, mana=0, elixir=0, trovo_id=-1, twitch_id=-1)
+        platform, _, platform_id = key.partition(':')
+        if platform in ('trovo', 'twitch') and platform_id.isdigit():
+            setattr(user, f'{platform}_id', int(platform_id))
+        return user
+
+
+def _record_keys(user: UserData) -> list[str]:
+    # records of a user with an account are keyed by it, a name key
+    # belongs to an accountless user even if someone else has that nick
+    return user.keys()[:-1] if user.accounts() else user.keys()
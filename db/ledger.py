@@ -0,0 +1,127 @@
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass
+from time import time
+
+from models import PointsType
+
+_log = logging.getLogger(__name__)
+
+_archive_pattern = re.compile(r'^points\.(\d+)\.log$')
+_identity = 'user'  # points type column of an identity record
+
+
+@dataclass
+class LedgerRecord:
+    seq: int
+    timestamp: float
+    points_type: PointsType or None  # None for an identity record, its change is in source
+    delta: int
+    source: str
+    key: str
+
+    @staticmethod
+    def parse(line: str) -> 'LedgerRecord':
+        seq, timestamp, points_type, delta, source, key = line.rstrip('\n').split('\t', maxsplit=5)
+        points_type = PointsType(points_type) if points_type != _identity else None
+        return LedgerRecord(int(seq), float(timestamp), points_type, int(delta), source, key)
+
+    def format(self) -> str:
+        points_type = self.points_type.value if self.points_type else _identity
+        return (f'{self.seq}\t{self.timestamp:.3f}\t{points_type}\t{self.delta}\t'
+                f'{_clean(self.source)}\t{_clean(self.key)}\n')
+
+
+def _clean(text: str) -> str:
+    return text.replace('\t', ' ').replace('\n', ' ').replace('\r', ' ')
+
+
+# Append-only log of points changes. The current segment is points.log, when it grows
+# past max_size it is renamed to points.<last seq>.log and kept as the audit trail.
+class Ledger:
+    def __init__(self, directory: str, *, max_size: int = 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self.seq = 0
+        self._file = None
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, 'points.log')
+
+    # Returns the records newer than after_seq, they are not in the snapshot yet
+    def open(self, after_seq: int = 0) -> list[LedgerRecord]:
+        os.makedirs(self.directory, exist_ok=True)
+        self.seq = after_seq
+        records = []
+        for path in self._segments(after_seq):
+            records.extend(self._read(path, after_seq))
+        if records:
+            self.seq = max(self.seq, records[-1].seq)
+
+        self._file = open(self.path, 'a+', encoding='utf-8', buffering=1)
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell() > 0:
+            # a crash may leave a half-written record, do not glue the next one to it
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != '\n':
+                self._file.write('\n')
+        return records
+
+    def append(self, key: str, delta: int, points_type: PointsType or None, source: str = '') -> LedgerRecord:
+        self.seq += 1
+        record = LedgerRecord(self.seq, time(), points_type, delta, source, key)
+        self._file.write(record.format())
+        return record
+
+    # The user under key changed its nick or accounts, or was merged away. Later records
+    # use its new key, so a replay has to apply the change before them.
+    def append_identity(self, key: str, change: dict) -> LedgerRecord:
+        return self.append(key, 0, None, json.dumps(change))
+
+    # Call only after a snapshot covering self.seq was written
+    def compact(self):
+        if self._file.tell() < self.max_size:
+            return
+
+        self._file.close()
+        archive = os.path.join(self.directory, f'points.{self.seq:012d}.log')
+        os.replace(self.path, archive)
+        _log.info(f'Ledger segment archived to {archive}')
+        self._file = open(self.path, 'a', encoding='utf-8', buffering=1)
+
+    def close(self):
+        if self._file:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+            self._file = None
+
+    def _segments(self, after_seq: int) -> list[str]:
+        archives = []
+        for filename in os.listdir(self.directory):
+            match = _archive_pattern.match(filename)
+            if match and int(match.group(1)) > after_seq:
+                archives.append((int(match.group(1)), os.path.join(self.directory, filename)))
+        return [path for _, path in sorted(archives)] + [self.path]
+
+    @staticmethod
+    def _read(path: str, after_seq: int) -> list[LedgerRecord]:
+        records = []
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = LedgerRecord.parse(line)
+                    except ValueError:
+                        _log.warning(f'Broken ledger record in {path}: {line!r}')
+                        continue
+                    if record.seq > after_seq:
+                        records.append(record)
+        except FileNotFoundError:
+            pass
+        return records
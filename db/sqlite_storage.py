@@ -0,0 +1,174 @@
+import logging
+import os
+import sqlite3
+from time import time
+
+from models import PointsType, UserData
+from .json_storage import JsonStorage
+
+_log = logging.getLogger(__name__)
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_key TEXT NOT NULL,
+    mana INTEGER NOT NULL DEFAULT 0,
+    elixir INTEGER NOT NULL DEFAULT 0,
+    trovo_id INTEGER NOT NULL DEFAULT -1,
+    twitch_id INTEGER NOT NULL DEFAULT -1
+);
+CREATE INDEX IF NOT EXISTS users_name_key ON users (name_key);
+CREATE INDEX IF NOT EXISTS users_trovo_id ON users (trovo_id) WHERE trovo_id != -1;
+CREATE INDEX IF NOT EXISTS users_twitch_id ON users (twitch_id) WHERE twitch_id != -1;
+CREATE TABLE IF NOT EXISTS ledger (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp REAL NOT NULL,
+    points_type TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    source TEXT NOT NULL,
+    user_key TEXT NOT NULL
+);
+'''
+
+_select_columns = 'SELECT id, name, mana, elixir, trovo_id, twitch_id FROM users'
+_select_by_name = f'{_select_columns} WHERE name_key = ? ORDER BY id LIMIT 1'
+_select_unlinked_by_name = (f'{_select_columns} WHERE name_key = ? AND trovo_id = -1 AND twitch_id = -1 '
+                            f'ORDER BY id LIMIT 1')
+_select_by_trovo_id = f'{_select_columns} WHERE trovo_id = ? ORDER BY id LIMIT 1'
+_select_by_twitch_id = f'{_select_columns} WHERE twitch_id = ? ORDER BY id LIMIT 1'
+_upsert_user = ('INSERT OR REPLACE INTO users (id, name, name_key, mana, elixir, trovo_id, twitch_id) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)')
+_delete_user = 'DELETE FROM users WHERE id = ?'
+_insert_record = 'INSERT INTO ledger (timestamp, points_type, delta, source, user_key) VALUES (?, ?, ?, ?, ?)'
+
+
+# Users stay on disk and are loaded on first lookup, so memory only holds the viewers
+# active in the current stream. Dirty users and ledger records are written in one transaction per flush.
+class SqliteStorage:
+    def __init__(self, path: str, *, import_from: JsonStorage = None):
+        self.path = path
+        self.import_from = import_from
+        self.replayed = 0
+        self.aliases: dict[str, str] = {}
+        self._reader: sqlite3.Connection or None = None
+        self._writer: sqlite3.Connection or None = None
+        # both are only changed under the db lock, row ids of new users are given out by snapshot()
+        self._row_ids: dict[int, int] = {}
+        self._loaded_rows: set[int] = set()  # rows with a user in memory, or deleted by a merge
+        self._next_row_id = 1
+        self._records: list[tuple] = []
+        self._deleted: list[int] = []
+
+    @property
+    def files(self) -> list[str]:
+        return [self.path, f'{self.path}-wal', f'{self.path}-shm']
+
+    def open(self) -> list[UserData]:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # WAL lets lookups on the reader connection run while the flusher thread writes
+        self._writer = sqlite3.connect(self.path, check_same_thread=False)
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._writer.execute('PRAGMA synchronous=NORMAL')
+        self._writer.executescript(_schema)
+        self._reader = sqlite3.connect(self.path, check_same_thread=False)
+        self._next_row_id = self._reader.execute('SELECT coalesce(max(id), 0) + 1 FROM users').fetchone()[0]
+
+        if self.import_from and self._reader.execute('SELECT count(*) FROM users').fetchone()[0] == 0:
+            users = self.import_from.open()
+            self.import_from.close()
+            self.aliases = self.import_from.aliases
+            if users:
+                self.write(self.snapshot(users, users))
+                # imported users are not kept, they load on lookup like any other
+                self._row_ids.clear()
+                self._loaded_rows.clear()
+                _log.info(f'Imported {len(users)} users from {self.import_from.filename}')
+
+        return []
+
+    def lookup(self, name: str, trovo_id: int, twitch_id: int, *, by_name: bool = True) -> UserData or None:
+        row = None
+        if trovo_id != -1:
+            row = self._reader.execute(_select_by_trovo_id, (trovo_id,)).fetchone()
+        if not row and twitch_id != -1:
+            row = self._reader.execute(_select_by_twitch_id, (twitch_id,)).fetchone()
+        if not row and by_name:
+            # with an id, the nick only matches a user without platform accounts, as in db.find_user
+            query = _select_by_name if trovo_id == -1 and twitch_id == -1 else _select_unlinked_by_name
+            row = self._reader.execute(query, (name.casefold(),)).fetchone()
+        # a row already in memory is ahead of the file, a second copy would split its balance
+        if not row or row[0] in self._loaded_rows:
+            return None
+
+        row_id, name, mana, elixir, trovo_id, twitch_id = row
+        user = UserData(name=name, mana=mana, elixir=elixir, trovo_id=trovo_id, twitch_id=twitch_id)
+        self._row_ids[id(user)] = row_id
+        self._loaded_rows.add(row_id)
+        return user
+
+    def has_account(self, platform: str, platform_id: int) -> bool:
+        query = _select_by_trovo_id if platform == 'trovo' else _select_by_twitch_id
+        row = self._reader.execute(query, (platform_id,)).fetchone()
+        return bool(row) and row[0] not in self._loaded_rows
+
+    def record(self, user: UserData, quantity: int, points_type: PointsType, source: str):
+        self._records.append((time(), points_type.value, quantity, source, user.keys()[0]))
+
+    def record_identity(self, old_key: str, user: UserData):
+        pass  # the user row is written in the same transaction as its records
+
+    def record_merge(self, source_key: str, target: UserData, aliases: dict[str, str]):
+        pass  # so are the deleted row and the target
+
+    def forget(self, user: UserData):
+        row_id = self._row_ids.pop(id(user), None)
+        if row_id:
+            self._deleted.append(row_id)
+
+    def snapshot(self, users: list[UserData], dirty: list[UserData]) -> tuple:
+        records, self._records = self._records, []
+        deleted, self._deleted = self._deleted, []
+        rows = []
+        for usr in dirty:
+            if id(usr) not in self._row_ids:
+                # a merge after this snapshot finds the row id and deletes the row in the next one
+                self._row_ids[id(usr)] = self._next_row_id
+                self._loaded_rows.add(self._next_row_id)
+                self._next_row_id += 1
+            rows.append((self._row_ids[id(usr)], *self._row(usr)))
+        return rows, records, deleted
+
+    def write(self, data: tuple):
+        # runs outside the db lock, so it only writes what snapshot() took
+        rows, records, deleted = data
+        with self._writer:
+            self._writer.executemany(_delete_user, [(row_id,) for row_id in deleted])
+            self._writer.executemany(_upsert_user, rows)
+            self._writer.executemany(_insert_record, records)
+
+    def compact(self):
+        pass  # sqlite checkpoints the WAL by itself
+
+    def backup(self, directory: str):
+        path = os.path.join(directory, os.path.basename(self.path))
+        # own connections, backups run in a worker thread
+        source = sqlite3.connect(self.path)
+        dest = sqlite3.connect(path)
+        try:
+            with dest:
+                source.backup(dest)
+        finally:
+            dest.close()
+            source.close()
+        _log.info(f'Database backup {path} created')
+
+    def close(self):
+        for conn in (self._reader, self._writer):
+            if conn:
+                conn.close()
+        self._reader = self._writer = None
+
+    @staticmethod
+    def _row(user: UserData) -> tuple:
+        return user.name, user.name.casefold(), user.mana, user.elixir, user.trovo_id, user.twitch_id
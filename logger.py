@@ -1,9 +1,46 @@
+import atexit
 import logging
 import os
-from datetime import datetime
+import queue
+from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from time import time
 
 import colorlog
 
+# Raw websocket frames go to their own logger, it stays quiet unless asked for in LOG_LEVELS
+frames_logger = 'services.trovo.frames'
+
+default_levels = {
+    'services': logging.DEBUG,
+    'commands': logging.DEBUG,
+    'db': logging.DEBUG,
+    frames_logger: logging.INFO
+}
+
+_listener: QueueListener or None = None
+
+
+# Rotates when the file reaches max_bytes or at midnight, whichever comes first
+class RotatingLogFile(RotatingFileHandler):
+    def __init__(self, filename: str, max_bytes: int, backup_count: int):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.rollover_at = self._next_midnight()
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if time() >= self.rollover_at:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._next_midnight()
+
+    @staticmethod
+    def _next_midnight() -> float:
+        tomorrow = datetime.now().date() + timedelta(days=1)
+        return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
 
 def get_console_handler():
     console_handler = logging.StreamHandler()
@@ -22,29 +59,54 @@ def get_console_handler():
     return console_handler
 
 
-def get_file_handler(path: str):
+def get_file_handler(path: str, max_bytes: int = 5 * 2 ** 20, backup_count: int = 10):
     if not os.path.exists('logs'):
         os.makedirs('logs')
 
-    file_handler = logging.FileHandler(f'logs/{path}', encoding='utf-8', mode='w')
+    file_handler = RotatingLogFile(f'logs/{path}', max_bytes, backup_count)
     file_handler.setFormatter(logging.Formatter(
         '{asctime} {levelname} {name}: {message}',
-        datefmt='%H:%M:%S',
+        datefmt='%Y-%m-%d %H:%M:%S',
         style='{'
     ))
     return file_handler
 
 
-def setup_logger():
+def parse_levels(text: str) -> dict[str, int]:
+    # 'services.trovo.frames=DEBUG,db=WARNING', an empty name is the root logger
+    levels = {}
+    for item in text.split(','):
+        if not item.strip():
+            continue
+        name, _, level = item.partition('=')
+        levels[name.strip()] = logging.getLevelName(level.strip().upper())
+        if not isinstance(levels[name.strip()], int):
+            raise ValueError(f'Unknown log level in LOG_LEVELS: {item}')
+    return levels
+
+
+def setup_logger(levels: str = ''):
+    global _listener
+    if _listener:
+        return
+
+    # handlers write from the listener thread, the event loop only puts records in the queue
+    records = queue.SimpleQueue()
+    _listener = QueueListener(records, get_console_handler(), get_file_handler('latest.log'),
+                              respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logger)
+
     log = logging.getLogger()
     log.setLevel(logging.INFO)
+    log.addHandler(QueueHandler(records))
 
-    log.addHandler(get_console_handler())
-    log.addHandler(get_file_handler('latest.log'))
+    for name, level in {**default_levels, **parse_levels(levels)}.items():
+        logging.getLogger(name or None).setLevel(level)
 
-    current_dt = datetime.now().strftime('%d-%m-%Y_%H-%M-%S')
-    log.addHandler(get_file_handler(f'{current_dt}.log'))
 
-    logging.getLogger('services').setLevel(logging.DEBUG)
-    logging.getLogger('commands').setLevel(logging.DEBUG)
-    logging.getLogger('db').setLevel(logging.DEBUG)
+def stop_logger():
+    global _listener
+    if _listener:
+        _listener.stop()  # flushes what is still queued
+        _listener = None
@@ -1,55 +1,142 @@
 import asyncio
+import logging
 import os
+import signal
+
+import startup  # first, the startup report counts from here
 
 from dotenv import load_dotenv
 
 import commands
 import db
+from commands import timer
+import metrics
 from logger import setup_logger
-from services.donation_alerts import DonationAlerts
-from services.factorio import FactorioBot
-from services.trovo import TrovoChat
-from services.twitch import TwitchBot
+from services.outbound import OutboundQueue
+from services.supervisor import Supervisor, RestartPolicy
+
+_log = logging.getLogger(__name__)
+
+backup_delay = 30  # seconds, the backup waits until the services are through their connect
 
 
 async def main():
     load_dotenv()
-    setup_logger()
+    startup.mark('env')
+    setup_logger(os.getenv('LOG_LEVELS', ''))
+    startup.mark('logging')
+    commands.bind()
+    await asyncio.to_thread(timer.clear_files)
 
-    db.init()
-    db.backup()
-
-    trovo_bot = TrovoChat(
-        os.getenv('TROVO_CLIENT_ID'),
-        os.getenv('TROVO_CLIENT_SECRET'),
-        os.getenv('TROVO_REDIRECT_URL')
+    # users load in a thread while the services import, authenticate and connect,
+    # db.find_user holds the first messages until they are there
+    users_loaded = db.init_in_background(
+        engine=os.getenv('DB_ENGINE', 'json'),
+        interval=float(os.getenv('DB_FLUSH_INTERVAL', 5)),
+        threshold=int(os.getenv('DB_FLUSH_THRESHOLD', 50))
     )
+    users_loaded.add_done_callback(lambda _: startup.mark('db'))
 
-    twitch_bot = TwitchBot(
-        os.getenv('TWITCH_CLIENT_ID'),
-        os.getenv('TWITCH_CLIENT_SECRET'),
-        os.getenv('TWITCH_REDIRECT_URL'),
-        os.getenv('TWITCH_CHANNEL_NAME')
-    )
+    supervisor = Supervisor()
+    outboxes = add_services(supervisor)
+    startup.mark('imports')
 
-    factorio_bot = FactorioBot(
-        os.getenv('FACTORIO_RCON_HOST'),
-        int(os.getenv('FACTORIO_RCON_PORT')),
-        os.getenv('FACTORIO_RCON_PASS'),
-        os.getenv('FACTORIO_USERNAME')
-    )
-    factorio_bot.start()
-    commands.enable_module('factorio')
+    async def backup():
+        await users_loaded
+        await asyncio.sleep(backup_delay)
+        await asyncio.to_thread(db.backup)
+
+    supervisor.add('backup', backup, RestartPolicy(restart=False))
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, lambda: asyncio.create_task(shutdown(supervisor, outboxes)))
+        except (NotImplementedError, RuntimeError):
+            pass  # windows, ctrl+c still cancels main and the finally below saves users
+
+    running = asyncio.create_task(supervisor.run())
+    try:
+        await users_loaded  # a database that can't be opened stops everything
+        await running
+    finally:
+        supervisor.stop()
+        await asyncio.gather(running, return_exceptions=True)
+        db.close()
+
+
+def add_services(supervisor: Supervisor) -> list[OutboundQueue]:
+    # a service module and its client library are imported only when the service is configured
+    outboxes = []
+    trovo_bot = None
+
+    if os.getenv('TROVO_CLIENT_ID'):
+        from services.trovo import TrovoChat
+        trovo_bot = TrovoChat(
+            os.getenv('TROVO_CLIENT_ID'),
+            os.getenv('TROVO_CLIENT_SECRET'),
+            os.getenv('TROVO_REDIRECT_URL')
+        )
+        supervisor.add('trovo', trovo_bot.run)
+        outboxes.append(trovo_bot.message_queue)
+
+    if os.getenv('TWITCH_CLIENT_ID'):
+        from services.twitch import TwitchBot
+        twitch_bot = TwitchBot(
+            os.getenv('TWITCH_CLIENT_ID'),
+            os.getenv('TWITCH_CLIENT_SECRET'),
+            os.getenv('TWITCH_REDIRECT_URL'),
+            os.getenv('TWITCH_CHANNEL_NAME')
+        )
+        supervisor.add('twitch', twitch_bot.run)
+        outboxes.append(twitch_bot.message_queue)
+
+    if os.getenv('DA_TOKEN'):
+        from services.donation_alerts import DonationAlerts
+        donation_alerts = DonationAlerts(os.getenv('DA_TOKEN'), trovo_bot)
+        supervisor.add('donation_alerts', donation_alerts.run)
+
+    if os.getenv('FACTORIO_RCON_HOST'):
+        from services.factorio import FactorioBot
+        factorio_bot = FactorioBot(
+            os.getenv('FACTORIO_RCON_HOST'),
+            int(os.getenv('FACTORIO_RCON_PORT')),
+            os.getenv('FACTORIO_RCON_PASS'),
+            os.getenv('FACTORIO_USERNAME')
+        )
+        factorio_bot.start()
+        commands.enable_module('factorio')
+        supervisor.add('factorio', factorio_bot.run)
+
+    if os.getenv('OVERLAY_EVENTS_PORT'):
+        from services import events
+        supervisor.add('overlay_events', lambda: events.serve(port=int(os.getenv('OVERLAY_EVENTS_PORT'))))
+
+    if os.getenv('TIMER_OVERLAY_PORT'):
+        from commands.timer import serve_overlay
+        supervisor.add('timer_overlay', lambda: serve_overlay(port=int(os.getenv('TIMER_OVERLAY_PORT'))))
+
+    if os.getenv('METRICS_PORT') or os.getenv('METRICS_LOG_INTERVAL'):
+        metrics.enable()
+        if os.getenv('METRICS_PORT'):
+            supervisor.add('metrics', lambda: metrics.serve(port=int(os.getenv('METRICS_PORT'))))
+        if os.getenv('METRICS_LOG_INTERVAL'):
+            supervisor.add('metrics_log', lambda: metrics.log_loop(float(os.getenv('METRICS_LOG_INTERVAL'))))
 
-    donation_alerts = DonationAlerts(os.getenv('DA_TOKEN'), trovo_bot)
+    return outboxes
 
-    tasks = [
-        asyncio.create_task(trovo_bot.run()),
-        asyncio.create_task(twitch_bot.run()),
-        asyncio.create_task(donation_alerts.run())
-    ]
 
-    await asyncio.gather(*tasks)
+async def shutdown(supervisor: Supervisor, outboxes: list[OutboundQueue], timeout: float = 10):
+    if supervisor.stopping:
+        return
+    _log.info('Shutting down')
+    # services keep running meanwhile, so running commands can finish and replies get sent
+    try:
+        await asyncio.wait_for(commands.wait_commands(), timeout)
+        await asyncio.wait_for(asyncio.gather(*(outbox.drained() for outbox in outboxes)), timeout)
+    except asyncio.TimeoutError:
+        _log.warning('Shutdown timeout, some commands or replies are lost')
+    supervisor.stop()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,212 @@
+import asyncio
+import bisect
+import logging
+import math
+import threading
+from time import perf_counter
+from typing import Callable
+
+_log = logging.getLogger(__name__)
+
+# Off by default. Every call below returns on the first line while disabled,
+# so the hot paths pay one global lookup and a function call.
+enabled = False
+
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+descriptions = {
+    'messages_received_total': 'Chat messages and events received, by service',
+    'commands_total': 'Commands dispatched, by command and result',
+    'command_seconds': 'Command run time including the effect queue, by command',
+    'rcon_seconds': 'Factorio rcon round trip',
+    'db_flush_seconds': 'Time to write one db snapshot',
+    'backup_seconds': 'Time to create one backup, pruning included',
+    'reconnects_total': 'Reconnects, by service',
+    'effect_queue_depth': 'Factorio effects waiting for their turn',
+    'effect_wait_avg_seconds': 'Average time recent effects waited in the queue',
+    'effect_wait_max_seconds': 'Longest time a recent effect waited in the queue',
+    'outbound_queue_depth': 'Messages waiting to be sent, by queue',
+    'outbound_sent_total': 'Chat lines sent, by queue',
+    'outbound_coalesced_total': 'Replies packed into another chat line, by queue',
+    'outbound_dropped_total': 'Messages dropped from a full queue, by queue',
+    'outbound_latency_seconds': 'Time from queueing a reply to sending it, by queue',
+    'outbound_rate_limit_wait_seconds': 'Time a chat line waited for the platform send limit, by queue'
+}
+
+_lock = threading.Lock()
+_counters: dict[tuple, float] = {}
+_histograms: dict[tuple, list] = {}  # key -> [bucket counts..., sum, count]
+_gauges: dict[tuple, Callable[[], float]] = {}
+
+
+class _Timer:
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name: str, labels: dict):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        observe(self.name, perf_counter() - self.start, **self.labels)
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+
+_null_timer = _NullTimer()
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def inc(name: str, amount: float = 1, **labels):
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name: str, value: float, **labels):
+    if not enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        histogram = _histograms.get(key)
+        if not histogram:
+            histogram = _histograms[key] = [0] * (len(default_buckets) + 3)
+        histogram[bisect.bisect_left(default_buckets, value)] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+def timer(name: str, **labels) -> _Timer or _NullTimer:
+    return _Timer(name, labels) if enabled else _null_timer
+
+
+def gauge(name: str, callback: Callable[[], float], **labels):
+    # read at scrape time, so queues pay nothing per message
+    _gauges[(name, tuple(sorted(labels.items())))] = callback
+
+
+def render() -> str:
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+    gauges = {key: callback() for key, callback in list(_gauges.items())}
+
+    lines = []
+    described = set()
+
+    def header(name: str, kind: str):
+        if name not in described:
+            described.add(name)
+            lines.append(f'# HELP {name} {descriptions.get(name, name)}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, 'counter')
+        lines.append(f'{name}{_labels(labels)} {_value(value)}')
+
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, 'gauge')
+        lines.append(f'{name}{_labels(labels)} {_value(value)}')
+
+    for (name, labels), histogram in sorted(histograms.items()):
+        header(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip((*default_buckets, '+Inf'), histogram):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels((*labels, ("le", bound)))} {cumulative}')
+        lines.append(f'{name}_sum{_labels(labels)} {_value(histogram[-2])}')
+        lines.append(f'{name}_count{_labels(labels)} {histogram[-1]}')
+
+    return '\n'.join(lines) + '\n'
+
+
+def summary() -> str:
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+
+    parts = [f'{name}{_labels(labels)}={_value(value)}' for (name, labels), value in sorted(counters.items())]
+    parts += [f'{name}{_labels(labels)}={_value(callback())}' for (name, labels), callback in sorted(_gauges.items())]
+    for (name, labels), histogram in sorted(histograms.items()):
+        count = histogram[-1]
+        parts.append(f'{name}{_labels(labels)}: n={count} avg={histogram[-2] / count * 1000:.1f}ms '
+                     f'p99<={_quantile(histogram, 0.99) * 1000:g}ms')
+    return ', '.join(parts)
+
+
+async def serve(host: str = '127.0.0.1', port: int = 9108):
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    _log.info(f'Metrics on http://{host}:{port}/metrics')
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+async def log_loop(interval: float = 300):
+    while True:
+        await asyncio.sleep(interval)
+        _log.info(f'Metrics: {summary()}')
+
+
+def _quantile(histogram: list, q: float) -> float:
+    # upper bound of the bucket holding the quantile, the last finite bound for the overflow bucket
+    target = histogram[-1] * q
+    cumulative = 0
+    for bound, count in zip(default_buckets, histogram):
+        cumulative += count
+        if cumulative >= target:
+            return bound
+    return default_buckets[-1]
+
+
+def _value(value: float) -> str:
+    # exact, :g would print a counter past a million as 1.23457e+06
+    if isinstance(value, int):
+        return str(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels) + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
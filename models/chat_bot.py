@@ -5,3 +5,7 @@ class ChatBot(ABC):
     @abstractmethod
     def send_message(self, msg: str):
         pass
+
+    async def user_ids(self, name: str) -> dict[str, int]:
+        # platform ids for a nickname, as find_user keyword arguments
+        return {}
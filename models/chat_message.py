@@ -3,7 +3,7 @@ from dataclasses import dataclass
 from .user_data import UserData
 
 
-@dataclass
+@dataclass(slots=True)
 class ChatMessage:
     text: str
     sender: UserData
@@ -16,9 +16,9 @@ class ChatMessage:
         _roles = list(obj.get('roles', []))
         return ChatMessage(_text, _sender, _roles)
 
-    def __dict__(self):
+    def to_dict(self) -> dict:
         return {
             'text': self.text,
-            'sender': self.sender,
+            'sender': self.sender.to_dict(),
             'roles': self.roles
         }
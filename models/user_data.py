@@ -1,7 +1,8 @@
 from dataclasses import dataclass
 
 
-@dataclass
+# one instance lives for every viewer ever seen, slots keep it small
+@dataclass(slots=True)
 class UserData:
     name: str
     mana: int
@@ -18,7 +19,7 @@ class UserData:
         _twitch_id = int(obj.get('twitch_id', -1))
         return UserData(_name, _mana, _elixir, _trovo_id, _twitch_id)
 
-    def __dict__(self):
+    def to_dict(self) -> dict:
         return {
             'name': self.name,
             'mana': self.mana,
@@ -26,3 +27,16 @@ class UserData:
             'trovo_id': self.trovo_id,
             'twitch_id': self.twitch_id
         }
+
+    def accounts(self) -> list[tuple[str, int]]:
+        # (platform, platform id) pairs, the identity of a user; nicks change and can be shared
+        accounts = []
+        if self.trovo_id != -1:
+            accounts.append(('trovo', self.trovo_id))
+        if self.twitch_id != -1:
+            accounts.append(('twitch', self.twitch_id))
+        return accounts
+
+    def keys(self) -> list[str]:
+        # ledger keys this user answers to, the first one is used for new records
+        return [f'{platform}:{platform_id}' for platform, platform_id in self.accounts()] + [self.name]
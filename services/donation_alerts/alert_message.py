@@ -4,7 +4,7 @@ from datetime import datetime
 from typing import Any
 
 
-@dataclass
+@dataclass(slots=True)
 class AlertMessage:
     id: int
     alert_type: str
@@ -51,3 +51,6 @@ class AlertMessage:
             preset_id=obj.get('preset_id'),
             objects=obj
         )
+
+    def to_dict(self) -> dict:
+        return self.objects  # the payload from_dict was built from, it round-trips as is
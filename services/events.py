@@ -0,0 +1,83 @@
+import asyncio
+import json
+import logging
+import threading
+from time import time
+from urllib.parse import urlparse, parse_qs
+
+import websockets
+
+import metrics
+from services.outbound import OutboundQueue
+
+_log = logging.getLogger(__name__)
+
+# Events for stream overlays: {'type': 'donation', 'time': ..., **data}.
+# Types: donation, spell, subscription, factorio, timer.
+_subscribers: dict[OutboundQueue, set[str] or None] = {}
+_status_types = {'timer'}  # only the latest value matters, a queued one is replaced
+_lock = threading.Lock()
+
+
+def publish(event_type: str, **data):
+    # callable from any thread, every subscriber queue hands the event to its own loop
+    with _lock:
+        if not _subscribers:
+            return
+        subscribers = list(_subscribers.items())
+
+    event = {'type': event_type, 'time': time(), **data}
+    coalesce_key = (event_type, data.get('name')) if event_type in _status_types else None
+    for queue, types in subscribers:
+        if types is None or event_type in types:
+            queue.put(event, coalesce_key)
+
+
+def subscribe(types: set[str] = None, maxsize: int = 100) -> OutboundQueue:
+    # bounded per subscriber, a stalled overlay loses its oldest events and nobody else waits
+    queue = OutboundQueue('Overlay', maxsize, depth_gauge=False)
+    queue.bind()
+    with _lock:
+        _subscribers[queue] = types
+    return queue
+
+
+def unsubscribe(queue: OutboundQueue):
+    with _lock:
+        _subscribers.pop(queue, None)
+
+
+def _depth() -> int:
+    with _lock:
+        return sum(len(queue) for queue in _subscribers)
+
+
+metrics.gauge('outbound_queue_depth', _depth, queue='Overlay')
+
+
+# ws://127.0.0.1:<port>/?types=donation,spell, without types every event is sent
+async def serve(host: str = '127.0.0.1', port: int = 8766):
+    async def handle(ws, path: str):
+        types = parse_qs(urlparse(path).query).get('types')
+        queue = subscribe(set(','.join(types).split(',')) if types else None)
+        _log.info(f'Overlay connected: {ws.remote_address}')
+        closed = asyncio.ensure_future(ws.wait_closed())
+        try:
+            while True:
+                event = asyncio.ensure_future(queue.get())
+                await asyncio.wait({event, closed}, return_when=asyncio.FIRST_COMPLETED)
+                if closed.done():
+                    event.cancel()
+                    break
+                await ws.send(json.dumps(event.result(), ensure_ascii=False))
+                queue.task_done()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            closed.cancel()
+            unsubscribe(queue)
+            _log.info(f'Overlay disconnected: {ws.remote_address}')
+
+    async with websockets.serve(handle, host, port):
+        _log.info(f'Overlay events on ws://{host}:{port}')
+        await asyncio.Event().wait()
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+
+from .rcon import RconClient, RconError
+
+_log = logging.getLogger(__name__)
+
+remote_interface = 'stream_integration'
+
+
+def lua_literal(value) -> str:
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    text = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+    return f'"{text}"'
+
+
+def build_chunk(calls: list[tuple[str, tuple]]) -> str:
+    # one line, console commands are single line
+    rows = ', '.join('{' + ', '.join(lua_literal(item) for item in (name, *args)) + '}' for name, args in calls)
+    return ('/ca local results = {} '
+            f'for i, call in ipairs({{{rows}}}) do '
+            f'local ok, err = pcall(remote.call, "{remote_interface}", table.unpack(call)) '
+            'if ok then results[i] = "ok" else results[i] = "error: " .. string.gsub(tostring(err), "\\n", " ") end '
+            'end '
+            'rcon.print(table.concat(results, "\\n"))')
+
+
+# Collects remote calls for a short window and sends them as one chunk, so a burst of
+# paid commands costs one rcon round trip and one game tick. Every caller still gets its own result.
+class LuaBatcher:
+    def __init__(self, client: RconClient, *, window: float = 0.25, max_batch: int = 50):
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        self._queue: list[tuple[str, tuple, asyncio.Future]] = []
+        self._timer: asyncio.TimerHandle or None = None
+        self._sending: set[asyncio.Task] = set()
+
+    async def call(self, name: str, *args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.append((name, args, future))
+        if len(self._queue) >= self.max_batch:
+            self._send_queue()
+        elif not self._timer:
+            self._timer = loop.call_later(self.window, self._on_window_end)
+        await future
+
+    def _on_window_end(self):
+        self._timer = None
+        self._send_queue()
+
+    def _send_queue(self):
+        # callers that gave up (timeout) are not sent
+        batch = [item for item in self._queue if not item[2].done()]
+        self._queue = []
+        if batch:
+            task = asyncio.create_task(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: list[tuple[str, tuple, asyncio.Future]]):
+        _log.info(f'Execute batch of {len(batch)} factorio calls')
+        try:
+            output = await self.client.execute(build_chunk([(name, args) for name, args, _ in batch]))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        results = output.split('\n') if output else []
+        for i, (name, _, future) in enumerate(batch):
+            if future.done():
+                continue
+            result = results[i] if i < len(results) else 'error: no result'
+            if result == 'ok':
+                future.set_result(None)
+            else:
+                future.set_exception(RconError(f'{name} failed: {result.removeprefix("error: ")}'))
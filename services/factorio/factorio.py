@@ -1,98 +1,129 @@
+import asyncio
 import logging
-import traceback
-
-import factorio_rcon
+from time import monotonic
 
 from commands import command
 from models import ChatMessage, ChatBot
+from services import events
+from .batcher import LuaBatcher
+from .rcon import RconClient
+from .scheduler import EffectScheduler
 
 _log = logging.getLogger(__name__)
 
 
 class FactorioBot(ChatBot):
-    client: factorio_rcon.RCONClient = None
-    cmd_queue = []
+    client: RconClient = None
+    batcher: LuaBatcher = None
+    # effects per second and burst, per kind and for the whole server
+    effect_limits = {
+        'spawn_biters': (0.5, 2),
+        'spawn_spitters': (0.5, 2),
+        'spawn_worms': (0.2, 1),
+        'spawn_spawners': (0.1, 1),
+        'give_item': (0.5, 2),
+        'drop_all': (0.1, 1),
+        'shower': (1 / 30, 1)
+    }
+    effects_per_second = 1
+    effects_burst = 3
+    # the queue wait is not limited, only the rcon round trip once the effect is due
+    effect_timeout = 30
 
     def __init__(self, rcon_host: str, rcon_port: int, rcon_password: str, username: str):
         self.rcon_host = rcon_host
         self.rcon_port = rcon_port
         self.rcon_password = rcon_password
         self.username = username
+        self._loop: asyncio.AbstractEventLoop or None = None
+        self.scheduler = EffectScheduler(self.effect_limits, rate=self.effects_per_second, burst=self.effects_burst)
         self._registry()
 
     def start(self):
-        self.client = factorio_rcon.RCONClient(
-            ip_address=self.rcon_host,
-            port=self.rcon_port,
-            password=self.rcon_password,
-            connect_on_init=False
-        )
+        self.client = RconClient(self.rcon_host, self.rcon_port, self.rcon_password)
+        self.batcher = LuaBatcher(self.client)
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        try:
+            await self.client.run()
+        finally:
+            await self.client.close()
 
     def send_message(self, msg: str):
-        self.reconnect()
         # Console input that does not start with / is shown as a chat message to your team.
-        self.client.send_command(msg)
-
-    def reconnect(self):
-        try:
-            if not self.client.rcon_socket:
-                self.client.connect()
-                _log.info(f'Factorio client connected')
-        except Exception as e:
-            _log.error(f'Factorio client error: {e}')
-            _log.debug(traceback.format_exc())
+        if self._loop:
+            asyncio.run_coroutine_threadsafe(self.client.execute(msg), self._loop)
 
     def _registry(self):
-        def execute(cmd: str):
+        async def execute(msg: ChatMessage, kind: str, cmd: str):
+            await self.scheduler.acquire(kind, msg.sender.name)
             _log.info(f'Trigger factorio command {cmd}')
-            self.reconnect()
-            self.client.send_command(cmd)
-
-        @command('biters', aliases=['кусаки'], mana=3500, elixir=70, module='factorio')
-        def bitters_command(msg: ChatMessage, bot: ChatBot):
-            execute(f'/spawn_biters {self.username}')
+            await asyncio.wait_for(self.client.execute(cmd), self.effect_timeout)
+            events.publish('factorio', effect=kind, user=msg.sender.name)
+
+        async def call(msg: ChatMessage, name: str, *args):
+            await self.scheduler.acquire(name, msg.sender.name)
+            _log.info(f'Trigger factorio call {name}{args}')
+            await asyncio.wait_for(self.batcher.call(name, self.username, *args), self.effect_timeout)
+            events.publish('factorio', effect=name, user=msg.sender.name)
+
+        @command('biters', aliases=['кусаки'], mana=3500, elixir=70, module='factorio', timeout=None)
+        async def bitters_command(msg: ChatMessage, bot: ChatBot):
+            await call(msg, 'spawn_biters')
             bot.send_message(f'{msg.sender.name} отправил толпу кусак')
 
-        @command('spitters', aliases=['плеваки'], mana=4000, elixir=80, module='factorio')
-        def splitters_command(msg: ChatMessage, bot: ChatBot):
-            execute(f'/spawn_spitters {self.username}')
+        @command('spitters', aliases=['плеваки'], mana=4000, elixir=80, module='factorio', timeout=None)
+        async def splitters_command(msg: ChatMessage, bot: ChatBot):
+            await call(msg, 'spawn_spitters')
             bot.send_message(f'{msg.sender.name} отправил толпу плевак')
 
-        @command('worms', aliases=['черви'], mana=5000, elixir=100, module='factorio')
-        def worms_command(msg: ChatMessage, bot: ChatBot):
-            execute(f'/spawn_worms {self.username}')
+        @command('worms', aliases=['черви'], mana=5000, elixir=100, module='factorio', timeout=None)
+        async def worms_command(msg: ChatMessage, bot: ChatBot):
+            await call(msg, 'spawn_worms')
             bot.send_message(f'{msg.sender.name} призвал червей')
 
-        @command('spawners', aliases=['гнезда'], mana=10000, elixir=200, module='factorio')
-        def spawners_command(msg: ChatMessage, bot: ChatBot):
-            execute(f'/spawn_spawners {self.username}')
+        @command('spawners', aliases=['гнезда'], mana=10000, elixir=200, module='factorio', timeout=None)
+        async def spawners_command(msg: ChatMessage, bot: ChatBot):
+            await call(msg, 'spawn_spawners')
             bot.send_message(f'{msg.sender.name} заспавнил метеорит из кусак')
 
-        @command('hotpotato', aliases=['горячаякартошка'], mana=2500, elixir=50, module='factorio')
-        def hotpotato_command(msg: ChatMessage, bot: ChatBot):
-            execute(f'/give_item {self.username} uranium_ore 100')
+        @command('hotpotato', aliases=['горячаякартошка'], mana=2500, elixir=50, module='factorio', timeout=None)
+        async def hotpotato_command(msg: ChatMessage, bot: ChatBot):
+            await call(msg, 'give_item', 100)
             bot.send_message(f'{msg.sender.name} добавил немного радиации')
 
-        @command('reactor', aliases=['реактор'], mana=-1, elixir=100, module='factorio')
-        def reactor_command(msg: ChatMessage, bot: ChatBot):
-            execute(f'/give_item {self.username} uranium_ore 999999999')
+        @command('reactor', aliases=['реактор'], mana=-1, elixir=100, module='factorio', timeout=None)
+        async def reactor_command(msg: ChatMessage, bot: ChatBot):
+            await call(msg, 'give_item', 999999999)
             bot.send_message(f'{msg.sender.name} помог запустить реактор')
 
-        @command('dropall', aliases=['выброситьвсе'], mana=2500, elixir=50, module='factorio')
-        def dropall_command(msg: ChatMessage, bot: ChatBot):
-            execute(f'/drop_all {self.username}')
+        @command('dropall', aliases=['выброситьвсе'], mana=2500, elixir=50, module='factorio', timeout=None)
+        async def dropall_command(msg: ChatMessage, bot: ChatBot):
+            await call(msg, 'drop_all')
             bot.send_message(f'{msg.sender.name} разгрузил инвентарь')
 
         # nopep8 /c remote.call("space-exploration", "begin_meteor_shower", {target_entity = game.player, meteors = 10})
         # nopep8 /c remote.call("space-exploration", "begin_meteor_shower", {target_entity = game.player.selected or game.player})
         # nopep8 /c remote.call("space-exploration", "begin_meteor_shower", {zone_name = "Nauvis", position = {x = 0, y = 0}, range = 1, meteors = 100})
         # nopep8 /c for i = 1, 10 do remote.call("space-exploration", "begin_meteor_shower", {target_entity = game.player, meteors = 100}) end
-        @command('shower', aliases=['душ'], mana=7500, elixir=150, module='factorio')
-        def shower_command(msg: ChatMessage, bot: ChatBot):
-            execute(f'/ca player = game.get_player("{self.username}")'
-                    'for i = 1, 5 do '
-                    'remote.call("space-exploration", "begin_meteor_shower", '
-                    '{target_entity = player, meteors = 5, range = 100}) '
-                    'end')
+        @command('shower', aliases=['душ'], mana=7500, elixir=150, module='factorio', timeout=None)
+        async def shower_command(msg: ChatMessage, bot: ChatBot):
+            await execute(msg, 'shower', f'/ca player = game.get_player("{self.username}")'
+                                         'for i = 1, 5 do '
+                                         'remote.call("space-exploration", "begin_meteor_shower", '
+                                         '{target_entity = player, meteors = 5, range = 100}) '
+                                         'end')
             bot.send_message(f'{msg.sender.name} запустил метеоритный дождь')
 
+        @command('queue', aliases=['очередь'], module='factorio')
+        async def queue_command(msg: ChatMessage, bot: ChatBot):
+            backlog = self.scheduler.backlog()
+            if not backlog:
+                bot.send_message('Очередь пуста')
+                return
+
+            now = monotonic()
+            items = ', '.join(f'{request.user}: {request.kind} ({int(now - request.created)}s)'
+                              for request in backlog[:10])
+            bot.send_message(f'В очереди {len(backlog)}: {items}')
@@ -70,46 +70,31 @@ function spawn_units_from_spawner(name, quantity, handler)
     end
 end
 
-commands.add_command("spawn_biters", "summon biters around you", function(command)
-    local player = get_player(command.parameter)
-    if not player then
-        return
+function spawn_unit_around(player, unit)
+    local surface = player.surface
+    local position = surface.find_non_colliding_position(unit, get_random_position_around(player, 40), 10, 1)
+    if position then
+        surface.create_entity({ name = unit, position = position, force = game.forces.enemy })
     end
+end
 
+function spawn_biters(player)
     spawn_units_from_spawner("biter-spawner", 10, function(unit)
-        local surface = player.surface
-        local position = surface.find_non_colliding_position(unit, get_random_position_around(player, 40), 10, 1)
-        if position then
-            surface.create_entity({ name = unit, position = position, force = game.forces.enemy })
-        end
+        spawn_unit_around(player, unit)
     end)
 
     player.print("Good luck to survive", { r = 255, g = 0, b = 0, a = 1 })
-end)
-
-commands.add_command("spawn_spitters", "summon spitters around you", function(command)
-    local player = get_player(command.parameter)
-    if not player then
-        return
-    end
+end
 
+function spawn_spitters(player)
     spawn_units_from_spawner("spitter-spawner", 10, function(unit)
-        local surface = player.surface
-        local position = surface.find_non_colliding_position(unit, get_random_position_around(player, 40), 10, 1)
-        if position then
-            surface.create_entity({ name = unit, position = position, force = game.forces.enemy })
-        end
+        spawn_unit_around(player, unit)
     end)
 
     player.print("Good luck to survive", { r = 255, g = 0, b = 0, a = 1 })
-end)
-
-commands.add_command("spawn_worms", "summon worms around you", function(command)
-    local player = get_player(command.parameter)
-    if not player then
-        return
-    end
+end
 
+function spawn_worms(player)
     local name
     local evolution = game.forces.enemy.evolution_factor
     if evolution > 0.9 then
@@ -123,22 +108,13 @@ commands.add_command("spawn_worms", "summon worms around you", function(command)
     end
 
     for i = 1, 5 do
-        local surface = player.surface
-        local position = surface.find_non_colliding_position(name, get_random_position_around(player, 40), 10, 1)
-        if position then
-            surface.create_entity({ name = name, position = position, force = game.forces.enemy })
-        end
+        spawn_unit_around(player, name)
     end
 
     player.print("Good luck to survive", { r = 255, g = 0, b = 0, a = 1 })
-end)
-
-commands.add_command("spawn_spawners", "summon spawners around you", function(command)
-    local player = get_player(command.parameter)
-    if not player then
-        return
-    end
+end
 
+function spawn_spawners(player)
     for i = 1, 5 do
         local unit
         if math.random() < 0.5 then
@@ -146,15 +122,63 @@ commands.add_command("spawn_spawners", "summon spawners around you", function(co
         else
             unit = "biter-spawner"
         end
-        local surface = player.surface
-        local position = surface.find_non_colliding_position(unit, get_random_position_around(player, 40), 10, 1)
-        if position then
-            surface.create_entity({ name = unit, position = position, force = game.forces.enemy })
-        end
+        spawn_unit_around(player, unit)
     end
 
     player.print("Good luck to survive", { r = 255, g = 0, b = 0, a = 1 })
-end)
+end
+
+function give_item(player, count)
+    local inventory = player.get_main_inventory()
+    if inventory then
+        inventory.insert({ name = "uranium-ore", count = count })
+    end
+    player.print("You received a gift", { r = 255, g = 0, b = 0, a = 1 })
+end
+
+function drop_all(player)
+    local surface = player.surface
+    local inventory = player.get_main_inventory()
+    if inventory then
+        local radius = math.sqrt(#inventory) / 2 + 2
+        for i = 1, #inventory do
+            local stack = inventory[i]
+            local position = surface.find_non_colliding_position("item-on-ground", get_random_position_around(player, radius), 100, 0.1)
+            pcall( function()
+                local simple_stack = {
+                    name = stack.name,
+                    count = stack.count
+                }
+                if position then
+                    surface.create_entity({
+                        name = "item-on-ground",
+                        position = position,
+                        item = stack,
+                        stack = simple_stack
+                    })
+                    inventory.remove(simple_stack)
+                end
+            end)
+        end
+    end
+    player.print("Curse of leaky pockets. Where is my inventory?", { r = 255, g = 0, b = 0, a = 1 })
+end
+
+function add_player_command(name, help, handler)
+    commands.add_command(name, help, function(command)
+        local player = get_player(command.parameter)
+        if not player then
+            return
+        end
+
+        handler(player)
+    end)
+end
+
+add_player_command("spawn_biters", "summon biters around you", spawn_biters)
+add_player_command("spawn_spitters", "summon spitters around you", spawn_spitters)
+add_player_command("spawn_worms", "summon worms around you", spawn_worms)
+add_player_command("spawn_spawners", "summon spawners around you", spawn_spawners)
 
 commands.add_command("give_item", "Give item", function(command)
     local args = {}
@@ -171,50 +195,13 @@ commands.add_command("give_item", "Give item", function(command)
         return
     end
 
-    if not pcall(function()
-        local inventory = player.get_main_inventory()
-        if inventory then
-            inventory.insert({ name = "uranium-ore", count = args[3] })
-        end
-        player.print("You received a gift", { r = 255, g = 0, b = 0, a = 1 })
-    end) then
+    if not pcall(give_item, player, args[3]) then
         game.print("Error")
     end
 end)
 
-commands.add_command("drop_all", "Drop all", function(command)
-    local player = get_player(command.parameter)
-    if not player then
-        return
-    end
-
-    if not pcall(function()
-        local surface = player.surface
-        local inventory = player.get_main_inventory()
-        if inventory then
-            local radius = math.sqrt(#inventory) / 2 + 2
-            for i = 1, #inventory do
-                local stack = inventory[i]
-                local position = surface.find_non_colliding_position("item-on-ground", get_random_position_around(player, radius), 100, 0.1)
-                pcall( function()
-                    local simple_stack = {
-                        name = stack.name,
-                        count = stack.count
-                    }
-                    if position then
-                        surface.create_entity({
-                            name = "item-on-ground",
-                            position = position,
-                            item = stack,
-                            stack = simple_stack
-                        })
-                        inventory.remove(simple_stack)
-                    end
-                end)
-            end
-        end
-        player.print("Curse of leaky pockets. Where is my inventory?", { r = 255, g = 0, b = 0, a = 1 })
-    end) then
+add_player_command("drop_all", "Drop all", function(player)
+    if not pcall(drop_all, player) then
         game.print("Error")
     end
 end)
@@ -225,4 +212,23 @@ commands.add_command("ca", "Execute with achievements", function(command)
     end) then
         game.print("Error")
     end
-end)
\ No newline at end of file
+end)
+
+-- Batched calls from the bot: /ca runs one chunk with many remote.call's in a single tick.
+-- Errors are raised instead of printed, so the bot can refund the viewer.
+function require_player(player_name)
+    local player = player_name and game.get_player(player_name)
+    if not player then
+        error("Unknown player " .. tostring(player_name))
+    end
+    return player
+end
+
+remote.add_interface("stream_integration", {
+    spawn_biters = function(player_name) spawn_biters(require_player(player_name)) end,
+    spawn_spitters = function(player_name) spawn_spitters(require_player(player_name)) end,
+    spawn_worms = function(player_name) spawn_worms(require_player(player_name)) end,
+    spawn_spawners = function(player_name) spawn_spawners(require_player(player_name)) end,
+    give_item = function(player_name, count) give_item(require_player(player_name), count) end,
+    drop_all = function(player_name) drop_all(require_player(player_name)) end
+})
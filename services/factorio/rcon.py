@@ -0,0 +1,175 @@
+import asyncio
+import enum
+import logging
+import struct
+import traceback
+from time import time
+
+import metrics
+import startup
+
+_log = logging.getLogger(__name__)
+
+# Source RCON packet types
+SERVERDATA_AUTH = 3
+SERVERDATA_AUTH_RESPONSE = 2
+SERVERDATA_EXECCOMMAND = 2
+SERVERDATA_RESPONSE_VALUE = 0
+
+_header = struct.Struct('<iii')  # size, id, type
+
+
+class RconError(Exception):
+    pass
+
+
+class RconAuthError(RconError):
+    pass
+
+
+class RconState(enum.Enum):
+    DISCONNECTED = 'disconnected'
+    CONNECTING = 'connecting'
+    CONNECTED = 'connected'
+
+
+def encode_packet(request_id: int, packet_type: int, body: str) -> bytes:
+    payload = body.encode('utf-8') + b'\x00\x00'
+    return _header.pack(8 + len(payload), request_id, packet_type) + payload
+
+
+async def read_packet(reader: asyncio.StreamReader) -> tuple[int, int, str]:
+    size, = struct.unpack('<i', await reader.readexactly(4))
+    data = await reader.readexactly(size)
+    request_id, packet_type = struct.unpack('<ii', data[:8])
+    return request_id, packet_type, data[8:-2].decode('utf-8', errors='replace')
+
+
+# One persistent connection. Commands are written without waiting for earlier answers
+# and matched back by request id. Factorio answers every command with a single packet.
+class RconClient:
+    def __init__(self, host: str, port: int, password: str, *, timeout: float = 10):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.timeout = timeout
+
+        self.state = RconState.DISCONNECTED
+        self.connected_since = 0.0
+        self.last_error = ''
+
+        self._reader: asyncio.StreamReader or None = None
+        self._writer: asyncio.StreamWriter or None = None
+        self._pending: dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._connected: asyncio.Event or None = None
+        self._closed = False
+        self._loop: asyncio.AbstractEventLoop or None = None
+
+    def health(self) -> dict:
+        return {
+            'state': self.state.value,
+            'connected_since': self.connected_since,
+            'pending': len(self._pending),
+            'last_error': self.last_error
+        }
+
+    async def run(self):
+        # one connection per call, reconnects and their backoff are up to the supervisor
+        self._closed = False
+        self._loop = asyncio.get_running_loop()
+        self._connected = self._connected or asyncio.Event()
+        self.state = RconState.CONNECTING
+        try:
+            await self._connect()
+            self.state = RconState.CONNECTED
+            self.connected_since = time()
+            self._connected.set()
+            _log.info(f'Factorio rcon connected to {self.host}:{self.port}')
+            startup.mark('factorio connected')
+            await self._read_loop()
+        except RconAuthError as e:
+            self.last_error = str(e)
+            _log.critical(f'Factorio rcon auth error: {e}')
+            raise
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, RconError) as e:
+            if self._closed:
+                return
+            self.last_error = str(e) or type(e).__name__
+            _log.debug(traceback.format_exc())
+            raise RconError(f'Factorio rcon connection lost: {self.last_error}') from e
+        finally:
+            self._disconnect()
+            self.state = RconState.DISCONNECTED
+
+    async def close(self):
+        self._closed = True
+        self._disconnect()
+
+    async def execute(self, command: str, timeout: float = None) -> str:
+        if self._loop and asyncio.get_running_loop() is not self._loop:
+            # the socket and the pending futures belong to the loop run() is on
+            future = asyncio.run_coroutine_threadsafe(self._execute(command, timeout), self._loop)
+            return await asyncio.wrap_future(future)
+        return await self._execute(command, timeout)
+
+    async def _execute(self, command: str, timeout: float = None) -> str:
+        timeout = timeout or self.timeout
+        if self.state != RconState.CONNECTED:
+            if self.state != RconState.CONNECTING or not self._connected:
+                raise RconError(f'Factorio rcon is {self.state.value}')
+            try:
+                await asyncio.wait_for(self._connected.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise RconError('Factorio rcon connect timeout')
+
+        request_id = self._new_id()
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            with metrics.timer('rcon_seconds'):
+                self._writer.write(encode_packet(request_id, SERVERDATA_EXECCOMMAND, command))
+                await self._writer.drain()
+                return await asyncio.wait_for(future, timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+
+        auth_id = self._new_id()
+        self._writer.write(encode_packet(auth_id, SERVERDATA_AUTH, self.password))
+        await self._writer.drain()
+        while True:
+            request_id, packet_type, _ = await asyncio.wait_for(read_packet(self._reader), self.timeout)
+            # some servers send an empty response value before the auth response
+            if packet_type == SERVERDATA_AUTH_RESPONSE:
+                if request_id == -1:
+                    raise RconAuthError('wrong password')
+                return
+
+    async def _read_loop(self):
+        while True:
+            request_id, packet_type, body = await read_packet(self._reader)
+            future = self._pending.get(request_id)
+            if future and not future.done():
+                future.set_result(body)
+            else:
+                _log.debug(f'Unexpected rcon packet {request_id}: {body}')
+
+    def _disconnect(self):
+        if self._connected:
+            self._connected.clear()
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        self._reader = None
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(RconError('Factorio rcon connection lost'))
+        self._pending.clear()
+
+    def _new_id(self) -> int:
+        self._next_id = self._next_id % 0x7fffffff + 1
+        return self._next_id
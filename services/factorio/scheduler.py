@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from time import monotonic
+
+import metrics
+
+_log = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = monotonic()
+
+    def delay(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+@dataclass
+class EffectRequest:
+    kind: str
+    user: str
+    created: float
+    future: asyncio.Future = field(repr=False)
+
+
+# Paid effects wait here until both the budget of their kind and the global budget allow them.
+# Users are served round-robin, so one rich viewer can't fill the whole queue.
+class EffectScheduler:
+    def __init__(self, limits: dict[str, tuple[float, int]], *, rate: float = 1, burst: int = 3,
+                 default_limit: tuple[float, int] = (0.5, 2)):
+        self.limits = limits
+        self.default_limit = default_limit
+        self.budget = TokenBucket(rate, burst)
+        self.wait_times: deque[float] = deque(maxlen=100)
+        self._buckets: dict[str, TokenBucket] = {}
+        self._queues: dict[str, deque[EffectRequest]] = {}  # insertion order is the round-robin order
+        self._timer: asyncio.TimerHandle or None = None
+        metrics.gauge('effect_queue_depth', lambda: self.depth)
+        metrics.gauge('effect_wait_avg_seconds', lambda: self.stats()['avg_wait'])
+        metrics.gauge('effect_wait_max_seconds', lambda: self.stats()['max_wait'])
+
+    @property
+    def depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def backlog(self) -> list[EffectRequest]:
+        return [request for queue in self._queues.values() for request in queue]
+
+    def stats(self) -> dict:
+        waits = self.wait_times
+        return {
+            'depth': self.depth,
+            'avg_wait': sum(waits) / len(waits) if waits else 0.0,
+            'max_wait': max(waits, default=0.0)
+        }
+
+    async def acquire(self, kind: str, user: str):
+        request = EffectRequest(kind, user, monotonic(), asyncio.get_running_loop().create_future())
+        self._queues.setdefault(user, deque()).append(request)
+        self._schedule()
+        try:
+            await request.future
+        except asyncio.CancelledError:
+            self._remove(request)
+            raise
+
+        wait = monotonic() - request.created
+        self.wait_times.append(wait)
+        if wait > 1:
+            _log.info(f'Effect {kind} by {user} waited {wait:.1f}s, {self.depth} more in queue')
+
+    def _bucket(self, kind: str) -> TokenBucket:
+        if kind not in self._buckets:
+            self._buckets[kind] = TokenBucket(*self.limits.get(kind, self.default_limit))
+        return self._buckets[kind]
+
+    def _schedule(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        now = monotonic()
+        next_wake = None
+        granted = True
+        while granted:
+            granted = False
+            for user, queue in self._queues.items():
+                request = queue[0]
+                if request.future.done():
+                    # cancelled, acquire takes it out once its task runs, it gets no budget meanwhile
+                    queue.popleft()
+                    if not queue:
+                        del self._queues[user]
+                    granted = True
+                    break
+
+                bucket = self._bucket(request.kind)
+                delay = max(bucket.delay(now), self.budget.delay(now))
+                if delay > 0:
+                    next_wake = delay if next_wake is None else min(next_wake, delay)
+                    continue
+
+                bucket.take(now)
+                self.budget.take(now)
+                queue.popleft()
+                del self._queues[user]
+                if queue:
+                    self._queues[user] = queue  # back of the line
+                request.future.set_result(None)
+                granted = True
+                break
+
+        if self._queues and next_wake is not None:
+            self._timer = asyncio.get_running_loop().call_later(next_wake, self._schedule)
+
+    def _remove(self, request: EffectRequest):
+        queue = self._queues.get(request.user)
+        if queue and request in queue:
+            queue.remove(request)
+            if not queue:
+                del self._queues[request.user]
+        self._schedule()
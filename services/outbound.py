@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from time import monotonic
+
+import metrics
+
+_log = logging.getLogger(__name__)
+
+
+@dataclass
+class RateLimit:
+    messages: int
+    period: float
+    max_length: int
+    mod_messages: int = 0
+
+    def budget(self, moderator: bool) -> int:
+        return self.mod_messages if moderator and self.mod_messages else self.messages
+
+
+TWITCH_LIMIT = RateLimit(messages=20, period=30, max_length=500, mod_messages=100)
+TROVO_LIMIT = RateLimit(messages=20, period=30, max_length=300)
+
+
+# Bounded outbound queue with an awaiting consumer. put() may be called from any thread,
+# command handlers run in worker threads and twitch events in their own loop.
+class OutboundQueue:
+    def __init__(self, name: str, maxsize: int = 100, *, depth_gauge: bool = True):
+        self.name = name
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._items: deque[tuple[object, float]] = deque()  # item, queued at
+        self._unfinished = 0  # taken, but the consumer hasn't called task_done yet
+        self._last_key = None  # coalesce key of the newest queued item
+        self._event = asyncio.Event()
+        self._empty = asyncio.Event()
+        self._empty.set()
+        self._loop: asyncio.AbstractEventLoop or None = None
+        self._thread_id: int or None = None
+        if depth_gauge:  # short-lived queues that share a name export their depth together
+            metrics.gauge('outbound_queue_depth', self.__len__, queue=name)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def bind(self, loop: asyncio.AbstractEventLoop = None):
+        self._loop = loop or asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+
+    def put(self, item, coalesce_key=None):
+        # items with a coalesce key are status updates, a newer one replaces a queued one with the same key
+        if self._loop and threading.get_ident() != self._thread_id:
+            self._loop.call_soon_threadsafe(self._put, item, coalesce_key)
+        else:
+            self._put(item, coalesce_key)
+
+    async def get(self):
+        item, _ = await self._get_entry()
+        return item
+
+    def clear(self):
+        self._items.clear()
+        self._last_key = None
+        self._unfinished = 0
+        self._empty.set()
+
+    def task_done(self):
+        # the consumer is through with what it took, e.g. the chat line is sent
+        self._unfinished = max(0, self._unfinished - 1)
+        if not self._items and not self._unfinished:
+            self._empty.set()
+
+    async def drained(self):
+        # nothing queued and nothing being sent
+        await self._empty.wait()
+
+    async def _get_entry(self) -> tuple[object, float]:
+        while not self._items:
+            self._event.clear()
+            await self._event.wait()
+        self._unfinished += 1
+        return self._items.popleft()
+
+    def _put(self, item, coalesce_key=None):
+        if coalesce_key is not None and self._items and self._last_key == coalesce_key:
+            self._items[-1] = (item, self._items[-1][1])  # only the latest value matters
+            return
+        self._last_key = coalesce_key
+
+        if len(self._items) >= self.maxsize:
+            self.dropped += 1
+            metrics.inc('outbound_dropped_total', queue=self.name)
+            _log.warning(f'{self.name} queue is full, dropped: {self._items.popleft()[0]}')
+
+        self._items.append((item, monotonic()))
+        self._event.set()
+        self._empty.clear()
+
+
+# Chat replies paced by the platform send limit. When the budget can't cover everything
+# that is waiting, several short replies are packed into one chat line.
+class ChatOutbox(OutboundQueue):
+    separator = ' | '
+
+    def __init__(self, name: str, limit: RateLimit, maxsize: int = 100):
+        super().__init__(name, maxsize)
+        self.limit = limit
+        self.moderator = False
+        self.sent = 0
+        self.coalesced = 0
+        self.latencies: deque[float] = deque(maxlen=100)
+        self._sent_times: deque[float] = deque()
+
+    def stats(self) -> dict:
+        latencies = self.latencies
+        return {
+            'depth': len(self),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'avg_latency': sum(latencies) / len(latencies) if latencies else 0.0,
+            'max_latency': max(latencies, default=0.0)
+        }
+
+    async def next_line(self) -> str:
+        text, queued = await self._get_entry()
+        await self._wait_for_budget()
+
+        max_length = self.limit.max_length
+        line = self._truncate(text, max_length)
+        parts = [queued]
+        if len(self._items) >= self._remaining():
+            while self._items:
+                next_text, next_queued = self._items[0]
+                if len(line) + len(self.separator) + len(next_text) > max_length:
+                    break
+                self._items.popleft()  # part of the same line, one task_done covers it
+                line += self.separator + next_text
+                parts.append(next_queued)
+            self.coalesced += len(parts) - 1
+            metrics.inc('outbound_coalesced_total', len(parts) - 1, queue=self.name)
+
+        now = monotonic()
+        self._sent_times.append(now)
+        self.sent += 1
+        metrics.inc('outbound_sent_total', queue=self.name)
+        for queued in parts:
+            self.latencies.append(now - queued)
+            metrics.observe('outbound_latency_seconds', now - queued, queue=self.name)
+        return line
+
+    def _remaining(self) -> int:
+        return self.limit.budget(self.moderator) - len(self._sent_times)
+
+    async def _wait_for_budget(self):
+        start = None
+        while True:
+            now = monotonic()
+            while self._sent_times and self._sent_times[0] <= now - self.limit.period:
+                self._sent_times.popleft()
+            if self._remaining() > 0:
+                if start is not None:
+                    metrics.observe('outbound_rate_limit_wait_seconds', now - start, queue=self.name)
+                return
+            if start is None:
+                start = now
+            await asyncio.sleep(self._sent_times[0] + self.limit.period - now)
+
+    @staticmethod
+    def _truncate(text: str, max_length: int) -> str:
+        return text if len(text) <= max_length else text[:max_length - 1] + '…'
@@ -0,0 +1,133 @@
+import asyncio
+import enum
+import logging
+import random
+import traceback
+from dataclasses import dataclass
+from time import monotonic, time
+from typing import Awaitable, Callable
+
+import metrics
+
+_log = logging.getLogger(__name__)
+
+
+class ServiceState(enum.Enum):
+    STARTING = 'starting'
+    RUNNING = 'running'
+    BACKOFF = 'backoff'
+    OPEN = 'open'  # circuit breaker tripped, waiting for the cooldown
+    STOPPED = 'stopped'
+    DONE = 'done'
+
+
+@dataclass
+class RestartPolicy:
+    min_backoff: float = 1
+    max_backoff: float = 60
+    failure_threshold: int = 5  # failures in a row that open the circuit
+    cooldown: float = 300
+    healthy_after: float = 60  # a run this long resets the failure count
+    restart: bool = True  # False for one-shot jobs
+
+
+class Service:
+    def __init__(self, name: str, factory: Callable[[], Awaitable], policy: RestartPolicy):
+        self.name = name
+        self.factory = factory
+        self.policy = policy
+        self.state = ServiceState.STARTING
+        self.restarts = 0
+        self.failures = 0
+        self.last_error = ''
+        self.since = time()
+        self.task: asyncio.Task or None = None
+        metrics.gauge('service_up', lambda: int(self.state == ServiceState.RUNNING), service=name)
+
+    def health(self) -> dict:
+        return {
+            'state': self.state.value,
+            'restarts': self.restarts,
+            'failures': self.failures,
+            'last_error': self.last_error,
+            'since': self.since
+        }
+
+    def _set_state(self, state: ServiceState):
+        if state != self.state:
+            self.state = state
+            self.since = time()
+
+
+# Runs every service with one restart policy: exponential backoff with full jitter,
+# and a circuit breaker that stops hammering a service that keeps failing.
+class Supervisor:
+    def __init__(self, policy: RestartPolicy = None):
+        self.policy = policy or RestartPolicy()
+        self.services: dict[str, Service] = {}
+        self._stopping = asyncio.Event()
+
+    def add(self, name: str, factory: Callable[[], Awaitable], policy: RestartPolicy = None):
+        self.services[name] = Service(name, factory, policy or self.policy)
+
+    def health(self) -> dict[str, dict]:
+        return {name: service.health() for name, service in self.services.items()}
+
+    async def run(self):
+        for service in self.services.values():
+            service.task = asyncio.create_task(self._supervise(service), name=f'service:{service.name}')
+        await self._stopping.wait()
+
+        for service in self.services.values():
+            service.task.cancel()
+        await asyncio.gather(*(service.task for service in self.services.values()), return_exceptions=True)
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def _supervise(self, service: Service):
+        policy = service.policy
+        try:
+            while True:
+                service._set_state(ServiceState.RUNNING)
+                started = monotonic()
+                try:
+                    await service.factory()
+                    if policy.restart:
+                        service.last_error = 'exited'
+                        _log.warning(f'Service {service.name} exited')
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    service.last_error = str(e) or type(e).__name__
+                    _log.error(f'Service {service.name} failed: {service.last_error}')
+                    _log.debug(traceback.format_exc())
+
+                if not policy.restart:
+                    service._set_state(ServiceState.DONE)
+                    return
+
+                if monotonic() - started >= policy.healthy_after:
+                    service.failures = 0
+                service.failures += 1
+                service.restarts += 1
+                metrics.inc('reconnects_total', service=service.name)
+
+                if service.failures >= policy.failure_threshold:
+                    service._set_state(ServiceState.OPEN)
+                    _log.warning(f'Service {service.name} failed {service.failures} times in a row, '
+                                 f'next try in {policy.cooldown:.0f}s')
+                    await asyncio.sleep(policy.cooldown)
+                    service.failures = policy.failure_threshold - 1  # one more failure opens it again
+                else:
+                    delay = random.uniform(0, min(policy.max_backoff, policy.min_backoff * 2 ** service.failures))
+                    service._set_state(ServiceState.BACKOFF)
+                    _log.info(f'Restart {service.name} in {delay:.1f}s')
+                    await asyncio.sleep(delay)
+        finally:
+            if service.state != ServiceState.DONE:
+                service._set_state(ServiceState.STOPPED)
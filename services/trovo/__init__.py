@@ -1,2 +1,2 @@
-from .api import TrovoApi
+from .api import TrovoApi, TrovoApiError
 from .chat import TrovoChat
@@ -40,7 +40,7 @@ class ChannelUserRole(enum.Enum):
     WARDEN = 500001  # Warden of Trovo platform, across all channels, who helps to maintain the platform order
 
 
-@dataclass
+@dataclass(slots=True)
 class TrovoChatMessage:
     type: TrovoChatMessageType
     content: str
@@ -66,11 +66,25 @@ class TrovoChatMessage:
         _nick_name = str(obj.get('nick_name'))
         _avatar = str(obj.get('avatar'))
         _sub_tier = int(obj.get('sub_tier', -1))
-        _medals = list(obj.get('medals', []))
-        _roles = list(obj.get('roles', []))
+        _medals = obj.get('medals') or []
+        _roles = obj.get('roles') or []
         _message_id = str(obj.get('message_id'))
         _sender_id = int(obj.get('sender_id', 0))
         _send_time = int(obj.get('send_time', 0))
 
         return TrovoChatMessage(_type, _content, _nick_name, _avatar, _sub_tier, _medals, _roles,
                                 _message_id, _sender_id, _send_time)
+
+    def to_dict(self) -> dict:
+        return {
+            'type': self.type.value,
+            'content': self.content,
+            'nick_name': self.nick_name,
+            'avatar': self.avatar,
+            'sub_tier': self.sub_tier,
+            'medals': self.medals,
+            'roles': self.roles,
+            'message_id': self.message_id,
+            'sender_id': self.sender_id,
+            'send_time': self.send_time
+        }
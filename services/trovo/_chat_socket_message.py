@@ -1,18 +1,26 @@
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class TrovoChatSocketMessage:
     type: str
     nonce: str
     error: str
-    data: {}
+    data: dict
 
     @staticmethod
     def from_dict(obj: dict) -> 'TrovoChatSocketMessage':
         _type = str(obj.get('type'))
         _nonce = str(obj.get('nonce', ''))
         _error = str(obj.get('error', None))
-        _data = dict(obj.get('data', {}))
+        _data = obj.get('data') or {}  # fresh from the parser, no need to copy
 
         return TrovoChatSocketMessage(_type, _nonce, _error, _data)
+
+    def to_dict(self) -> dict:
+        return {
+            'type': self.type,
+            'nonce': self.nonce,
+            'error': self.error,
+            'data': self.data
+        }
@@ -0,0 +1,24 @@
+import json
+
+from ._chat_message import TrovoChatMessage
+from ._chat_socket_message import TrovoChatSocketMessage
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson parses chat frames several times faster, the stdlib parser is the fallback
+loads = orjson.loads if orjson else json.loads
+
+
+def decode_frame(data: str or bytes) -> TrovoChatSocketMessage:
+    return TrovoChatSocketMessage.from_dict(loads(data))
+
+
+def new_chats(frame: TrovoChatSocketMessage, start_time: int) -> tuple[list[TrovoChatMessage], int]:
+    # the first frame after a connect replays chat history, old entries are dropped
+    # before any message object is built for them
+    chats = frame.data.get('chats') or ()
+    fresh = [TrovoChatMessage.from_dict(chat) for chat in chats if int(chat.get('send_time', 0)) >= start_time]
+    return fresh, len(chats) - len(fresh)
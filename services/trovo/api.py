@@ -1,9 +1,12 @@
+import asyncio
 import json
 import logging
+import random
 from time import time
+from typing import Callable
 from urllib.parse import urlencode
 
-import requests
+import aiohttp
 
 from utils import request_oauth_login_by_user
 
@@ -13,6 +16,11 @@ _log = logging.getLogger(__name__)
 class TrovoAccount:
     access_token: str or None = None
     refresh_token: str or None = None
+    expire_ts: int = 0  # last known expiry of access_token, 0 when unknown
+
+
+class TrovoApiError(Exception):
+    pass
 
 
 class TrovoApi:
@@ -28,6 +36,9 @@ class TrovoApi:
         'manage_messages'           # Perform chat commands and delete chat messages.
     ]
     channel_id = ''
+    timeout = 10
+    retries = 3
+    refresh_margin = 600  # refresh tokens this many seconds before they expire
 
     def __init__(self, client_id: str, client_secret: str, redirect_url: str):
         self.client_id = client_id
@@ -35,32 +46,62 @@ class TrovoApi:
         self.redirect_uri = redirect_url
         self.channel = TrovoAccount()
         self.bot = TrovoAccount()
+        self._session: aiohttp.ClientSession or None = None
+        self._refreshing: dict[int, asyncio.Task] = {}
+        self._chat_token = ''
+        self.on_refresh: Callable[[], None] or None = None  # tokens changed and should be saved
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
 
-    def auth(self) -> bool:
-        success = self._auth(self.channel) and self._auth(self.bot)
-        if success:
-            info = self.get_channel_info()
+    async def auth(self) -> bool:
+        success = await self._auth(self.channel) and await self._auth(self.bot)
+        if success and not self.channel_id:
+            info = await self.get_channel_info()
             self.channel_id = info['channel_id']
         return success
 
-    def _auth(self, acc: TrovoAccount) -> bool:
+    async def _auth(self, acc: TrovoAccount) -> bool:
         if not acc.access_token and not acc.refresh_token:
             _log.info('First auth. Open browser')
-            code = self._get_code(self.scopes)
-            token = self._get_token(code)
-            acc.access_token = token.get('access_token')
-            acc.refresh_token = token.get('refresh_token')
-            return acc.access_token
+            code = await self._get_code(self.scopes)
+            token = await self._get_token(code)
+            self._set_tokens(acc, token)
+            return bool(acc.access_token)
 
-        if acc.refresh_token and not self.is_token_valid(acc.access_token):
-            return self.refresh(acc)
+        if acc.expire_ts > time() + self.refresh_margin:
+            return True  # validated before and not close to expiry, no need to ask again
 
-        return self.is_token_valid(acc.access_token)
+        if await self.is_token_valid(acc):
+            return True
+        return bool(acc.refresh_token) and await self.refresh(acc)
 
-    def _get_token(self, code: str) -> dict:
-        r = requests.post(f'{self.api_url}/exchangetoken', headers={
-            'Accept': 'application/json',
-            'Client-ID': self.client_id,
+    async def keep_fresh(self):
+        # refreshes tokens in the background shortly before they expire,
+        # so neither a reconnect nor a chat message has to wait for it
+        while True:
+            accounts = [acc for acc in (self.channel, self.bot) if acc.expire_ts and acc.refresh_token]
+            if not accounts:
+                await asyncio.sleep(60)
+                continue
+            acc = min(accounts, key=lambda a: a.expire_ts)
+            delay = acc.expire_ts - self.refresh_margin - time()
+            if delay > 0:
+                await asyncio.sleep(min(delay, 300))  # expiry may move, e.g. refreshed by send_message
+                continue
+
+            try:
+                if not await self.refresh(acc):
+                    _log.error('Background token refresh failed')
+                    await asyncio.sleep(60)
+            except TrovoApiError as e:
+                _log.error(f'Background token refresh failed: {e}')
+                await asyncio.sleep(60)
+
+    async def _get_token(self, code: str) -> dict:
+        d = await self._request('POST', '/exchangetoken', retry=False, headers={
             'Content-Type': 'application/json'
         }, json={
             'client_secret': self.client_secret,
@@ -68,113 +109,177 @@ class TrovoApi:
             'code': code,
             'redirect_uri': self.redirect_uri
         })
-        _log.debug(f'First auth response: {r.text}')
-        return json.loads(r.text)
+        _log.debug(f'First auth response: {d}')
+        return d
 
-    def _get_code(self, scopes: list) -> str:
+    async def _get_code(self, scopes: list) -> str:
         d = {
             'client_id': self.client_id,
             'response_type': 'code',
             'scope': '+'.join(scopes),
             'redirect_uri': self.redirect_uri
         }
-        return request_oauth_login_by_user(f'{self.login_url}?{urlencode(d)}')['code'][0]
+        url = f'{self.login_url}?{urlencode(d)}'
+        return (await asyncio.to_thread(request_oauth_login_by_user, url))['code'][0]
 
-    def is_token_valid(self, access_token: str) -> bool:
+    async def is_token_valid(self, acc: TrovoAccount) -> bool:
         _log.info('Check is access token valid')
-        d = self.validate_token(access_token)
+        d = await self.validate_token(acc.access_token)
         if 'error' in d:
             _log.error('Invalid access token. Error: ' + d['error'])
+            acc.expire_ts = 0
             return False
-        if int(d.get('expire_ts')) < time():
+        acc.expire_ts = int(d.get('expire_ts', 0))
+        if acc.expire_ts < time():
             _log.warning('Expired access token')
             return False
         _log.info('Valid access token')
         return True
 
-    def validate_token(self, access_token: str) -> dict:
+    async def validate_token(self, access_token: str) -> dict:
         _log.info('Validate access token')
-        r = requests.get(f'{self.api_url}/validate', headers={
-            'Accept': 'application/json',
-            'Client-ID': self.client_id,
+        d = await self._request('GET', '/validate', headers={
             'Authorization': 'OAuth ' + access_token
         })
-        _log.debug(f'Validate access token response: {r.text}')
-        return json.loads(r.text)
+        _log.debug(f'Validate access token response: {d}')
+        return d
 
-    def refresh(self, acc: TrovoAccount) -> bool:
+    async def refresh(self, acc: TrovoAccount) -> bool:
+        # concurrent callers share one refresh, a refresh token can only be used once
+        task = self._refreshing.get(id(acc))
+        if not task:
+            task = asyncio.create_task(self._refresh(acc))
+            self._refreshing[id(acc)] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(id(acc), None))
+        return await asyncio.shield(task)
+
+    async def _refresh(self, acc: TrovoAccount) -> bool:
         _log.info('Refresh token')
-        r = requests.post(f'{self.api_url}/revoke', headers={
-            'Accept': 'application/json',
-            'Client-ID': self.client_id,
-            'Authorization': 'OAuth ' + acc.access_token
-        }, json={
-            'access_token': acc.access_token
-        })
-        _log.debug(f'Revoke old access token response: {r.text}')
-        r = requests.post(f'{self.api_url}/refreshtoken', headers={
-            'Accept': 'application/json',
-            'Client-ID': self.client_id,
+        d = await self._request('POST', '/refreshtoken', retry=False, headers={
             'Content-Type': 'application/json'
         }, json={
             'client_secret': self.client_secret,
             'grant_type': 'refresh_token',
             'refresh_token': acc.refresh_token
         })
-        _log.debug(f'Refresh access token response: {r.text}')
-        d = json.loads(r.text)
+        _log.debug(f'Refresh access token response: {d}')
+        if 'access_token' not in d:
+            # keep the old tokens, saving the error would lose the refresh token for good
+            _log.error(f'Can\'t refresh token: {d}')
+            return False
+
+        old_token = acc.access_token
+        self._set_tokens(acc, d)
+        if acc is self.channel:
+            self._chat_token = ''
+        if self.on_refresh:
+            self.on_refresh()
+
+        # the old token goes only once the new one is in hand and saved
+        try:
+            d = await self._request('POST', '/revoke', headers={
+                'Authorization': 'OAuth ' + old_token
+            }, json={
+                'access_token': old_token
+            })
+            _log.debug(f'Revoke old access token response: {d}')
+        except TrovoApiError as e:
+            _log.warning(f'Can\'t revoke old access token: {e}')
+        return bool(acc.access_token)
+
+    @staticmethod
+    def _set_tokens(acc: TrovoAccount, d: dict):
         acc.access_token = d.get('access_token')
         acc.refresh_token = d.get('refresh_token')
-        return acc.access_token
-
-    def send_message(self, msg: str, times: int = 1):
-        if times > 3:
-            _log.error(f'Can\'t send message {msg}')
-            return
+        # expires_in is seconds from now, without it the next auth validates the token again
+        acc.expire_ts = int(time()) + int(d['expires_in']) if d.get('expires_in') else 0
 
+    async def send_message(self, msg: str):
         _log.info(f'Send message: {msg}')
-        r = requests.post(f'{self.api_url}/chat/send', headers={
-            'Accept': 'application/json',
-            'Client-ID': self.client_id,
-            'Authorization': 'OAuth ' + self.bot.access_token,
-            'Content-Type': 'application/json'
-        }, json={
-            'content': msg,
-            'channel_id': self.channel_id
-        })
-        _log.debug(f'Send message response: {r.text}')
+        for _ in range(2):
+            token = self.bot.access_token
+            d = await self._request('POST', '/chat/send', retry=False, headers={
+                'Authorization': 'OAuth ' + token,
+                'Content-Type': 'application/json'
+            }, json={
+                'content': msg,
+                'channel_id': self.channel_id
+            })
+            _log.debug(f'Send message response: {d}')
+
+            if d.get('error') != 'accessTokenExpired':
+                return
+            if self.bot.access_token == token:  # not refreshed by someone else yet
+                await self.refresh(self.bot)
 
-        if r.text != '' and json.loads(r.text).get('error') == 'accessTokenExpired':
-            self.auth()
-            self.send_message(msg, times + 1)
+        _log.error(f'Can\'t send message {msg}')
 
-    def get_channel_chat_token(self) -> str:
+    async def get_channel_chat_token(self) -> str:
+        # reused across reconnects until the socket rejects it or the channel token changes
+        if self._chat_token:
+            return self._chat_token
         _log.info('Get channel chat token')
-        r = requests.get(f'{self.api_url}/chat/channel-token/{self.channel_id}', headers={
-            'Accept': 'application/json',
-            'Client-ID': self.client_id,
+        d = await self._request('GET', f'/chat/channel-token/{self.channel_id}', headers={
             'Authorization': 'OAuth ' + self.channel.access_token
         })
-        _log.debug(f'Get channel chat token response: {r.text}')
-        d = json.loads(r.text)
-        return d.get('token', '')
+        _log.debug(f'Get channel chat token response: {d}')
+        self._chat_token = d.get('token', '')
+        return self._chat_token
+
+    def forget_chat_token(self):
+        self._chat_token = ''
 
-    def get_channel_info(self) -> dict:
+    async def get_channel_info(self) -> dict:
         _log.info('Get channel info')
-        r = requests.get(f'{self.api_url}/channel', headers={
-            'Accept': 'application/json',
-            'Client-ID': self.client_id,
+        return await self._request('GET', '/channel', headers={
             'Authorization': 'OAuth ' + self.channel.access_token
         })
-        return json.loads(r.text)
 
-    def get_users(self, user_names: list) -> dict:
+    async def get_users(self, user_names: list) -> dict:
         _log.info(f'Get users info: ' + ', '.join(user_names))
-        r = requests.post(f'{self.api_url}/getusers', headers={
-            'Accept': 'application/json',
-            'Client-ID': self.client_id
-        }, json={
+        d = await self._request('POST', '/getusers', json={
             'user': user_names
         })
-        _log.debug(f'Get users info response: {r.text}')
-        return json.loads(r.text)
+        _log.debug(f'Get users info response: {d}')
+        return d
+
+    async def _request(self, method: str, path: str, *, headers: dict = None, json: dict = None,
+                       retry: bool = True) -> dict:
+        # retry=False for calls that must not run twice, a sent chat line or a used up code or
+        # refresh token. They are only retried when the connection couldn't even be opened.
+        if not self._session:
+            # one pooled keep-alive session instead of a new tls connection per call
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=10, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+
+        headers = {
+            'Accept': 'application/json',
+            'Client-ID': self.client_id,
+            **(headers or {})
+        }
+        for attempt in range(self.retries):
+            try:
+                async with self._session.request(method, self.api_url + path, headers=headers, json=json) as r:
+                    if r.status < 500:
+                        return _parse(path, r.status, await r.text())
+                    error = f'HTTP {r.status}'
+                    delivered = True
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = str(e) or type(e).__name__
+                delivered = not isinstance(e, aiohttp.ClientConnectorError)
+
+            if attempt == self.retries - 1 or (delivered and not retry):
+                raise TrovoApiError(f'Trovo api {path} failed: {error}')
+            delay = 0.5 * 2 ** attempt * random.uniform(0.5, 1.5)
+            _log.warning(f'Trovo api {path} failed ({error}), retry in {delay:.1f}s')
+            await asyncio.sleep(delay)
+
+
+def _parse(path: str, status: int, text: str) -> dict:
+    try:
+        return json.loads(text) if text else {}
+    except ValueError:
+        # e.g. an html error page of a proxy with a 429
+        raise TrovoApiError(f'Trovo api {path} failed: HTTP {status}, not json: {text[:200]!r}') from None
@@ -3,24 +3,29 @@ import json
 import logging
 import random
 import string
-import traceback
 from time import time
 
 import websockets
 
 import db
+import metrics
+import startup
 from commands import trigger_commands
 from models import ChatBot, PointsType, ChatMessage, UserData
-from .api import TrovoApi
+from services import events
+from services.outbound import OutboundQueue, ChatOutbox, TROVO_LIMIT
+from .api import TrovoApi, TrovoApiError
+from .resolver import TrovoUserResolver
 from ._chat_message import TrovoChatMessage, TrovoChatMessageType
 from ._chat_socket_message import TrovoChatSocketMessage
+from ._frames import decode_frame, new_chats
 
 _log = logging.getLogger(__name__)
+_frame_log = logging.getLogger('services.trovo.frames')  # off unless enabled in LOG_LEVELS
 
 
 class TrovoChat(ChatBot):
     chat_url = 'wss://open-chat.trovo.live/chat'
-    request_queue = []
     active = False
     start_time = 0
     last_pong_time = 0
@@ -29,44 +34,57 @@ class TrovoChat(ChatBot):
 
     def __init__(self, client_id: str, client_secret: str, redirect_url: str):
         self.api = TrovoApi(client_id, client_secret, redirect_url)
+        self.request_queue = OutboundQueue('Trovo socket')
+        self.message_queue = ChatOutbox('Trovo', TROVO_LIMIT)
+        self.api.on_refresh = self.save
+        self.resolver = TrovoUserResolver(self.api)
+        self._resolving: set[asyncio.Task] = set()
+        self._auth_task: asyncio.Task or None = None
 
     async def run(self):
-        async for ws in websockets.connect(self.chat_url):
+        # one connection per call, reconnects are up to the supervisor
+        keep_fresh = asyncio.create_task(self.api.keep_fresh())
+        try:
             self.load()
-            if not self.api.auth():
-                _log.critical('Auth error')
-                return
+            if not await self.api.auth():
+                raise TrovoApiError('Auth error')
             self.save()
-
-            self.request_queue.clear()
-            self.active = True
-            self.start_time = int(time())
-            self.last_pong_time = 0
-            self.heartbeat_gap = 30
-
-            tasks = [
-                asyncio.create_task(self._ping_pong_loop()),
-                asyncio.create_task(self._response_loop(ws)),
-                asyncio.create_task(self._request_loop(ws))
-            ]
-            try:
-                await asyncio.gather(*tasks)
-            except Exception as e:
-                _log.error(f'Chat loop crashed: {e}')
-                _log.debug(traceback.format_exc())
-                for task in tasks:
-                    task.cancel()
-
-            if not self.active:
-                break
-
-            await asyncio.sleep(5)
+            startup.mark('trovo auth')
+
+            async with websockets.connect(self.chat_url) as ws:
+                startup.mark('trovo connected')
+                self.request_queue.clear()
+                self.request_queue.bind()
+                self.message_queue.bind()
+                self.active = True
+                self.start_time = int(time())
+                self.last_pong_time = 0
+                self.heartbeat_gap = 30
+
+                tasks = [
+                    asyncio.create_task(self._ping_pong_loop()),
+                    asyncio.create_task(self._response_loop(ws)),
+                    asyncio.create_task(self._request_loop(ws)),
+                    asyncio.create_task(self._send_loop())
+                ]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    self.active = False
+                    for task in tasks:
+                        task.cancel()
+        finally:
+            keep_fresh.cancel()
+            await self.api.close()
 
     async def _ping_pong_loop(self):
         _log.info(f'Ping-pong loop started')
         while self.active:
+            if self.last_pong_time + self.heartbeat_gap * 2 < time():
+                await self._chat_auth()
+
             await asyncio.sleep(self.heartbeat_gap)
-            self.request_queue.append({
+            self.request_queue.put({
                 'type': 'PING',
                 'nonce': self.get_new_nonce()
             })
@@ -75,31 +93,35 @@ class TrovoChat(ChatBot):
         _log.info(f'Response loop started')
         while self.active:
             data = await ws.recv()
-            _log.debug(f'Response: {data}')
-            raw_msg = TrovoChatSocketMessage.from_dict(json.loads(data))
-            self._process_message(raw_msg)
+            _frame_log.debug('Response: %s', data)
+            await db.wait_ready()
+            self._process_message(decode_frame(data))
 
     async def _request_loop(self, ws):
         _log.info(f'Request loop started')
         while self.active:
-            if self.last_pong_time + self.heartbeat_gap * 2 < time():
-                self._chat_auth()
-
-            if len(self.request_queue) == 0:
-                await asyncio.sleep(0.1)
-                continue
-
-            msg = self.request_queue.pop(0)
+            msg = await self.request_queue.get()
             data = json.dumps(msg)
-            _log.debug(f'Request: {data}')
+            _frame_log.debug('Request: %s', data)
             await ws.send(data)
+            self.request_queue.task_done()
 
-    def _chat_auth(self):
-        self.request_queue.append({
+    async def _send_loop(self):
+        while self.active:
+            msg = await self.message_queue.next_line()
+            try:
+                await self.api.send_message(msg)
+            except TrovoApiError as e:
+                _log.error(f'Can\'t send message {msg}: {e}')
+            finally:
+                self.message_queue.task_done()
+
+    async def _chat_auth(self):
+        self.request_queue.put({
             'type': 'AUTH',
             'nonce': self.get_new_nonce(),
             'data': {
-                'token': self.api.get_channel_chat_token()
+                'token': await self.api.get_channel_chat_token()
             }
         })
         self.last_pong_time = time()
@@ -107,6 +129,12 @@ class TrovoChat(ChatBot):
     def _process_message(self, raw_msg: TrovoChatSocketMessage):
         match raw_msg.type:
             case "RESPONSE":
+                if raw_msg.error != 'None':
+                    # the cached chat token was rejected, get a new one
+                    _log.warning(f'Chat auth failed: {raw_msg.error}')
+                    self.api.forget_chat_token()
+                    self._auth_task = asyncio.create_task(self._chat_auth())
+                    return
                 self.send_message('Awakening')
 
             case "PONG":
@@ -114,18 +142,32 @@ class TrovoChat(ChatBot):
                 self.heartbeat_gap = raw_msg.data.get('gap', 30)
 
             case "CHAT":
-                for raw_chat_msg in raw_msg.data.get('chats', []):
-                    msg = TrovoChatMessage.from_dict(raw_chat_msg)
-                    if msg.send_time >= self.start_time:
-                        user = db.find_user(msg.nick_name, trovo_id=msg.sender_id)
-                        self._check_donation(msg, user)
-                        trigger_commands(ChatMessage(
-                            text=msg.content,
-                            sender=user,
-                            roles=msg.roles
-                        ), self)
+                chats, old = new_chats(raw_msg, self.start_time)
+                metrics.inc('messages_received_total', len(chats), service='trovo')
+                if old:
+                    _log.debug('Ignored %d old messages', old)
+                for msg in chats:
+                    if msg.sender_id:
+                        self.resolver.remember(msg.nick_name, msg.sender_id)
+                        self._process_chat_message(msg, msg.sender_id)
                     else:
-                        _log.debug(f'Old message "{msg.content}" ignored')
+                        # no sender id, look it up so the points don't land on a stale nick
+                        task = asyncio.create_task(self._resolve_chat_message(msg))
+                        self._resolving.add(task)
+                        task.add_done_callback(self._resolving.discard)
+
+    async def _resolve_chat_message(self, msg: TrovoChatMessage):
+        self._process_chat_message(msg, await self.resolver.resolve(msg.nick_name))
+
+    def _process_chat_message(self, msg: TrovoChatMessage, trovo_id: int):
+        startup.first_message('trovo')
+        user = db.find_user(msg.nick_name, trovo_id=trovo_id or -1)
+        self._check_donation(msg, user)
+        trigger_commands(ChatMessage(
+            text=msg.content,
+            sender=user,
+            roles=msg.roles
+        ), self)
 
     def _check_donation(self, msg: TrovoChatMessage, user: UserData):
         if msg.type == TrovoChatMessageType.SPELLS:
@@ -133,12 +175,15 @@ class TrovoChat(ChatBot):
             value = content.get('gift_value')
             num = content.get('num')
             if content.get('value_type') == 'Mana':
-                db.add_points(user, num * value, PointsType.Mana, bot=self)
+                db.add_points(user, num * value, PointsType.Mana, bot=self, source='trovo:spell')
             elif content.get('value_type') == 'Elixir':
-                db.add_points(user, num * value, PointsType.Elixir, bot=self)
+                db.add_points(user, num * value, PointsType.Elixir, bot=self, source='trovo:spell')
+            events.publish('spell', platform='trovo', user=user.name, gift=content.get('gift'), num=num,
+                           value=value, value_type=content.get('value_type'))
 
         elif msg.type == TrovoChatMessageType.SUBSCRIPTION_MESSAGE:
-            db.add_points(user, 500, PointsType.Elixir, bot=self)
+            db.add_points(user, 500, PointsType.Elixir, bot=self, source='trovo:subscription')
+            events.publish('subscription', platform='trovo', user=user.name)
 
     def load(self):
         auth = db.load('accounts/trovo.json')
@@ -146,17 +191,27 @@ class TrovoChat(ChatBot):
         self.api.channel.refresh_token = auth.get('refresh_token')
         self.api.bot.access_token = auth.get('bot_access_token')
         self.api.bot.refresh_token = auth.get('bot_refresh_token')
+        self.api.channel.expire_ts = auth.get('expire_ts', 0)
+        self.api.bot.expire_ts = auth.get('bot_expire_ts', 0)
+        self.api.channel_id = auth.get('channel_id', '')
 
     def save(self):
         db.save('accounts/trovo.json', {
             'access_token': self.api.channel.access_token,
             'refresh_token': self.api.channel.refresh_token,
             'bot_access_token': self.api.bot.access_token,
-            'bot_refresh_token': self.api.bot.refresh_token
+            'bot_refresh_token': self.api.bot.refresh_token,
+            'expire_ts': self.api.channel.expire_ts,
+            'bot_expire_ts': self.api.bot.expire_ts,
+            'channel_id': self.api.channel_id
         })
 
     def send_message(self, msg: str):
-        return self.api.send_message(msg)
+        self.message_queue.put(msg)
+
+    async def user_ids(self, name: str) -> dict[str, int]:
+        trovo_id = await self.resolver.resolve(name)
+        return {'trovo_id': trovo_id} if trovo_id else {}
 
     @staticmethod
     def get_new_nonce() -> str:
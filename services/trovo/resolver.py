@@ -0,0 +1,94 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from time import monotonic
+
+from .api import TrovoApi, TrovoApiError
+
+_log = logging.getLogger(__name__)
+
+
+# Nickname -> trovo user id. Lookups within a short window go out as one getusers call,
+# answers are kept in a bounded LRU cache, so a busy chat costs no request per message.
+class TrovoUserResolver:
+    def __init__(self, api: TrovoApi, *, window: float = 0.2, max_batch: int = 100,
+                 cache_size: int = 5000, ttl: float = 3600, negative_ttl: float = 60):
+        self.api = api
+        self.window = window
+        self.max_batch = max_batch
+        self.cache_size = cache_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[str, tuple[int, float]] = OrderedDict()  # name key -> user id (0 unknown), expires
+        self._pending: dict[str, asyncio.Future] = {}
+        self._timer: asyncio.TimerHandle or None = None
+        self._sending: set[asyncio.Task] = set()
+
+    def remember(self, name: str, user_id: int):
+        # chat messages carry both, every message keeps its sender warm for free
+        self._store(name.casefold(), user_id, self.ttl)
+
+    async def resolve(self, name: str) -> int:
+        key = name.casefold()
+        cached = self._cache.get(key)
+        if cached and cached[1] > monotonic():
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached[0]
+
+        self.misses += 1
+        future = self._pending.get(key)
+        if not future:
+            loop = asyncio.get_running_loop()
+            future = self._pending[key] = loop.create_future()
+            if len(self._pending) >= self.max_batch:
+                self._send_pending()
+            elif not self._timer:
+                self._timer = loop.call_later(self.window, self._on_window_end)
+        # shielded, one caller giving up must not cancel the answer for the others
+        return await asyncio.shield(future)
+
+    def _on_window_end(self):
+        self._timer = None
+        self._send_pending()
+
+    def _send_pending(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.create_task(self._resolve_batch(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _resolve_batch(self, batch: dict[str, asyncio.Future]):
+        try:
+            d = await self.api.get_users(list(batch))
+        except TrovoApiError as e:
+            _log.error(f'Can\'t resolve trovo users: {e}')
+            for future in batch.values():
+                if not future.done():
+                    future.set_result(0)  # not cached, the next lookup asks again
+            return
+
+        found = {}
+        for user in d.get('users', []):
+            user_id = int(user.get('user_id', 0))
+            for field in ('username', 'nickname'):  # getusers says nickname, chat messages nick_name
+                if user.get(field):
+                    found[str(user[field]).casefold()] = user_id
+
+        for key, future in batch.items():
+            user_id = found.get(key, 0)
+            self._store(key, user_id, self.ttl if user_id else self.negative_ttl)
+            if not future.done():
+                future.set_result(user_id)
+
+    def _store(self, key: str, user_id: int, ttl: float):
+        self._cache[key] = (user_id, monotonic() + ttl)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
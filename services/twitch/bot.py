@@ -1,6 +1,6 @@
 import asyncio
 import logging
-import time
+from time import monotonic
 
 from twitchAPI import UserAuthenticator, Chat
 from twitchAPI.chat import EventData, ChatMessage, ChatSub
@@ -12,8 +12,11 @@ from twitchAPI.types import AuthScope, InvalidRefreshTokenException, ChatEvent
 
 import commands
 import db
+import metrics
 import models
+import startup
 from models import ChatBot
+from services.outbound import ChatOutbox, TWITCH_LIMIT
 
 _log = logging.getLogger(__name__)
 
@@ -33,36 +36,24 @@ class TwitchBot(ChatBot):
         AuthScope.MODERATOR_MANAGE_CHAT_MESSAGES,
         AuthScope.MODERATOR_READ_FOLLOWERS
     ]
-    message_queue = []
+    announce_gap = 1800
+    keepalive_gap = 10
+    reconnect_grace = 60  # seconds twitchAPI gets to reconnect by itself
 
     def __init__(self, client_id: str, client_secret: str, redirect_url: str, channel_name: str):
         self.client_id = client_id
         self.client_secret = client_secret
         self.redirect_url = redirect_url
         self.channel_name = channel_name
+        self.message_queue = ChatOutbox('Twitch', TWITCH_LIMIT)
 
     async def run(self):
         async def on_ready(ready_event: EventData):
             _log.info("Twitch chat ready")
+            startup.mark('twitch connected')
             await ready_event.chat.join_room(self.channel_name)
             await ready_event.chat.send_message(self.channel_name, 'Awakening')
 
-        async def on_message(msg: ChatMessage):
-            user = db.find_user(msg.user.name, twitch_id=int(msg.user.id))
-
-            try:
-                roles = msg.user.badges.keys()
-            except AttributeError:
-                roles = []
-
-            message = models.ChatMessage(
-                text=msg.text,
-                sender=user,
-                roles=roles
-            )
-            commands.trigger_commands(message, self)
-            _log.debug(f'Message received: {msg.text}')
-
         async def on_sub(sub: ChatSub):
             _log.info(f'New subscription [{sub.sub_plan}]: {sub.sub_message}')
 
@@ -72,31 +63,76 @@ class TwitchBot(ChatBot):
         self.save()
         self.user = await first(self.twitch.get_users(logins=[self.channel_name]))
         await self.twitch.set_user_authentication(self.access_token, self.scope, self.refresh_token)
+        startup.mark('twitch auth')
 
         self.chat = await Chat(self.twitch)
         self.chat.register_event(ChatEvent.READY, on_ready)
-        self.chat.register_event(ChatEvent.MESSAGE, on_message)
+        self.chat.register_event(ChatEvent.MESSAGE, self._on_message)
         self.chat.register_event(ChatEvent.SUB, on_sub)
-        self.chat.start()
+        await asyncio.to_thread(self.chat.start)  # waits for the irc connect in a polling loop
 
         self.message_queue.clear()
+        self.message_queue.bind()
 
-        last_announce_time = time.time()
-        while True:
-            if time.time() - last_announce_time > 1800:
-                last_announce_time = time.time()
-                self.send_message('Trovo: https://trovo.live/DArkHekRoMaNT')
-                self.send_message('Дискорд-сервер: https://discord.gg/WE43bcx4EK')
-
-            if not self.chat.is_connected:
-                self.chat.stop()
-                self.chat.start()
+        tasks = [
+            asyncio.create_task(self._send_loop()),
+            asyncio.create_task(self._announce_loop()),
+            asyncio.create_task(self._watch_connection())
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.chat.stop()
+            await self.twitch.close()
+
+    async def _on_message(self, msg: ChatMessage):
+        metrics.inc('messages_received_total', service='twitch')
+        startup.first_message('twitch')
+        await db.wait_ready()
+        user = db.find_user(msg.user.name, twitch_id=int(msg.user.id))
 
-            if len(self.message_queue) > 0:
-                chat_msg = self.message_queue.pop(0)
+        try:
+            roles = msg.user.badges.keys()
+        except AttributeError:
+            roles = []
+
+        message = models.ChatMessage(
+            text=msg.text,
+            sender=user,
+            roles=roles
+        )
+        commands.trigger_commands(message, self)
+        _log.debug('Message received: %s', msg.text)
+
+    async def _send_loop(self):
+        while True:
+            self.message_queue.moderator = self.chat.is_mod(self.channel_name)
+            chat_msg = await self.message_queue.next_line()
+            try:
                 await self.chat.send_message(self.channel_name, chat_msg)
-            else:
-                await asyncio.sleep(0.1)
+            finally:
+                self.message_queue.task_done()
+
+    async def _announce_loop(self):
+        while True:
+            await asyncio.sleep(self.announce_gap)
+            self.send_message('Trovo: https://trovo.live/DArkHekRoMaNT')
+            self.send_message('Дискорд-сервер: https://discord.gg/WE43bcx4EK')
+
+    async def _watch_connection(self):
+        # the chat reconnects by itself, a short disconnect is part of that. Only a chat
+        # that stays down for reconnect_grace is given up, then the supervisor starts the bot over
+        down_since = None
+        while True:
+            await asyncio.sleep(self.keepalive_gap)
+            if self.chat.is_connected():
+                down_since = None
+            elif down_since is None:
+                down_since = monotonic()
+            elif monotonic() - down_since >= self.reconnect_grace:
+                raise ConnectionError(f'Twitch chat disconnected for {monotonic() - down_since:.0f}s')
 
     async def auth(self):
         try:
@@ -119,4 +155,4 @@ class TwitchBot(ChatBot):
         self.refresh_token = data.get('refresh_token', self.refresh_token)
 
     def send_message(self, msg: str):
-        self.message_queue.append(msg)
+        self.message_queue.put(msg)
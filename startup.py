@@ -0,0 +1,56 @@
+import logging
+import threading
+from time import perf_counter
+
+_log = logging.getLogger(__name__)
+
+# Seconds from process start to each startup phase, the first time it is reached.
+# Reconnects later on don't move the marks.
+_started = perf_counter()
+_marks: dict[str, float] = {}
+_lock = threading.Lock()
+_reported = False
+
+
+def reset():
+    global _started, _reported
+    with _lock:
+        _started = perf_counter()
+        _marks.clear()
+        _reported = False
+
+
+def mark(phase: str):
+    # callable from any thread, twitchAPI runs its chat in its own loop
+    if phase in _marks:
+        return
+    with _lock:
+        _marks.setdefault(phase, perf_counter() - _started)
+
+
+def marks() -> dict[str, float]:
+    with _lock:
+        return dict(sorted(_marks.items(), key=lambda item: item[1]))
+
+
+def first_message(service: str):
+    # on every chat message, only the very first one costs more than a bool check
+    global _reported
+    if _reported:
+        return
+    with _lock:
+        if _reported:
+            return
+        _reported = True
+    mark(f'{service} first message')
+    _log.info(report())
+
+
+def report() -> str:
+    # each phase with its time since start and the time since the phase before it
+    lines = ['Startup timing:']
+    previous = 0.0
+    for phase, at in marks().items():
+        lines.append(f'  {phase:<32} {at:7.3f}s  +{at - previous:.3f}s')
+        previous = at
+    return '\n'.join(lines)
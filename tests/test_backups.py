@@ -0,0 +1,53 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import metrics
+from db import backups
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data' / 'accounts').mkdir(parents=True)
+    (tmp_path / 'data' / 'users.json').write_text('[]')
+    (tmp_path / 'data' / 'accounts' / 'trovo.json').write_text('{}')
+    return tmp_path
+
+
+def test_unchanged_files_are_linked(workdir):
+    first = os.path.join('backups', 'backup_2000-01-01-00-00-00')
+    os.rename(backups.create('data'), first)  # both would get the same name within a second
+    os.utime(workdir / 'data' / 'users.json', ns=(0, 0))
+    second = backups.create('data')
+
+    assert os.path.samefile(os.path.join(first, 'accounts', 'trovo.json'),
+                            os.path.join(second, 'accounts', 'trovo.json'))
+    assert not os.path.samefile(os.path.join(first, 'users.json'), os.path.join(second, 'users.json'))
+
+
+def test_prune_keeps_recent_daily_and_weekly(workdir, monkeypatch):
+    monkeypatch.setattr(backups, 'keep_last', 2)
+    monkeypatch.setattr(backups, 'keep_daily', 3)
+    monkeypatch.setattr(backups, 'keep_weekly', 2)
+    now = datetime(2024, 5, 15, 12)
+    names = []
+    for hours in [0, 1, 2, 26, 27, 24 * 10, 24 * 20]:
+        name = 'backup_' + (now - timedelta(hours=hours)).strftime('%Y-%m-%d-%H-%M-%S')
+        (workdir / 'backups' / name).mkdir(parents=True)
+        names.append(name)
+
+    removed = backups.prune(now)
+    # two newest, the newest of yesterday, the newest of the previous week
+    assert sorted(removed) == sorted([names[2], names[4], names[6]])
+
+
+def test_backup_time_is_observed(workdir, monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    metrics.reset()
+    backups.create('data')
+    text = metrics.render()
+    metrics.reset()
+
+    assert 'backup_seconds_count 1' in text
@@ -0,0 +1,64 @@
+import asyncio
+
+from services.factorio.batcher import LuaBatcher, build_chunk, lua_literal
+from services.factorio.rcon import RconError
+
+
+class FakeClient:
+    def __init__(self, output: str = None):
+        self.chunks = []
+        self.output = output
+
+    async def execute(self, chunk: str) -> str:
+        self.chunks.append(chunk)
+        if self.output is None:
+            return '\n'.join('ok' for _ in range(chunk.count('}, {') + 1))
+        return self.output
+
+
+def test_lua_literal_escapes_strings():
+    assert lua_literal('a"b\\c\nd') == '"a\\"b\\\\c\\nd"'
+    assert lua_literal(100) == '100'
+
+
+def test_build_chunk():
+    chunk = build_chunk([('spawn_biters', ('streamer',)), ('give_item', ('streamer', 100))])
+    assert chunk.startswith('/ca ')
+    assert '\n' not in chunk
+    assert '{{"spawn_biters", "streamer"}, {"give_item", "streamer", 100}}' in chunk
+
+
+def test_calls_in_one_window_share_one_round_trip():
+    async def run():
+        client = FakeClient()
+        batcher = LuaBatcher(client, window=0.05)
+        await asyncio.gather(*(batcher.call('spawn_biters', 'streamer') for _ in range(5)))
+        return client
+
+    assert len(asyncio.run(run()).chunks) == 1
+
+
+def test_failure_is_reported_to_its_caller_only():
+    async def run():
+        batcher = LuaBatcher(FakeClient('ok\nerror: Unknown player nobody\nok'), window=0.05)
+        return await asyncio.gather(
+            batcher.call('spawn_biters', 'streamer'),
+            batcher.call('spawn_biters', 'nobody'),
+            batcher.call('drop_all', 'streamer'),
+            return_exceptions=True
+        )
+
+    first, second, third = asyncio.run(run())
+    assert first is None and third is None
+    assert isinstance(second, RconError)
+    assert 'Unknown player nobody' in str(second)
+
+
+def test_max_batch_sends_without_waiting():
+    async def run():
+        client = FakeClient()
+        batcher = LuaBatcher(client, window=10, max_batch=2)
+        await asyncio.wait_for(asyncio.gather(batcher.call('a'), batcher.call('b')), 1)
+        return client
+
+    assert len(asyncio.run(run()).chunks) == 1
@@ -0,0 +1,215 @@
+import asyncio
+import importlib
+
+import pytest
+
+import commands
+import db
+from models import ChatBot, ChatMessage, PointsType, UserData
+
+_commands = importlib.import_module('commands.commands')
+
+
+class FakeBot(ChatBot):
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, msg: str):
+        self.messages.append(msg)
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db.init(interval=60)
+    yield tmp_path
+    db.close()
+
+
+@pytest.fixture
+def command():
+    # registers test commands and removes them afterwards, so they don't show up in later tests
+    registered = []
+
+    def register(*args, **kwargs):
+        def decorator(func):
+            wrapper = commands.command(*args, **kwargs)(func)
+            registered.append(wrapper)
+            return wrapper
+        return decorator
+
+    yield register
+    for wrapper in registered:
+        _commands.commands.remove(wrapper)
+        _commands._remove_from_dispatch_table(wrapper)
+
+
+def dispatch(*messages: ChatMessage, bot: ChatBot = None) -> ChatBot:
+    bot = bot or FakeBot()
+
+    async def run():
+        for msg in messages:
+            commands.trigger_commands(msg, bot)
+        await commands.wait_commands()
+
+    asyncio.run(run())
+    return bot
+
+
+def message(text: str, *roles: str, mana: int = 0) -> ChatMessage:
+    return ChatMessage(text, UserData('viewer', mana, 0, -1, -1), list(roles))
+
+
+def test_dispatch_by_name_and_alias():
+    bot = dispatch(message('!points'), message('!P extra args'), message('points'), message('!pointsx'))
+    assert bot.messages == ['viewer: 0 mp, 0 ep', 'viewer: 0 mp, 0 ep']
+
+
+def test_module_toggle_updates_dispatch_table(command):
+    calls = []
+
+    @command('test_toggle', aliases=['tt'], module='test')
+    def toggle_command(msg, bot):
+        calls.append(msg.text)
+
+    dispatch(message('!tt'))
+    commands.enable_module('test')
+    dispatch(message('!tt'), message('!test_toggle'))
+    commands.disable_module('test')
+    dispatch(message('!tt'))
+    assert calls == ['!tt', '!test_toggle']
+
+
+def test_paid_command_deducts_points(command):
+    @command('test_paid', mana=10, elixir=10)
+    def paid_command(msg, bot):
+        pass
+
+    bot = dispatch(message('!test_paid', mana=5))
+    assert bot.messages == ['@viewer не хватает (10 ep или 10 mp)']
+
+    rich = message('!test_paid', mana=15)
+    dispatch(rich)
+    assert rich.sender.mana == 5
+
+
+def test_command_priced_in_one_currency_says_what_is_missing(command):
+    @command('test_mana_only', mana=10)
+    def mana_only_command(msg, bot):
+        bot.send_message('done')
+
+    msg = message('!test_mana_only', mana=5)
+    bot = dispatch(msg)
+    assert bot.messages == ['@viewer не хватает (10 mp)']
+    assert msg.sender.mana == 5
+
+
+def test_timed_out_sync_command_is_not_refunded(command):
+    @command('test_stuck', mana=10, timeout=0.05)
+    def stuck_command(msg, bot):
+        import time
+        time.sleep(0.2)  # still running after the timeout, its effect may land
+
+    msg = message('!test_stuck', mana=15)
+    bot = dispatch(msg)
+    assert msg.sender.mana == 5
+    assert bot.messages == []
+
+
+def test_failed_command_refunds_points(command):
+    @command('test_failing', mana=10, elixir=10)
+    async def failing_command(msg, bot):
+        raise RuntimeError('rcon is down')
+
+    msg = message('!test_failing', mana=15)
+    bot = dispatch(msg)
+    assert msg.sender.mana == 15
+    assert bot.messages == ['@viewer !test_failing не сработала, очки возвращены']
+
+
+def test_slow_command_does_not_block_others(command):
+    @command('test_slow', timeout=0.1)
+    def slow_command(msg, bot):
+        import time
+        time.sleep(0.3)
+
+    @command('test_fast')
+    async def fast_command(msg, bot):
+        bot.send_message('fast')
+
+    async def run():
+        bot = FakeBot()
+        commands.trigger_commands(message('!test_slow'), bot)
+        commands.trigger_commands(message('!test_fast'), bot)
+        await asyncio.sleep(0.05)
+        assert bot.messages == ['fast']
+        await commands.wait_commands()
+
+    asyncio.run(run())
+
+
+def test_concurrency_limit(command):
+    active = []
+    peak = []
+
+    @command('test_limited', concurrency=1)
+    async def limited_command(msg, bot):
+        active.append(msg)
+        peak.append(len(active))
+        await asyncio.sleep(0.01)
+        active.remove(msg)
+
+    dispatch(message('!test_limited'), message('!test_limited'), message('!test_limited'))
+    assert peak == [1, 1, 1]
+
+
+def test_link_needs_both_platforms():
+    trovo, twitch = FakeBot(), FakeBot()
+    alice = db.find_user('alice', trovo_id=1)
+    db.add_points(alice, 5, PointsType.Mana)
+    twitch_alice = db.find_user('alice_tw', twitch_id=2)
+    db.add_points(twitch_alice, 3, PointsType.Mana)
+
+    dispatch(ChatMessage('!link alice_tw', alice, []), bot=trovo)
+    dispatch(ChatMessage('!link alice', db.find_user('mallory', twitch_id=3), []), bot=twitch)
+    assert alice.mana == 5  # alice named alice_tw, not mallory
+
+    dispatch(ChatMessage('!link alice', twitch_alice, []), bot=twitch)
+    assert (alice.mana, alice.twitch_id) == (8, 2)
+    assert db.find_user('x', twitch_id=2) is alice
+    assert twitch.messages[-1] == '@alice_tw linked with alice: 8 mp, 0 ep'
+
+
+def test_merge_command_is_for_the_streamer():
+    donor = db.find_user('Donor')
+    db.add_points(donor, 100, PointsType.Elixir)
+    viewer = db.find_user('viewer', trovo_id=1)
+
+    dispatch(ChatMessage('!merge Donor viewer', viewer, []))
+    assert donor.elixir == 100
+    bot = dispatch(ChatMessage('!merge @Donor @viewer', viewer, ['streamer']))
+    assert bot.messages == ['Donor merged into viewer: 0 mp, 100 ep']
+    assert db.find_user('donor') is viewer
+
+
+def test_commands_from_another_loop_run_on_the_bound_loop(command):
+    loops = []
+
+    @command('test_loop')
+    async def loop_command(msg, bot):
+        loops.append(asyncio.get_running_loop())
+
+    async def from_twitch():
+        commands.trigger_commands(message('!test_loop'), FakeBot())
+
+    async def run():
+        commands.bind()
+        try:
+            await asyncio.to_thread(asyncio.run, from_twitch())
+            await asyncio.sleep(0.01)
+            await commands.wait_commands()
+            assert loops == [asyncio.get_running_loop()]
+        finally:
+            _commands._loop = None
+
+    asyncio.run(run())
@@ -0,0 +1,348 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+import pytest
+
+import db
+from db.ledger import Ledger
+from models import PointsType
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'data' / 'users.json').write_text(json.dumps([
+        {'name': 'Alice', 'mana': 10, 'elixir': 0, 'trovo_id': 1, 'twitch_id': -1},
+        {'name': 'bob', 'mana': 0, 'elixir': 5, 'trovo_id': -1, 'twitch_id': 2},
+    ]))
+    db.init()
+    yield tmp_path
+    db.close()
+
+
+def test_find_user_by_name_is_case_insensitive():
+    assert db.find_user('ALICE').mana == 10
+    assert db.find_user('Bob').elixir == 5
+
+
+def test_find_user_by_platform_id_follows_renames():
+    alice = db.find_user('alice_renamed', trovo_id=1)
+    assert alice.name == 'alice_renamed' and alice.mana == 10
+    assert db.find_user('alice_renamed') is alice
+    assert db.find_user('bob_renamed', twitch_id=2).name == 'bob_renamed'
+    assert len(db.users) == 2
+
+
+def test_find_user_prefers_platform_id_over_name():
+    # someone else took the old nick of a renamed viewer
+    bob = db.find_user('Alice', twitch_id=2)
+    assert bob.elixir == 5
+    assert db.find_user('alice_new', trovo_id=1).mana == 10
+
+
+def test_same_nick_on_two_platforms_is_two_users():
+    twitch_alice = db.find_user('alice', twitch_id=7)
+    assert twitch_alice is not db.find_user('Alice', trovo_id=1)
+    assert twitch_alice.mana == 0 and twitch_alice.trovo_id == -1
+    assert db.find_user('alice') is db.find_user('Alice', trovo_id=1)  # the first one keeps the nick
+
+
+def test_find_user_creates_and_indexes_new_user():
+    user = db.find_user('Carol', trovo_id=3)
+    assert user in db.users
+    assert db.find_user('carol') is user
+    assert db.find_user('someone', trovo_id=3) is user
+
+
+def test_user_without_accounts_takes_the_first_id():
+    dave = db.find_user('dave')  # e.g. made by a donation
+    db.add_points(dave, 7, PointsType.Mana)
+    assert db.find_user('Dave', twitch_id=9) is dave
+    assert dave.twitch_id == 9
+    assert db.find_user('dave', trovo_id=4) is not dave
+
+
+def test_merge_moves_balance_accounts_and_nick(data_dir):
+    db.init(interval=60, threshold=1000)
+    twitch_alice = db.find_user('alice_tw', twitch_id=7)
+    db.add_points(twitch_alice, 3, PointsType.Mana)
+    alice = db.find_user('Alice', trovo_id=1)
+
+    db.merge(twitch_alice, alice)
+    assert (alice.mana, alice.trovo_id, alice.twitch_id) == (13, 1, 7)
+    assert db.find_user('whatever', twitch_id=7) is alice
+    assert db.find_user('alice_tw') is alice  # an alias now, e.g. for donations
+    assert twitch_alice not in db.users
+
+    # a message that still holds the merged user pays into the right balance
+    db.add_points(twitch_alice, 1, PointsType.Mana)
+    assert alice.mana == 14 and twitch_alice.mana == 0
+
+    db.init()  # a snapshot from before or after the merge, plus the ledger
+    reloaded = {id(user): user for user in (db.find_user('Alice', trovo_id=1), db.find_user('x', twitch_id=7))}
+    assert sum(user.mana for user in reloaded.values()) == 14
+
+
+def test_merge_removes_only_the_merged_user():
+    other = db.find_user('someone')
+    other.name = 'twin'
+    twin = db.find_user('twin', twitch_id=8)
+    db.merge(twin, db.find_user('Alice', trovo_id=1))
+    # both are now ('twin', 0, 0, -1, -1), == would remove the first of them
+    assert any(user is other for user in db.users)
+    assert not any(user is twin for user in db.users)
+
+
+def test_merge_refuses_two_accounts_on_one_platform():
+    with pytest.raises(ValueError):
+        db.merge(db.find_user('carol', trovo_id=3), db.find_user('Alice', trovo_id=1))
+    with pytest.raises(ValueError):
+        db.merge(db.find_user('alice'), db.find_user('Alice'))
+
+
+def test_spend_is_checked_and_taken_under_the_lock():
+    bob = db.find_user('bob', twitch_id=2)
+    spent = []
+
+    def worker():
+        for _ in range(100):
+            spent.append(db.spend(bob, 1, PointsType.Elixir))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert spent.count(True) == 5 and bob.elixir == 0
+
+
+def test_add_points_is_written_behind(data_dir):
+    db.init(interval=60, threshold=1000)
+    db.add_points(db.find_user('alice'), 5, PointsType.Mana)
+    saved = json.loads((data_dir / 'data' / 'users.json').read_text())
+    assert saved[0]['mana'] == 10
+
+    db.flush()
+    saved = json.loads((data_dir / 'data' / 'users.json').read_text())
+    assert saved['users'][0]['mana'] == 15
+    assert not list((data_dir / 'data').glob('*.tmp'))
+
+
+def test_close_flushes_pending_changes(data_dir):
+    db.add_points(db.find_user('bob'), 1, PointsType.Elixir)
+    db.close()
+    saved = json.loads((data_dir / 'data' / 'users.json').read_text())
+    assert saved['users'][1]['elixir'] == 6
+
+
+def test_unflushed_changes_are_replayed_from_ledger(data_dir):
+    db.init(interval=60, threshold=1000)
+    db.add_points(db.find_user('alice'), 5, PointsType.Mana, source='test')
+    db.add_points(db.find_user('dave'), 3, PointsType.Elixir, source='test')
+
+    db.init()  # users.json is still the old snapshot
+    assert db.find_user('alice').mana == 15
+    assert db.find_user('dave').elixir == 3
+
+
+def test_attached_account_is_replayed_before_its_records(data_dir, monkeypatch):
+    (data_dir / 'data' / 'users.json').write_text(json.dumps([
+        {'name': 'dave', 'mana': 7, 'elixir': 0, 'trovo_id': -1, 'twitch_id': -1},
+    ]))
+    db.init(interval=60, threshold=1000)
+    monkeypatch.setattr(db, 'flush', lambda: None)  # crashes before any snapshot
+    db.add_points(db.find_user('dave', twitch_id=9), 5, PointsType.Mana)  # keyed twitch:9
+
+    db.init()  # crashed before a snapshot with the account
+    assert db.find_user('dave', twitch_id=9).mana == 12
+    assert len(db.users) == 1
+
+
+def test_rename_is_replayed(data_dir, monkeypatch):
+    db.init(interval=60, threshold=1000)
+    monkeypatch.setattr(db, 'flush', lambda: None)
+    db.add_points(db.find_user('alice_new', trovo_id=1), 5, PointsType.Mana)
+
+    db.init()
+    assert [(user.name, user.mana) for user in db.users if user.trovo_id == 1] == [('alice_new', 15)]
+    assert db.find_user('alice_new').trovo_id == 1
+
+
+def test_merge_is_replayed(data_dir, monkeypatch):
+    db.init(interval=60, threshold=1000)
+    monkeypatch.setattr(db, 'flush', lambda: None)
+    donor = db.find_user('carol')  # a donation before carol linked her account
+    db.add_points(donor, 4, PointsType.Mana)
+    db.merge(donor, db.find_user('bob', twitch_id=2))
+    db.add_points(db.find_user('bob', twitch_id=2), 1, PointsType.Mana)
+
+    db.init()
+    assert db.find_user('x', twitch_id=2).mana == 5
+    assert db.find_user('carol') is db.find_user('x', twitch_id=2)  # through the alias
+    assert len(db.users) == 2
+
+
+def test_name_records_are_not_replayed_onto_a_user_with_an_account(data_dir):
+    # a donation to an accountless 'alice' is keyed by nick, the trovo Alice only answers to her id
+    (data_dir / 'data' / 'users.json').write_text(json.dumps([
+        {'name': 'Alice', 'mana': 10, 'elixir': 0, 'trovo_id': 1, 'twitch_id': -1},
+        {'name': 'alice', 'mana': 0, 'elixir': 0, 'trovo_id': -1, 'twitch_id': -1},
+    ]))
+    db.init(interval=60, threshold=1000)
+    donor = next(user for user in db.users if not user.accounts())
+    db.add_points(donor, 100, PointsType.Mana, source='donation')
+
+    db.init()
+    assert db.find_user('someone', trovo_id=1).mana == 10
+    assert next(user for user in db.users if not user.accounts()).mana == 100
+
+
+def test_snapshot_records_are_not_replayed_twice(data_dir):
+    db.add_points(db.find_user('alice'), 5, PointsType.Mana)
+    db.flush()
+
+    db.init()
+    assert db.find_user('alice').mana == 15
+
+
+def test_ledger_archives_big_segments(tmp_path):
+    ledger = Ledger(str(tmp_path), max_size=1)
+    ledger.open()
+    ledger.append('alice', 1, PointsType.Mana, 'a')
+    ledger.append('alice', 2, PointsType.Mana, 'b')
+    ledger.compact()
+    ledger.append('bob', 3, PointsType.Elixir, 'c')
+    ledger.close()
+
+    assert (tmp_path / 'points.000000000002.log').exists()
+    records = Ledger(str(tmp_path)).open(after_seq=1)
+    assert [(r.seq, r.key, r.delta, r.source) for r in records] == [(2, 'alice', 2, 'b'), (3, 'bob', 3, 'c')]
+
+
+def test_sqlite_engine_imports_json_and_loads_users_lazily(data_dir):
+    db.init(engine='sqlite', interval=60)
+    assert db.users == []
+
+    alice = db.find_user('alice')
+    assert alice.mana == 10
+    db.add_points(alice, 5, PointsType.Mana, source='test')
+    db.find_user('carol', twitch_id=9)
+    db.close()
+
+    db.init(engine='sqlite')
+    assert db.find_user('carol2', twitch_id=9).name == 'carol2'
+    assert db.find_user('ALICE').mana == 15
+    assert len(db.users) == 2
+
+
+def test_sqlite_account_on_disk_beats_a_nick_in_memory(data_dir):
+    (data_dir / 'data' / 'users.json').write_text(json.dumps([
+        {'name': 'old_nick', 'mana': 500, 'elixir': 0, 'trovo_id': -1, 'twitch_id': 2},
+    ]))
+    db.init(engine='sqlite', interval=60)
+    donor = db.find_user('new_nick')  # a donation under the new nick
+    db.add_points(donor, 10, PointsType.Mana)
+
+    user = db.find_user('new_nick', twitch_id=2)
+    assert user is not donor and user.mana == 500
+    assert donor.twitch_id == -1
+    db.close()
+
+    db.init(engine='sqlite')
+    assert db.find_user('x', twitch_id=2).mana == 500
+
+
+def test_sqlite_merge_deletes_the_merged_row(data_dir):
+    db.init(engine='sqlite', interval=60)
+    db.merge(db.find_user('bob', twitch_id=2), db.find_user('alice', trovo_id=1))
+    db.close()
+
+    db.init(engine='sqlite')
+    alice = db.find_user('x', twitch_id=2)
+    assert (alice.name, alice.mana, alice.elixir) == ('Alice', 10, 5)
+    assert db.find_user('bob') is alice
+
+
+def test_sqlite_merge_during_a_flush_deletes_the_new_row(data_dir, monkeypatch):
+    db.init(engine='sqlite', interval=60)
+    carol = db.find_user('carol', twitch_id=5)
+    storage = db._storage
+    write = storage.write
+
+    def merge_then_write(data):
+        # the flusher writes outside the db lock, a merge can come in between
+        db.merge(carol, db.find_user('alice', trovo_id=1))
+        monkeypatch.setattr(storage, 'write', write)
+        write(data)
+
+    monkeypatch.setattr(storage, 'write', merge_then_write)
+    db.flush()
+    db.close()
+
+    with closing(sqlite3.connect(data_dir / 'data' / 'users.sqlite3')) as conn:
+        assert conn.execute('SELECT name, trovo_id FROM users WHERE twitch_id = 5').fetchall() == [('Alice', 1)]
+
+
+def test_sqlite_backup_uses_online_backup(data_dir):
+    db.init(engine='sqlite')
+    db.backup()
+    backup, = (data_dir / 'backups').iterdir()
+    assert (backup / 'users.sqlite3').exists()
+    assert not (backup / 'users.sqlite3-wal').exists()
+
+
+def test_find_user_waits_for_background_init(data_dir, monkeypatch):
+    (data_dir / 'data' / 'users.json').write_text(json.dumps([
+        {'name': 'Alice', 'mana': 20, 'elixir': 0, 'trovo_id': 1, 'twitch_id': -1},
+    ]))
+    opening = threading.Event()
+    open_storage = db.JsonStorage.open
+
+    def slow_open(self):
+        opening.set()
+        time.sleep(0.2)
+        return open_storage(self)
+
+    monkeypatch.setattr(db.JsonStorage, 'open', slow_open)
+
+    async def main():
+        loaded = db.init_in_background()
+        await asyncio.to_thread(opening.wait)
+        # the old users are still indexed, without the wait this would be the stale Alice
+        assert db.find_user('Alice', trovo_id=1).mana == 20
+        await loaded
+
+    asyncio.run(main())
+
+
+def test_wait_ready_does_not_block_the_loop(monkeypatch):
+    open_storage = db.JsonStorage.open
+
+    def slow_open(self):
+        time.sleep(0.2)
+        return open_storage(self)
+
+    monkeypatch.setattr(db.JsonStorage, 'open', slow_open)
+
+    async def main():
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        task = asyncio.create_task(ticker())
+        loaded = db.init_in_background()
+        await db.wait_ready()
+        task.cancel()
+        await loaded
+        assert len(ticks) > 5  # the loop kept running while users loaded
+        assert db.find_user('Alice').mana == 10
+
+    asyncio.run(main())
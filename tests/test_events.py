@@ -0,0 +1,76 @@
+import asyncio
+import json
+import socket
+import threading
+
+import websockets
+
+import metrics
+from services import events
+
+
+def test_subscribers_get_their_types_and_stay_bounded():
+    async def run():
+        everything = events.subscribe()
+        donations = events.subscribe({'donation'}, maxsize=2)
+        try:
+            events.publish('factorio', effect='spawn_biters', user='alice')
+            for amount in (1, 2, 3):
+                events.publish('donation', user='bob', amount=amount)
+
+            # from a worker thread, like a command running in the executor
+            thread = threading.Thread(target=events.publish, args=('spell',), kwargs={'user': 'carol'})
+            thread.start()
+            thread.join()
+            await asyncio.sleep(0)
+
+            assert [event['type'] for event in [await everything.get() for _ in range(5)]] == \
+                ['factorio', 'donation', 'donation', 'donation', 'spell']
+            assert [(await donations.get())['amount'] for _ in range(2)] == [2, 3]
+            assert donations.dropped == 1
+        finally:
+            events.unsubscribe(everything)
+            events.unsubscribe(donations)
+
+    asyncio.run(run())
+
+
+def test_overlay_depth_is_summed_over_subscribers(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+
+    async def run():
+        donations = events.subscribe({'donation'})
+        spells = events.subscribe({'spell'})
+        try:
+            events.publish('donation', user='bob', amount=1)
+            events.publish('donation', user='bob', amount=2)
+            events.publish('spell', user='carol')
+            return metrics.render()
+        finally:
+            events.unsubscribe(donations)
+            events.unsubscribe(spells)
+
+    assert 'outbound_queue_depth{queue="Overlay"} 3' in asyncio.run(run())
+
+
+def test_websocket_server_pushes_events():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    async def run():
+        server = asyncio.create_task(events.serve(port=port))
+        await asyncio.sleep(0.1)
+        async with websockets.connect(f'ws://127.0.0.1:{port}/?types=donation') as ws:
+            await asyncio.sleep(0.05)
+            events.publish('timer', name='timer', text='00:10')
+            events.publish('donation', user='bob', amount=100)
+            event = json.loads(await ws.recv())
+        await asyncio.sleep(0.05)
+        assert not events._subscribers  # closed overlays are forgotten
+        server.cancel()
+        await asyncio.gather(server, return_exceptions=True)
+        return event
+
+    event = asyncio.run(run())
+    assert (event['type'], event['user'], event['amount']) == ('donation', 'bob', 100)
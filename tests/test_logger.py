@@ -0,0 +1,34 @@
+import logging
+
+import pytest
+
+import logger
+
+
+def test_parse_levels():
+    assert logger.parse_levels('services.trovo.frames=debug, db=WARNING,=ERROR') == {
+        'services.trovo.frames': logging.DEBUG,
+        'db': logging.WARNING,
+        '': logging.ERROR
+    }
+    assert logger.parse_levels('') == {}
+    with pytest.raises(ValueError):
+        logger.parse_levels('db=LOUD')
+
+
+def test_log_file_rotates_by_size_and_time(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    handler = logger.get_file_handler('test.log', max_bytes=200, backup_count=2)
+    record = logging.LogRecord('test', logging.INFO, __file__, 1, 'x' * 50, None, None)
+    try:
+        for _ in range(10):
+            handler.emit(record)
+        assert sorted(path.name for path in (tmp_path / 'logs').iterdir()) == ['test.log', 'test.log.1', 'test.log.2']
+
+        handler.rollover_at = 0  # midnight passed
+        size = (tmp_path / 'logs' / 'test.log').stat().st_size
+        handler.emit(record)
+        assert (tmp_path / 'logs' / 'test.log').stat().st_size < size
+        assert handler.rollover_at > 0
+    finally:
+        handler.close()
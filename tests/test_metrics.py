@@ -0,0 +1,72 @@
+import asyncio
+import socket
+
+import aiohttp
+import pytest
+
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    metrics.reset()
+    yield
+    metrics.reset()
+
+
+def test_disabled_metrics_record_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', False)
+    metrics.inc('commands_total', command='p')
+    with metrics.timer('rcon_seconds'):
+        pass
+    assert 'commands_total' not in metrics.render()
+    assert 'rcon_seconds' not in metrics.render()
+
+
+def test_render_prometheus_text():
+    metrics.inc('commands_total', command='points', result='ok')
+    metrics.inc('commands_total', command='points', result='ok')
+    metrics.observe('rcon_seconds', 0.003)
+    metrics.observe('rcon_seconds', 20)
+    metrics.gauge('outbound_queue_depth', lambda: 7, queue='test')
+
+    text = metrics.render()
+    assert '# TYPE commands_total counter' in text
+    assert 'commands_total{command="points",result="ok"} 2' in text
+    assert 'outbound_queue_depth{queue="test"} 7' in text
+    assert 'rcon_seconds_bucket{le="0.0025"} 0' in text
+    assert 'rcon_seconds_bucket{le="0.005"} 1' in text
+    assert 'rcon_seconds_bucket{le="+Inf"} 2' in text
+    assert 'rcon_seconds_count 2' in text
+    assert 'rcon_seconds: n=2' in metrics.summary()
+
+
+def test_big_values_are_exact():
+    metrics.inc('messages_received_total', 1234567, service='trovo')
+    metrics.inc('messages_received_total', service='trovo')
+    metrics.observe('db_flush_seconds', 1234567.125)
+
+    text = metrics.render()
+    assert 'messages_received_total{service="trovo"} 1234568\n' in text
+    assert 'db_flush_seconds_sum 1234567.125\n' in text
+    assert 'messages_received_total{service="trovo"}=1234568' in metrics.summary()
+
+
+def test_serve_metrics_endpoint():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    async def run():
+        metrics.inc('reconnects_total', service='trovo')
+        server = asyncio.create_task(metrics.serve(port=port))
+        await asyncio.sleep(0.1)
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'http://127.0.0.1:{port}/metrics') as r:
+                text = await r.text()
+        server.cancel()
+        await asyncio.gather(server, return_exceptions=True)
+        return text
+
+    assert 'reconnects_total{service="trovo"} 1' in asyncio.run(run())
@@ -0,0 +1,16 @@
+import pytest
+
+from models import ChatMessage, UserData
+
+
+def test_user_data_round_trip():
+    user = UserData('alice', 10, 5, 1, -1)
+    assert UserData.from_dict(user.to_dict()) == user
+    assert ChatMessage.from_dict(ChatMessage('!p', user, ['mod']).to_dict()).sender == user
+
+
+def test_models_have_no_instance_dict():
+    user = UserData('alice', 10, 5, 1, -1)
+    assert not hasattr(user, '__dict__')
+    with pytest.raises(AttributeError):
+        user.nickname = 'typo'
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+
+import metrics
+from services.outbound import ChatOutbox, OutboundQueue, RateLimit
+
+
+def test_consumer_wakes_up_on_put():
+    async def run():
+        queue = OutboundQueue('test')
+        queue.bind()
+        consumer = asyncio.create_task(queue.get())
+        await asyncio.sleep(0.01)
+        queue.put('hello')
+        return await asyncio.wait_for(consumer, 0.1)
+
+    assert asyncio.run(run()) == 'hello'
+
+
+def test_put_from_another_thread():
+    async def run():
+        queue = OutboundQueue('test')
+        queue.bind()
+        thread = threading.Thread(target=queue.put, args=('from thread',))
+        thread.start()
+        thread.join()
+        return await asyncio.wait_for(queue.get(), 0.1)
+
+    assert asyncio.run(run()) == 'from thread'
+
+
+def test_bounded_with_drop_oldest():
+    queue = OutboundQueue('test', maxsize=2)
+    for item in ['a', 'b', 'c']:
+        queue.put(item)
+    assert [item for item, _ in queue._items] == ['b', 'c']
+    assert queue.dropped == 1
+
+
+def test_only_keyed_items_are_coalesced():
+    queue = OutboundQueue('test')
+    queue.put('thanks bob')
+    queue.put('thanks bob')  # two real replies, both stay
+    queue.put('00:10', coalesce_key='timer')
+    queue.put('00:09', coalesce_key='timer')
+    queue.put('break 05:00', coalesce_key='break')
+    assert [item for item, _ in queue._items] == ['thanks bob', 'thanks bob', '00:09', 'break 05:00']
+
+
+def test_chat_outbox_sends_singly_while_budget_allows():
+    async def run():
+        outbox = ChatOutbox('test', RateLimit(messages=10, period=30, max_length=100))
+        outbox.put('one')
+        outbox.put('two')
+        return [await outbox.next_line(), await outbox.next_line()]
+
+    assert asyncio.run(run()) == ['one', 'two']
+
+
+def test_chat_outbox_packs_replies_when_budget_is_tight():
+    async def run(moderator: bool):
+        outbox = ChatOutbox('test', RateLimit(messages=2, period=30, max_length=40, mod_messages=10))
+        outbox.moderator = moderator
+        for msg in ['Add 5 mp to a', 'Add 5 mp to b', 'Add 5 mp to c', 'Add 5 mp to d', 'e']:
+            outbox.put(msg)
+        return [await outbox.next_line(), await outbox.next_line()], outbox
+
+    lines, outbox = asyncio.run(run(moderator=False))
+    assert lines == ['Add 5 mp to a | Add 5 mp to b', 'Add 5 mp to c | Add 5 mp to d | e']
+    assert outbox.stats()['coalesced'] == 3
+
+    lines, _ = asyncio.run(run(moderator=True))
+    assert lines == ['Add 5 mp to a', 'Add 5 mp to b']
+
+
+def test_drained_waits_until_everything_is_sent():
+    async def run():
+        queue = OutboundQueue('test')
+        queue.bind()
+        await asyncio.wait_for(queue.drained(), 0.1)
+
+        queue.put('a')
+        queue.put('b')
+        drained = asyncio.create_task(queue.drained())
+        assert await queue.get() == 'a'
+        queue.task_done()
+        assert await queue.get() == 'b'
+        await asyncio.sleep(0)
+        assert not drained.done()  # taken, but still being sent
+        queue.task_done()
+        await asyncio.wait_for(drained, 0.1)
+
+    asyncio.run(run())
+
+
+def test_chat_outbox_exports_its_stats(monkeypatch):
+    monkeypatch.setattr(metrics, 'enabled', True)
+    metrics.reset()
+
+    async def run():
+        outbox = ChatOutbox('test', RateLimit(messages=1, period=0.05, max_length=10))
+        for msg in ['one', 'two', 'three']:
+            outbox.put(msg)
+        return [await outbox.next_line(), await outbox.next_line()]
+
+    assert asyncio.run(run()) == ['one | two', 'three']
+    text = metrics.render()
+    metrics.reset()
+
+    assert 'outbound_sent_total{queue="test"} 2' in text
+    assert 'outbound_coalesced_total{queue="test"} 1' in text
+    assert 'outbound_latency_seconds_count{queue="test"} 3' in text
+    assert 'outbound_rate_limit_wait_seconds_count{queue="test"} 1' in text
@@ -0,0 +1,157 @@
+import asyncio
+
+import pytest
+
+from services.factorio.rcon import (
+    RconClient, RconError, RconAuthError, RconState, encode_packet, read_packet,
+    SERVERDATA_AUTH, SERVERDATA_AUTH_RESPONSE, SERVERDATA_RESPONSE_VALUE
+)
+
+
+class FakeRconServer:
+    def __init__(self, password: str = 'secret'):
+        self.password = password
+        self.commands = []
+        self.connections = 0
+        self.server = None
+        self.writers = []
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, '127.0.0.1', 0)
+
+    async def stop(self):
+        self.server.close()
+        self.drop()
+        await self.server.wait_closed()
+
+    def drop(self):
+        for writer in self.writers:
+            writer.close()
+        self.writers.clear()
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        self.writers.append(writer)
+        try:
+            request_id, packet_type, body = await read_packet(reader)
+            assert packet_type == SERVERDATA_AUTH
+            writer.write(encode_packet(request_id, SERVERDATA_RESPONSE_VALUE, ''))
+            ok = body == self.password
+            writer.write(encode_packet(request_id if ok else -1, SERVERDATA_AUTH_RESPONSE, ''))
+            if not ok:
+                writer.close()
+                return
+
+            while True:
+                request_id, _, body = await read_packet(reader)
+                self.commands.append(body)
+                asyncio.create_task(self._respond(writer, request_id, body))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    @staticmethod
+    async def _respond(writer, request_id: int, body: str):
+        # '/sleep N' answers late, so pipelined answers come back out of order
+        if body.startswith('/sleep'):
+            await asyncio.sleep(float(body.split()[1]))
+        writer.write(encode_packet(request_id, SERVERDATA_RESPONSE_VALUE, f'ran {body}'))
+
+
+async def connected_client(server: FakeRconServer, password: str = 'secret') -> tuple[RconClient, asyncio.Task]:
+    client = RconClient('127.0.0.1', server.port, password, timeout=2)
+    task = asyncio.create_task(client.run())
+    for _ in range(100):
+        if client.state == RconState.CONNECTED:
+            break
+        await asyncio.sleep(0.01)
+    return client, task
+
+
+def test_pipelined_commands_are_matched_by_id():
+    async def run():
+        server = FakeRconServer()
+        await server.start()
+        client, task = await connected_client(server)
+
+        results = await asyncio.gather(
+            client.execute('/sleep 0.1'),
+            client.execute('/sleep 0.05'),
+            client.execute('/fast')
+        )
+        assert results == ['ran /sleep 0.1', 'ran /sleep 0.05', 'ran /fast']
+        assert server.connections == 1
+
+        await client.close()
+        await task
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_connection_loss_ends_run_for_the_supervisor():
+    async def run():
+        server = FakeRconServer()
+        await server.start()
+        client, task = await connected_client(server)
+
+        pending = asyncio.create_task(client.execute('/sleep 1'))
+        await asyncio.sleep(0.05)
+        server.drop()
+        with pytest.raises(RconError):
+            await pending
+        with pytest.raises(RconError):
+            await task  # no retries of its own, the supervisor restarts it
+        assert client.state == RconState.DISCONNECTED
+
+        client, task = await connected_client(server)
+        assert await client.execute('/after') == 'ran /after'
+        assert server.connections == 2
+
+        await client.close()
+        await task
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_wrong_password_fails_fast():
+    async def run():
+        server = FakeRconServer()
+        await server.start()
+        client, task = await connected_client(server, password='wrong')
+        await asyncio.sleep(0.05)
+
+        assert client.state != RconState.CONNECTED
+        assert client.health()['last_error'] == 'wrong password'
+        with pytest.raises(RconError):
+            await client.execute('/anything')
+
+        with pytest.raises(RconAuthError):
+            await task
+        await client.close()
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_execute_from_another_loop_runs_on_the_client_loop():
+    async def run():
+        server = FakeRconServer()
+        await server.start()
+        client, task = await connected_client(server)
+
+        # twitchAPI calls in from its own loop in another thread
+        start = asyncio.get_running_loop().time()
+        result = await asyncio.to_thread(asyncio.run, client.execute('/from_twitch'))
+        assert result == 'ran /from_twitch'
+        assert asyncio.get_running_loop().time() - start < 1
+
+        await client.close()
+        await task
+        await server.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,20 @@
+import asyncio
+
+import commands
+import db
+from benchmarks.pipeline import replay, synthetic_events
+
+
+def test_replay_harness_runs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    db.init(interval=60)
+    try:
+        result = asyncio.run(replay(synthetic_events(50)))
+    finally:
+        db.close()
+        commands.disable_module('factorio')
+
+    assert result['events'] == 50
+    assert result['messages'] >= 50
+    assert result['rcon_calls'] > 0
+    assert result['p99_ms'] >= result['p50_ms'] > 0
@@ -0,0 +1,64 @@
+import asyncio
+import time
+
+from services.factorio.scheduler import EffectScheduler, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=2, burst=2)
+    now = bucket.updated
+    bucket.take(now)
+    bucket.take(now)
+    assert bucket.delay(now) == 0.5
+    assert bucket.delay(now + 0.5) == 0
+
+
+def test_users_are_served_round_robin():
+    async def run():
+        scheduler = EffectScheduler({}, rate=100, burst=1, default_limit=(100, 1))
+        order = []
+
+        async def effect(user: str):
+            await scheduler.acquire('spawn', user)
+            order.append(user)
+
+        tasks = [asyncio.create_task(effect(user)) for user in ['rich', 'rich', 'rich', 'poor', 'other']]
+        await asyncio.sleep(0)
+        assert scheduler.depth == 4  # the first one went through the burst
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ['rich', 'rich', 'poor', 'other', 'rich']
+
+
+def test_limited_kind_does_not_block_other_kinds():
+    async def run():
+        scheduler = EffectScheduler({'spawners': (0.01, 1)}, rate=100, burst=10)
+        await scheduler.acquire('spawners', 'a')
+        waiting = asyncio.create_task(scheduler.acquire('spawners', 'a'))
+        await asyncio.wait_for(scheduler.acquire('biters', 'b'), 0.5)
+        assert [request.kind for request in scheduler.backlog()] == ['spawners']
+
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        assert scheduler.depth == 0
+
+    asyncio.run(run())
+
+
+def test_cancelled_waiter_is_skipped():
+    async def run():
+        scheduler = EffectScheduler({}, rate=100, burst=1, default_limit=(20, 1))
+        await scheduler.acquire('spawn', 'a')
+        first = asyncio.create_task(scheduler.acquire('spawn', 'a'))
+        second = asyncio.create_task(scheduler.acquire('spawn', 'b'))
+        await asyncio.sleep(0)
+        time.sleep(0.1)  # both are due, the timer hasn't fired yet
+        # cancelled, but its task hasn't run yet to take it out of the queue
+        first.cancel()
+        scheduler._schedule()
+        await asyncio.wait_for(second, 0.5)
+        await asyncio.gather(first, return_exceptions=True)
+        assert scheduler.depth == 0
+
+    asyncio.run(run())
@@ -0,0 +1,32 @@
+import os
+import subprocess
+import sys
+
+import startup
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_report_lists_phases_in_order():
+    startup.reset()
+    startup.mark('env')
+    startup.mark('db')
+    startup.mark('env')  # a later mark of the same phase is ignored
+    startup.first_message('trovo')
+    startup.first_message('twitch')
+
+    phases = list(startup.marks())
+    assert phases == ['env', 'db', 'trovo first message']
+    report = startup.report()
+    assert report.index('env') < report.index('db') < report.index('trovo first message')
+
+
+def test_import_main_is_lazy_and_does_no_io(tmp_path):
+    # run in an empty directory, any file written on import shows up there
+    code = ('import sys, main; '
+            'print(",".join(m for m in ("twitchAPI", "socketio", "aiohttp") if m in sys.modules))')
+    result = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, capture_output=True, text=True,
+                            env={**os.environ, 'PYTHONPATH': root, 'PYTHONDONTWRITEBYTECODE': '1'})
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ''
+    assert list(tmp_path.iterdir()) == []
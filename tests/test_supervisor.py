@@ -0,0 +1,65 @@
+import asyncio
+
+from services.supervisor import RestartPolicy, ServiceState, Supervisor
+
+fast = RestartPolicy(min_backoff=0.001, max_backoff=0.01, failure_threshold=3, cooldown=0.2, healthy_after=60)
+
+
+def test_failing_service_is_restarted_until_the_circuit_opens():
+    async def run():
+        runs = []
+
+        async def flaky():
+            runs.append(1)
+            raise ConnectionError('socket closed')
+
+        supervisor = Supervisor(fast)
+        supervisor.add('flaky', flaky)
+        task = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.1)
+
+        health = supervisor.health()['flaky']
+        assert len(runs) == 3
+        assert health['state'] == ServiceState.OPEN.value
+        assert health['last_error'] == 'socket closed'
+
+        await asyncio.sleep(0.2)
+        assert len(runs) == 4  # one try after the cooldown, it fails and opens the circuit again
+        assert supervisor.health()['flaky']['state'] == ServiceState.OPEN.value
+
+        supervisor.stop()
+        await task
+        assert supervisor.health()['flaky']['state'] == ServiceState.STOPPED.value
+
+    asyncio.run(run())
+
+
+def test_stop_cancels_services_and_one_shot_jobs_are_not_restarted():
+    async def run():
+        cancelled = []
+        jobs = []
+
+        async def forever():
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        async def job():
+            jobs.append(1)
+
+        supervisor = Supervisor(fast)
+        supervisor.add('forever', forever)
+        supervisor.add('job', job, RestartPolicy(restart=False))
+        task = asyncio.create_task(supervisor.run())
+        await asyncio.sleep(0.05)
+        assert supervisor.health()['forever']['state'] == ServiceState.RUNNING.value
+        assert supervisor.health()['job']['state'] == ServiceState.DONE.value
+
+        supervisor.stop()
+        await task
+        assert cancelled == [1]
+        assert jobs == [1]
+
+    asyncio.run(run())
@@ -0,0 +1,113 @@
+import asyncio
+import socket
+import threading
+from time import monotonic
+
+import aiohttp
+import pytest
+
+from commands import timer
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # absolute, a write still in its thread after the test must not land in the repo
+    (tmp_path / 'data').mkdir()
+    monkeypatch.setattr(timer.db, 'save', lambda filename, text: (tmp_path / 'data' / filename).write_text(text))
+    monkeypatch.setattr(timer.Countdown, 'hold', 0.2)
+    monkeypatch.setattr(timer, '_timers', {})
+    return tmp_path
+
+
+def test_clear_files_empties_countdowns_of_the_last_run(data_dir):
+    (data_dir / 'data' / 'timer_break.txt').write_text('00:05')
+    (data_dir / 'data' / 'users.json').write_text('[]')
+    timer.clear_files()
+    assert (data_dir / 'data' / 'timer.txt').read_text() == ''
+    assert (data_dir / 'data' / 'timer_break.txt').read_text() == ''
+    assert (data_dir / 'data' / 'users.json').read_text() == '[]'
+
+
+def test_countdown_writes_only_changes(data_dir, monkeypatch):
+    writes = []
+    save = timer.db.save
+
+    def recording_save(filename, text):
+        writes.append((filename, text))
+        save(filename, text)
+
+    monkeypatch.setattr(timer.db, 'save', recording_save)
+
+    async def run():
+        countdown = timer.get_timer()
+        updates = countdown.subscribe()
+        countdown.start(2.5)
+        await asyncio.sleep(3)
+        seen = []
+        while not updates.empty():
+            seen.append(updates.get_nowait())
+        return seen
+
+    seen = asyncio.run(run())
+    assert [text for _, text in writes] == ['00:02', '00:01', '00:00', '']
+    assert {filename for filename, _ in writes} == {'timer.txt'}
+    assert seen == ['']  # a slow subscriber keeps only the latest text
+    assert (data_dir / 'data' / 'timer.txt').read_text() == ''
+
+
+def test_named_timers_run_concurrently(data_dir):
+    async def run():
+        timer.get_timer('break').start(60)
+        timer.get_timer().start(125)
+        await asyncio.sleep(0.1)
+        texts = (data_dir / 'data' / 'timer_break.txt').read_text(), (data_dir / 'data' / 'timer.txt').read_text()
+        timer.get_timer('break').stop()
+        timer.get_timer().stop()
+        await asyncio.sleep(0.1)
+        return texts
+
+    assert asyncio.run(run()) == ('00:59', '02:04')
+    assert (data_dir / 'data' / 'timer_break.txt').read_text() == ''
+
+
+def test_overlay_streams_timer_text(data_dir):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+
+    async def run():
+        server = asyncio.create_task(timer.serve_overlay(port=port))
+        await asyncio.sleep(0.1)
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'http://127.0.0.1:{port}/timers/timer') as r:
+                assert await r.content.readline() == b'data: \n'
+                await r.content.readline()
+                timer.get_timer().start(90)
+                assert await r.content.readline() == b'data: 01:29\n'
+            async with session.get(f'http://127.0.0.1:{port}/timers/timer/overlay') as r:
+                assert "EventSource('/timers/timer')" in await r.text()
+        timer.get_timer().stop()
+        server.cancel()
+        await asyncio.gather(server, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+def test_subscriber_on_another_loop_gets_updates():
+    async def run():
+        countdown = timer.get_timer()
+        updates = countdown.subscribe()
+        assert updates.get_nowait() == ''
+
+        getter = asyncio.create_task(updates.get())
+        await asyncio.sleep(0)
+        # a timer started from a twitch command shows on twitchAPI's loop
+        thread = threading.Thread(target=asyncio.run, args=(countdown._show('00:02'),))
+        start = monotonic()
+        thread.start()
+        assert await asyncio.wait_for(getter, 2) == '00:02'
+        assert monotonic() - start < 0.5
+        thread.join()
+
+    asyncio.run(run())
@@ -0,0 +1,212 @@
+import asyncio
+from time import time
+
+import pytest
+from aiohttp import web
+
+from services.trovo.api import TrovoApi, TrovoApiError
+
+
+class FakeTrovoServer:
+    def __init__(self):
+        self.requests = []
+        self.peers = set()
+        self.failures = 0
+        self.token = 'old'
+        self.refreshes = 0
+        self.refresh_error = False
+        self.html_status = 0
+        self.runner = None
+        self.url = ''
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post('/chat/send', self._send)
+        app.router.add_post('/revoke', self._revoke)
+        app.router.add_post('/refreshtoken', self._refresh)
+        app.router.add_get('/channel', self._channel)
+        app.router.add_get('/validate', self._validate)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f'http://127.0.0.1:{self.runner.addresses[0][1]}'
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def _track(self, request):
+        self.requests.append(request.path)
+        self.peers.add(request.transport.get_extra_info('peername'))
+
+    async def _send(self, request):
+        self._track(request)
+        if self.failures:
+            self.failures -= 1
+            return web.Response(status=502)
+        if request.headers['Authorization'] != f'OAuth {self.token}':
+            return web.json_response({'error': 'accessTokenExpired'})
+        return web.json_response({})
+
+    async def _revoke(self, request):
+        self._track(request)
+        return web.json_response({})
+
+    async def _refresh(self, request):
+        self._track(request)
+        await asyncio.sleep(0.05)
+        self.refreshes += 1
+        if self.refresh_error:
+            return web.json_response({'error': 'invalid refresh token', 'status': 11101})
+        return web.json_response({
+            'access_token': self.token,
+            'refresh_token': f'refresh{self.refreshes}',
+            'expires_in': 3600
+        })
+
+    async def _validate(self, request):
+        self._track(request)
+        if request.headers['Authorization'] != f'OAuth {self.token}':
+            return web.json_response({'error': 'invalid token'})
+        return web.json_response({'expire_ts': int(time()) + 3600})
+
+    async def _channel(self, request):
+        self._track(request)
+        if self.failures:
+            self.failures -= 1
+            return web.Response(status=502)
+        if self.html_status:
+            return web.Response(status=self.html_status, text='<html>Too Many Requests</html>',
+                                content_type='text/html')
+        return web.json_response({'channel_id': '42'})
+
+
+async def make_api() -> tuple[TrovoApi, FakeTrovoServer]:
+    server = FakeTrovoServer()
+    await server.start()
+    api = TrovoApi('client', 'secret', 'http://localhost')
+    api.api_url = server.url
+    api.bot.access_token = api.channel.access_token = 'old'
+    api.bot.refresh_token = 'refresh0'
+    return api, server
+
+
+def test_retries_server_errors():
+    async def run():
+        api, server = await make_api()
+        server.failures = 2
+        assert (await api.get_channel_info())['channel_id'] == '42'
+        assert server.requests == ['/channel'] * 3
+
+        server.failures = 3
+        with pytest.raises(TrovoApiError):
+            await api.get_channel_info()
+
+        await api.close()
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_sent_message_is_not_retried():
+    async def run():
+        api, server = await make_api()
+        server.failures = 1  # the line may have reached chat before the 502
+        with pytest.raises(TrovoApiError):
+            await api.send_message('hello')
+        assert server.requests == ['/chat/send']
+
+        await api.close()
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_html_error_page_is_an_api_error():
+    async def run():
+        api, server = await make_api()
+        server.html_status = 429
+        with pytest.raises(TrovoApiError, match='HTTP 429'):
+            await api.get_channel_info()
+
+        await api.close()
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_concurrent_sends_share_one_refresh():
+    async def run():
+        api, server = await make_api()
+        server.token = 'new'
+        await asyncio.gather(*(api.send_message(f'msg {i}') for i in range(5)))
+
+        assert server.refreshes == 1
+        assert server.requests.count('/refreshtoken') == 1
+        assert api.bot.access_token == 'new'
+        assert api.bot.refresh_token == 'refresh1'
+
+        await api.close()
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_connection_is_reused():
+    async def run():
+        api, server = await make_api()
+        for i in range(5):
+            await api.send_message(f'msg {i}')
+        assert (await api.get_channel_info())['channel_id'] == '42'
+        assert len(server.peers) == 1
+
+        await api.close()
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_auth_is_cached_until_expiry():
+    async def run():
+        api, server = await make_api()
+        api.channel.refresh_token = 'refresh0'
+        assert await api.auth()
+        assert sorted(server.requests) == ['/channel', '/validate', '/validate']
+        assert api.channel_id == '42'
+
+        server.requests.clear()
+        assert await api.auth()
+        assert server.requests == []
+
+        # close to expiry it is checked again and refreshed once the server rejects it
+        saved = []
+        api.on_refresh = lambda: saved.append(api.bot.access_token)
+        api.bot.expire_ts = int(time()) + 10
+        server.token = 'new'
+        assert await api.auth()
+        assert server.requests == ['/validate', '/refreshtoken', '/revoke']
+        assert saved == ['new']
+        assert api.bot.expire_ts > time() + 3000
+
+        await api.close()
+        await server.stop()
+
+    asyncio.run(run())
+
+
+def test_failed_refresh_keeps_the_old_tokens():
+    async def run():
+        api, server = await make_api()
+        saved = []
+        api.on_refresh = lambda: saved.append(api.bot.refresh_token)
+        server.refresh_error = True
+
+        assert not await api.refresh(api.bot)
+        assert (api.bot.access_token, api.bot.refresh_token) == ('old', 'refresh0')
+        assert saved == []
+        assert '/revoke' not in server.requests
+
+        await api.close()
+        await server.stop()
+
+    asyncio.run(run())
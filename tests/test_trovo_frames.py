@@ -0,0 +1,25 @@
+import json
+
+from services.trovo._chat_message import TrovoChatMessageType
+from services.trovo._frames import decode_frame, new_chats
+
+
+def test_decode_frame_skips_old_chats():
+    frame = decode_frame(json.dumps({'type': 'CHAT', 'data': {'chats': [
+        {'type': 0, 'content': 'old', 'nick_name': 'a', 'sender_id': 1, 'send_time': 99},
+        {'type': 5, 'content': 'new', 'nick_name': 'b', 'sender_id': 2, 'send_time': 100, 'roles': ['mod']},
+    ]}}))
+    assert frame.type == 'CHAT'
+    assert frame.error == 'None'
+
+    chats, old = new_chats(frame, 100)
+    assert old == 1
+    msg, = chats
+    assert (msg.content, msg.sender_id, msg.roles) == ('new', 2, ['mod'])
+    assert msg.type == TrovoChatMessageType.SPELLS
+
+
+def test_decode_frame_without_chats():
+    frame = decode_frame(b'{"type": "PONG", "nonce": "x", "data": {"gap": 30}}')
+    assert frame.data == {'gap': 30}
+    assert new_chats(frame, 0) == ([], 0)
@@ -0,0 +1,68 @@
+import asyncio
+
+from services.trovo.api import TrovoApiError
+from services.trovo.resolver import TrovoUserResolver
+
+
+class FakeApi:
+    def __init__(self, known: dict[str, int]):
+        self.known = known
+        self.calls = []
+        self.fail = False
+
+    async def get_users(self, user_names: list) -> dict:
+        self.calls.append(sorted(user_names))
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise TrovoApiError('down')
+        # the documented getusers shape, chat shows the nickname and the login name differs
+        users = [
+            {'user_id': str(self.known[name.lower()]), 'username': f'{name.lower()}_login',
+             'nickname': name, 'channel_id': str(100 + self.known[name.lower()])}
+            for name in user_names if name.lower() in self.known
+        ]
+        return {'total': len(users), 'users': users}
+
+
+def test_lookups_in_one_window_share_one_call():
+    async def run():
+        api = FakeApi({'alice': 1, 'bob': 2})
+        resolver = TrovoUserResolver(api, window=0.05)
+        results = await asyncio.gather(*(resolver.resolve(name) for name in ['Alice', 'bob', 'alice', 'ghost']))
+        assert results == [1, 2, 1, 0]
+        assert api.calls == [['alice', 'bob', 'ghost']]
+
+        # cached, unknown names too
+        assert await resolver.resolve('ALICE') == 1
+        assert await resolver.resolve('ghost') == 0
+        assert len(api.calls) == 1
+
+    asyncio.run(run())
+
+
+def test_remembered_senders_need_no_call():
+    async def run():
+        api = FakeApi({})
+        resolver = TrovoUserResolver(api, window=0.01)
+        resolver.remember('Carol', 3)
+        assert await resolver.resolve('carol') == 3
+        assert api.calls == []
+
+    asyncio.run(run())
+
+
+def test_cache_is_bounded_and_errors_are_not_cached():
+    async def run():
+        api = FakeApi({'alice': 1})
+        resolver = TrovoUserResolver(api, window=0.01, cache_size=2)
+        for i in range(5):
+            resolver.remember(f'user{i}', i + 10)
+        assert len(resolver._cache) == 2
+
+        api.fail = True
+        assert await resolver.resolve('alice') == 0
+        api.fail = False
+        assert await resolver.resolve('alice') == 1
+        assert len(api.calls) == 2
+
+    asyncio.run(run())
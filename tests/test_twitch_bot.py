@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from services.twitch.bot import TwitchBot
+
+
+class FakeChat:
+    def __init__(self, states: list[bool]):
+        self.states = states
+
+    def is_connected(self) -> bool:
+        return self.states.pop(0) if len(self.states) > 1 else self.states[0]
+
+
+def make_bot(states: list[bool]) -> TwitchBot:
+    bot = TwitchBot('client', 'secret', 'http://localhost:17563', 'channel')
+    bot.keepalive_gap = 0.01
+    bot.reconnect_grace = 0.05
+    bot.chat = FakeChat(states)
+    return bot
+
+
+def test_short_reconnect_is_left_to_the_chat():
+    async def run():
+        bot = make_bot([True, False, False, True])
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(bot._watch_connection(), 0.2)
+
+    asyncio.run(run())
+
+
+def test_chat_that_stays_down_is_given_up():
+    async def run():
+        bot = make_bot([True, False])
+        with pytest.raises(ConnectionError):
+            await asyncio.wait_for(bot._watch_connection(), 1)
+
+    asyncio.run(run())